@@ -0,0 +1,154 @@
+"""Benchmarks of representative morph chains and their refinement."""
+
+import numpy
+
+from diffpy.morph.morph_helpers.transformpdftordf import TransformXtalPDFtoRDF
+from diffpy.morph.morph_helpers.transformrdftopdf import TransformXtalRDFtoPDF
+from diffpy.morph.morphs.morphchain import MorphChain
+from diffpy.morph.morphs.morphresolution import MorphResolutionDamping
+from diffpy.morph.morphs.morphrgrid import MorphRGrid
+from diffpy.morph.morphs.morphscale import MorphScale
+from diffpy.morph.morphs.morphshape import MorphSphere
+from diffpy.morph.morphs.morphshift import MorphShift
+from diffpy.morph.morphs.morphsmear import MorphSmear
+from diffpy.morph.morphs.morphsqueeze import MorphSqueeze
+from diffpy.morph.morphs.morphstretch import MorphStretch
+from diffpy.morph.refine import Refiner
+
+from .synthetic import baselineslope, synthetic_pdf, synthetic_rdf
+
+RMAX = 100.0
+GRID = dict(xmin=None, xmax=None, xstep=None)
+
+
+def scale_stretch_smear():
+    """The chain of --scale --stretch --smear."""
+    config = dict(scale=1.1, stretch=0.005, smear=0.05, **GRID)
+    return MorphChain(
+        config, MorphScale(), MorphStretch(), MorphSmear(), MorphRGrid()
+    )
+
+
+def pdf_smear():
+    """The chain of --scale --stretch --smear-pdf."""
+    config = dict(scale=1.1, stretch=0.005, smear=0.05, **GRID)
+    config["baselineslope"] = baselineslope()
+    return MorphChain(
+        config,
+        MorphScale(),
+        MorphStretch(),
+        TransformXtalPDFtoRDF(),
+        MorphSmear(),
+        TransformXtalRDFtoPDF(),
+        MorphRGrid(),
+    )
+
+
+def nanoparticle():
+    """The chain of a nanoparticle with a limited Q resolution."""
+    config = dict(scale=1.1, stretch=0.005, smear=0.05, **GRID)
+    config.update(radius=30.0, qdamp=0.02)
+    return MorphChain(
+        config,
+        MorphScale(),
+        MorphStretch(),
+        MorphSmear(),
+        MorphSphere(),
+        MorphResolutionDamping(),
+        MorphRGrid(),
+    )
+
+
+def squeeze_shift():
+    """The chain of --squeeze --scale --hshift --vshift."""
+    config = dict(squeeze={"a0": 0.01, "a1": 0.001, "a2": 1e-5}, **GRID)
+    config.update(scale=1.1, hshift=0.05, vshift=0.1)
+    return MorphChain(
+        config, MorphSqueeze(), MorphScale(), MorphShift(), MorphRGrid()
+    )
+
+
+CHAINS = {
+    "scale-stretch-smear": scale_stretch_smear,
+    "pdf-smear": pdf_smear,
+    "nanoparticle": nanoparticle,
+    "squeeze-shift": squeeze_shift,
+}
+
+
+class TimeChain:
+    """Time MorphChain evaluations with the stages fused or not."""
+
+    params = (list(CHAINS), [1000, 10000, 100000, 1000000], [False, True])
+    param_names = ["chain", "npoints", "fused"]
+
+    def setup(self, name, npoints, fused):
+        self.chain = CHAINS[name]()
+        # Time every stage on each call
+        self.chain.memo_size = 0
+        self.chain.fuse_maps = fused
+        self.chain.fuse_envelopes = fused
+        x = numpy.linspace(0.5, RMAX, npoints)
+        y = synthetic_pdf(x)
+        self.xyall = (x, y, x.copy(), y.copy())
+        self.chain(*self.xyall)
+        self.pars = [
+            (p, None)
+            for p in ["scale", "stretch", "smear"]
+            if p in self.chain.config
+        ]
+
+    def time_morph(self, name, npoints, fused):
+        self.chain(*self.xyall)
+
+    def time_jacobian(self, name, npoints, fused):
+        npoints = len(self.xyall[0])
+        dy_morph = numpy.zeros((npoints, len(self.pars)))
+        dy_target = numpy.zeros((npoints, len(self.pars)))
+        self.chain.jacobian(self.pars, dy_morph, dy_target)
+
+
+# The residual of each refinement mode of the Refiner
+RESIDUALS = ["residual", "pearson", "addpearson", "separable"]
+# Morph parameters of the refined target and initial values
+KNOWN = dict(scale=1.1, stretch=0.007, smear=0.03)
+INITIAL = dict(scale=1.0, stretch=0.0, smear=0.01)
+
+
+class TimeRefine:
+    """Time Refiner.refine of scale, stretch and smear with each
+    residual type."""
+
+    params = (RESIDUALS, [1000, 10000, 100000])
+    param_names = ["residual", "npoints"]
+    timeout = 300
+
+    def setup(self, residual, npoints):
+        x = numpy.linspace(0.5, 30.0, npoints)
+        self.xyall = (x, synthetic_rdf(x), x, synthetic_rdf(x, **KNOWN))
+        self.refine(residual)
+
+    def refine(self, residual):
+        config = dict(INITIAL, **GRID)
+        chain = MorphChain(
+            config, MorphScale(), MorphStretch(), MorphSmear(), MorphRGrid()
+        )
+        refiner = Refiner(chain, *self.xyall)
+        pars = ["scale", "stretch", "smear"]
+        if residual == "pearson":
+            # The Pearson coefficient does not depend on the scale
+            refiner.residual = refiner._pearson
+            pars.remove("scale")
+        elif residual == "addpearson":
+            refiner.residual = refiner._add_pearson
+        refiner.refine(*pars, separable=residual == "separable")
+        return config
+
+    def time_refine(self, residual, npoints):
+        self.refine(residual)
+
+    def track_stretch_error(self, residual, npoints):
+        """Error of the refined stretch from the known stretch."""
+        return abs(self.refine(residual)["stretch"] - KNOWN["stretch"])
+
+    track_stretch_error.unit = "stretch"
@@ -0,0 +1,12 @@
+"""Benchmarks of importing the command line application."""
+
+
+def timeraw_import_morphapp():
+    """Time a fresh import of diffpy.morph.morphapp, which must not load
+    the plotting, fitting and file parsing modules."""
+    return "import diffpy.morph.morphapp"
+
+
+def timeraw_import_morph_api():
+    """Time a fresh import of diffpy.morph.morph_api."""
+    return "import diffpy.morph.morph_api"
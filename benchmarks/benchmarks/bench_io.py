@@ -0,0 +1,62 @@
+"""Benchmarks of reading files and of morphing a directory of files."""
+
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy
+
+from diffpy.morph.morphapp import create_option_parser, multiple_targets
+from diffpy.morph.tools import read_two_column
+
+from .synthetic import synthetic_pdf, write_series
+
+
+class TimeReadTwoColumn:
+    """Time tools.read_two_column on files of 1e4 to 1e6 points."""
+
+    params = [10000, 100000, 1000000]
+    param_names = ["npoints"]
+    timeout = 300
+
+    def setup(self, npoints):
+        self.directory = Path(tempfile.mkdtemp())
+        self.filename = self.directory / "data.gr"
+        x = numpy.linspace(0.5, 100.0, npoints)
+        header = "# Synthetic PDF of fcc nickel\n# r G"
+        numpy.savetxt(
+            self.filename,
+            numpy.column_stack([x, synthetic_pdf(x)]),
+            header=header,
+            comments="",
+        )
+
+    def teardown(self, npoints):
+        shutil.rmtree(self.directory)
+
+    def time_read_two_column(self, npoints):
+        read_two_column(self.filename)
+
+
+class TimeMultipleTargets:
+    """Time diffpy.morph --multiple-targets over N synthetic targets."""
+
+    params = ([10, 50], [1, 4])
+    param_names = ["nfiles", "jobs"]
+    timeout = 600
+
+    def setup(self, nfiles, jobs):
+        self.directory = Path(tempfile.mkdtemp())
+        morph_file, _ = write_series(self.directory, nfiles, 2000)
+        self.parser = create_option_parser()
+        self.opts, _ = self.parser.parse_args(
+            ["--multiple-targets", "--scale=1", "--stretch=0", "--smear=0.01"]
+            + ["-n", f"--jobs={jobs}"]
+        )
+        self.pargs = [morph_file, self.directory / "targets"]
+
+    def teardown(self, nfiles, jobs):
+        shutil.rmtree(self.directory)
+
+    def time_multiple_targets(self, nfiles, jobs):
+        multiple_targets(self.parser, self.opts, self.pargs, stdout_flag=False)
@@ -0,0 +1,94 @@
+"""Benchmarks of each morph on grids of 1e3 to 1e6 points."""
+
+import numpy
+
+from diffpy.morph.morph_helpers.transformpdftordf import TransformXtalPDFtoRDF
+from diffpy.morph.morph_helpers.transformrdftopdf import TransformXtalRDFtoPDF
+from diffpy.morph.morphs.morphfuncx import MorphFuncx
+from diffpy.morph.morphs.morphfuncxy import MorphFuncxy
+from diffpy.morph.morphs.morphfuncy import MorphFuncy
+from diffpy.morph.morphs.morphishape import MorphISphere, MorphISpheroid
+from diffpy.morph.morphs.morphresolution import MorphResolutionDamping
+from diffpy.morph.morphs.morphrgrid import MorphRGrid
+from diffpy.morph.morphs.morphscale import MorphScale
+from diffpy.morph.morphs.morphshape import MorphSphere, MorphSpheroid
+from diffpy.morph.morphs.morphshift import MorphShift
+from diffpy.morph.morphs.morphsmear import MorphSmear
+from diffpy.morph.morphs.morphsqueeze import MorphSqueeze
+from diffpy.morph.morphs.morphstretch import MorphStretch
+
+from .synthetic import baselineslope, synthetic_pdf
+
+SIZES = [1000, 10000, 100000, 1000000]
+RMAX = 100.0
+
+
+def funcx(x, y, stretch):
+    return x * (1 + stretch)
+
+
+def funcy(x, y, scale, offset):
+    return scale * y + offset
+
+
+def funcxy(x, y, stretch, scale):
+    return x * (1 + stretch), scale * y
+
+
+# Morph class and configuration of each benchmarked morph
+MORPHS = {
+    "MorphRGrid": (MorphRGrid, dict(xmin=1.0, xmax=RMAX - 1, xstep=0.01)),
+    "MorphScale": (MorphScale, dict(scale=1.1)),
+    "MorphStretch": (MorphStretch, dict(stretch=0.005)),
+    "MorphSmear": (MorphSmear, dict(smear=0.05)),
+    "MorphShift": (MorphShift, dict(hshift=0.05, vshift=0.1)),
+    "MorphSqueeze": (
+        MorphSqueeze,
+        dict(squeeze={"a0": 0.01, "a1": 0.001, "a2": 1e-5}),
+    ),
+    "MorphResolutionDamping": (MorphResolutionDamping, dict(qdamp=0.02)),
+    "MorphSphere": (MorphSphere, dict(radius=30.0)),
+    "MorphSpheroid": (MorphSpheroid, dict(radius=30.0, pradius=40.0)),
+    "MorphISphere": (MorphISphere, dict(iradius=30.0)),
+    "MorphISpheroid": (MorphISpheroid, dict(iradius=30.0, ipradius=40.0)),
+    "MorphFuncx": (
+        MorphFuncx,
+        dict(funcx_function=funcx, funcx={"stretch": 0.005}),
+    ),
+    "MorphFuncy": (
+        MorphFuncy,
+        dict(funcy_function=funcy, funcy={"scale": 1.1, "offset": 0.1}),
+    ),
+    "MorphFuncxy": (
+        MorphFuncxy,
+        dict(funcxy_function=funcxy, funcxy={"stretch": 0.005, "scale": 1.1}),
+    ),
+    "TransformXtalPDFtoRDF": (
+        TransformXtalPDFtoRDF,
+        dict(baselineslope=baselineslope()),
+    ),
+    "TransformXtalRDFtoPDF": (
+        TransformXtalRDFtoPDF,
+        dict(baselineslope=baselineslope()),
+    ),
+}
+
+
+class TimeMorph:
+    """Time Morph.morph of each morph."""
+
+    params = (list(MORPHS), SIZES)
+    param_names = ["morph", "npoints"]
+
+    def setup(self, name, npoints):
+        morph_class, config = MORPHS[name]
+        self.morph = morph_class(dict(config))
+        x = numpy.linspace(0.5, RMAX, npoints)
+        y = synthetic_pdf(x)
+        self.xyall = (x, y, x.copy(), y.copy())
+
+    def time_morph(self, name, npoints):
+        self.morph(*self.xyall)
+
+    def peakmem_morph(self, name, npoints):
+        self.morph(*self.xyall)
@@ -0,0 +1,172 @@
+"""Synthetic PDFs with known morph parameters.
+
+The functions of fcc nickel are computed from the interatomic distances
+of the crystal with Gaussian peaks. The morphs are applied analytically
+to the peaks rather than with diffpy.morph, such that the parameters of
+a target are known independently of the morph implementation.
+"""
+
+from functools import lru_cache
+
+import numpy
+
+# Lattice parameter of nickel in Angstrom
+NI_LATTICE = 3.52
+# Width of the peaks of the unmorphed functions in Angstrom
+PEAK_WIDTH = 0.05
+# Half width of the evaluated range of a peak in units of its width
+PEAK_RANGE = 8
+
+
+@lru_cache(maxsize=8)
+def fcc_shells(a, rmax):
+    """Get the distances and coordination numbers of the neighbour
+    shells of an fcc crystal.
+
+    Parameters
+    ----------
+    a: float
+        The lattice parameter.
+    rmax: float
+        The largest distance.
+
+    Returns
+    -------
+    distances, counts: numpy.ndarray
+        The distance of each shell up to rmax and its number of
+        neighbours.
+    """
+    # Lattice vectors of the fcc lattice in units of a / 2
+    nmax = int(numpy.ceil(2 * rmax / a))
+    n = numpy.arange(-nmax, nmax + 1)
+    n1, n2, n3 = numpy.meshgrid(n, n, n, indexing="ij", sparse=True)
+    even = (n1 + n2 + n3) % 2 == 0
+    length2 = n1**2 + n2**2 + n3**2
+    length2 = length2[even & (length2 > 0)]
+    length2 = length2[length2 <= (2 * rmax / a) ** 2]
+    length2, counts = numpy.unique(length2, return_counts=True)
+    return 0.5 * a * numpy.sqrt(length2), counts
+
+
+def synthetic_rdf(
+    r,
+    scale=1.0,
+    stretch=0.0,
+    smear=0.0,
+    a=NI_LATTICE,
+    sigma=PEAK_WIDTH,
+):
+    """Get the RDF of fcc nickel morphed by scale, stretch and smear.
+
+    The morphs are applied in the order of diffpy.morph: the scale,
+    then the stretch and then the smear.
+
+    Parameters
+    ----------
+    r: numpy.ndarray
+        The increasing grid.
+    scale, stretch, smear: float
+        The morph parameters.
+    a: float
+        The lattice parameter of the unmorphed function.
+    sigma: float
+        The peak width of the unmorphed function.
+
+    Returns
+    -------
+    numpy.ndarray
+        The RDF on r.
+    """
+    r = numpy.asarray(r, dtype=float)
+    rdf = numpy.zeros_like(r)
+    # Stretching sampled at r / (1 + stretch) moves the peaks, widens them
+    # and raises their area by 1 + stretch. The smear adds in quadrature.
+    factor = 1.0 + stretch
+    width = numpy.sqrt((sigma * factor) ** 2 + smear**2)
+    distances, counts = fcc_shells(a, (r[-1] + PEAK_RANGE * width) / factor)
+    norm = scale * factor / (width * numpy.sqrt(2 * numpy.pi))
+    for distance, count in zip(factor * distances, counts):
+        lo, hi = numpy.searchsorted(
+            r, [distance - PEAK_RANGE * width, distance + PEAK_RANGE * width]
+        )
+        rdf[lo:hi] += (
+            count
+            * norm
+            * numpy.exp(-0.5 * ((r[lo:hi] - distance) / width) ** 2)
+        )
+    return rdf
+
+
+def synthetic_pdf(r, a=NI_LATTICE, **kwargs):
+    """Get the PDF of fcc nickel morphed by scale, stretch and smear.
+
+    This is synthetic_rdf(r) / r with the baseline of the unmorphed
+    function, baselineslope() * r.
+
+    Parameters
+    ----------
+    r: numpy.ndarray
+        The increasing, positive grid.
+    a: float
+        The lattice parameter of the unmorphed function.
+    **kwargs
+        The morph parameters and peak width, see synthetic_rdf.
+
+    Returns
+    -------
+    numpy.ndarray
+        The PDF on r.
+    """
+    r = numpy.asarray(r, dtype=float)
+    return synthetic_rdf(r, a=a, **kwargs) / r + baselineslope(a) * r
+
+
+def baselineslope(a=NI_LATTICE):
+    """Get the slope -4 pi rho0 of the PDF baseline of fcc nickel."""
+    return -4 * numpy.pi * 4 / a**3
+
+
+def write_series(directory, nfiles, npoints, rmax=20.0, seed=0):
+    """Write a morph RDF and target RDFs with random morph parameters.
+
+    Parameters
+    ----------
+    directory: Path
+        The existing directory of the files. The morph is written to
+        morph.gr and the targets to target_XXXX.gr in a targets
+        subdirectory.
+    nfiles: int
+        Number of targets.
+    npoints: int
+        Number of points of each function.
+    rmax: float
+        The last point of the grid, which starts at 0.5 Angstrom.
+    seed: int
+        Seed of the morph parameters.
+
+    Returns
+    -------
+    morph_file: Path
+        The morph file.
+    parameters: dict
+        The scale, stretch and smear of each target file.
+    """
+    rng = numpy.random.default_rng(seed)
+    r = numpy.linspace(0.5, rmax, npoints)
+    morph_file = directory / "morph.gr"
+    numpy.savetxt(morph_file, numpy.column_stack([r, synthetic_rdf(r)]))
+    target_directory = directory / "targets"
+    target_directory.mkdir(exist_ok=True)
+    parameters = {}
+    for idx in range(nfiles):
+        pars = dict(
+            scale=rng.uniform(0.8, 1.2),
+            stretch=rng.uniform(-0.01, 0.01),
+            smear=rng.uniform(0.01, 0.05),
+        )
+        target_file = target_directory / f"target_{idx:04d}.gr"
+        numpy.savetxt(
+            target_file, numpy.column_stack([r, synthetic_rdf(r, **pars)])
+        )
+        parameters[target_file] = pars
+    return morph_file, parameters
@@ -22,11 +22,12 @@ if sys.version_info.major < 3:
 else:
     from collections.abc import Iterable
 
-import matplotlib.pyplot as plt
+import numpy
 
-from diffpy.morph import morph_helpers, morphs
+from diffpy.morph import morph_helpers, morph_io, morphs
 from diffpy.morph import refine as ref
 from diffpy.morph import tools
+from diffpy.morph.morphs.morph import _batch_row
 
 # map of operation dict
 # TODO: include morphing on psize
@@ -81,6 +82,59 @@ def morph_default_config(**kwargs):
     return rv
 
 
+def _build_morph_chain(xmin, xmax, xstep, fixed_operations, kwargs):
+    """Build the morph chain used by morph and morph_batch.
+
+    Returns
+    -------
+    tuple
+        The configuration dictionary, the morph chain and the list of
+        parameters to refine.
+    """
+    refpars = []
+    # input config
+    rv_cfg = dict(kwargs)
+    # configure morph operations
+    active_morphs = [
+        k
+        for k, v in rv_cfg.items()
+        if (v is not None) and k in _morph_step_dict
+    ]
+    rv_cfg["xmin"] = xmin
+    rv_cfg["xmax"] = xmax
+    rv_cfg["xstep"] = xstep
+    # configure smear, guess baselineslope when it is not provided
+    if rv_cfg.get("smear") is not None and rv_cfg.get("baselineslope") is None:
+        rv_cfg["baselineslope"] = -0.5
+    # config dict defines initial guess of parameters
+    chain = morphs.MorphChain(rv_cfg)
+    # fused envelopes give the same results with fewer temporary arrays
+    chain.fuse_envelopes = True
+    # rgrid
+    chain.append(morphs.MorphRGrid())
+    # configure morph chain
+    for k in active_morphs:
+        morph_cls = _morph_step_dict[k]
+        if k == "smear":
+            [chain.append(el()) for el in morph_cls]
+            refpars.append("baselineslope")
+        elif k == "funcy":
+            morph_inst = morph_cls()
+            morph_inst.function = rv_cfg.get("funcy_function", None)
+            if morph_inst.function is None:
+                raise ValueError(
+                    "Must provide a 'function' when using 'parameters'"
+                )
+            chain.append(morph_inst)
+        else:
+            chain.append(morph_cls())
+        refpars.append(k)
+    # exclude fixed options
+    for opt in fixed_operations:
+        refpars.remove(opt)
+    return rv_cfg, chain, refpars
+
+
 def morph(
     x_morph,
     y_morph,
@@ -91,6 +145,16 @@ def morph(
     xstep=None,
     pearson=False,
     add_pearson=False,
+    separable=False,
+    fuse_maps=False,
+    optimizer="leastsq",
+    bounds=None,
+    max_nfev=None,
+    multistart=None,
+    starts=8,
+    sampling="lhs",
+    seed=None,
+    jobs=1,
     fixed_operations=None,
     refine=True,
     verbose=False,
@@ -124,6 +188,42 @@ def morph(
     add_pearson: Bool, optional
         Option to include **both** Pearson coefficient and Rw as
         minimizing targets during morphing. Default to False.
+    separable: Bool, optional
+        Option to solve the linear parameters (scale) exactly at each
+        step of the refinement of the other parameters. Default to False.
+    fuse_maps: Bool, optional
+        Option to evaluate consecutive scale, stretch and shift morphs
+        with a single resampling of the morph function, see
+        MorphChain.fuse_maps. This is faster and avoids the smoothing of
+        repeated interpolation, so the results differ slightly. Default
+        to False.
+    optimizer: str, optional
+        The minimizer, one of 'leastsq', 'trf' or 'dogbox'. 'trf' and
+        'dogbox' keep parameters such as smear and radius within their
+        physical bounds and scale the parameters by the Jacobian.
+        Default to 'leastsq'.
+    bounds: dict, optional
+        A dictionary with morph parameters as keys and (lower, upper)
+        bounds as values. Requires the 'trf' or 'dogbox' optimizer.
+        Default is None.
+    max_nfev: int, optional
+        Maximum number of residual evaluations of each minimization.
+        Default is None, the scipy default.
+    multistart: dict or str, optional
+        A dictionary with morph parameters as keys and (lower, upper)
+        ranges as values, or a string such as
+        'stretch=-0.01:0.01,radius=5:20'. If given, the refinement is
+        repeated from starting values drawn from these ranges and the
+        best minimum is kept. Default is None, a single refinement.
+    starts: int, optional
+        Number of starting values drawn for `multistart`. Default to 8.
+    sampling: str, optional
+        How the starting values are drawn, 'lhs' for a Latin hypercube
+        or 'sobol' for a Sobol sequence. Default to 'lhs'.
+    seed: int, optional
+        Seed of the starting values. Default is None.
+    jobs: int, optional
+        Number of processes used to refine the starts. Default to 1.
     fixed_operations: list, optional
         A list of string specifying operations will be keep fixed during
         morphing. Default is None.
@@ -164,6 +264,9 @@ def morph(
         - pcc: float
               The pearson correlation coefficient between morphed
                data and referenced data
+        - minima: list
+              Only with `multistart`. The physical minima found from the
+              starts, from the lowest chi2, see Refiner.multistart.
 
     Examples
     --------
@@ -182,50 +285,25 @@ def morph(
     print(morph_rv_dict['pcc'])
     print(morph_rv_dict['rw'])
     """
-    refpars = []
-    # input config
-    rv_cfg = dict(kwargs)
-    # configure morph operations
-    active_morphs = [
-        k
-        for k, v in rv_cfg.items()
-        if (v is not None) and k in _morph_step_dict
-    ]
-    rv_cfg["xmin"] = xmin
-    rv_cfg["xmax"] = xmax
-    rv_cfg["xstep"] = xstep
-    # configure smear, guess baselineslope when it is not provided
-    if rv_cfg.get("smear") is not None and rv_cfg.get("baselineslope") is None:
-        rv_cfg["baselineslope"] = -0.5
-    # config dict defines initial guess of parameters
-    chain = morphs.MorphChain(rv_cfg)
-    # rgrid
-    chain.append(morphs.MorphRGrid())
-    # configure morph chain
-    for k in active_morphs:
-        morph_cls = _morph_step_dict[k]
-        if k == "smear":
-            [chain.append(el()) for el in morph_cls]
-            refpars.append("baselineslope")
-        elif k == "funcy":
-            morph_inst = morph_cls()
-            morph_inst.function = rv_cfg.get("funcy_function", None)
-            if morph_inst.function is None:
-                raise ValueError(
-                    "Must provide a 'function' when using 'parameters'"
-                )
-            chain.append(morph_inst)
-        else:
-            chain.append(morph_cls())
-        refpars.append(k)
-    # exclude fixed options
-    if fixed_operations:
-        if not isinstance(fixed_operations, Iterable):
-            fixed_operations = [fixed_operations]
-        for opt in fixed_operations:
-            refpars.remove(opt)
+    if fixed_operations and not isinstance(fixed_operations, Iterable):
+        fixed_operations = [fixed_operations]
+    if isinstance(multistart, str):
+        multistart = tools.parse_ranges(multistart)
+    if multistart:
+        # the morph of a parameter with a range needs a value to be used
+        kwargs = dict(kwargs)
+        for k, (lower, upper) in multistart.items():
+            if kwargs.get(k) is None:
+                kwargs[k] = 0.5 * (lower + upper)
+    rv_cfg, chain, refpars = _build_morph_chain(
+        xmin, xmax, xstep, fixed_operations or [], kwargs
+    )
+    chain.fuse_maps = fuse_maps
     # define refiner
     refiner = ref.Refiner(chain, x_morph, y_morph, x_target, y_target)
+    refiner.optimizer = optimizer
+    refiner.bounds = bounds or {}
+    refiner.max_nfev = max_nfev
     if pearson:
         refiner.residual = refiner._pearson
     if add_pearson:
@@ -237,9 +315,20 @@ def morph(
             rptemp = ["smear"]
             if "scale" in refpars:
                 rptemp.append("scale")
-            refiner.refine(*rptemp)
+            refiner.refine(*rptemp, separable=separable)
         # Refine all params
-        refiner.refine(*refpars)
+        if multistart:
+            refiner.multistart(
+                multistart,
+                *refpars,
+                starts=starts,
+                sampling=sampling,
+                seed=seed,
+                jobs=jobs,
+                separable=separable,
+            )
+        else:
+            refiner.refine(*refpars, separable=separable)
     else:
         # no operation if refine=False or refpars is empty list
         chain(x_morph, y_morph, x_target, y_target)
@@ -250,6 +339,8 @@ def morph(
     # restore rgrid
     chain[0] = morphs.Morph()
     chain(x_morph, y_morph, x_target, y_target)
+    # fill in the outputs of each morph of the returned chain
+    chain.expand_fused()
     # print output
     if verbose:
         if fixed_operations:
@@ -264,9 +355,252 @@ def morph(
         print(output)
 
     rv_dict = dict(morph_chain=chain, morphed_config=rv_cfg, rw=rw, pcc=pcc)
+    if multistart and refpars and refine:
+        rv_dict["minima"] = refiner.minima
     return rv_dict
 
 
+def morph_batch(
+    x_morph,
+    y_morph,
+    x_target,
+    y_target,
+    xmin=None,
+    xmax=None,
+    xstep=None,
+    fixed_operations=None,
+    refine=True,
+    **kwargs,
+):
+    """Function to morph one PDF against a batch of target PDFs.
+
+    The same morph chain is refined for every target at once. Each
+    residual evaluation runs the chain for the whole batch, so the work
+    is done by NumPy rather than in a Python loop over the targets.
+
+    Parameters
+    ----------
+    x_morph: numpy.array
+        An array of morphed x values, i.e., those will be manipulated by
+        morphing.
+    y_morph: numpy.array
+        An array of morphed y values, i.e., those will be manipulated by
+        morphing.
+    x_target: numpy.array
+        An array of target x values shared by all targets.
+    y_target: numpy.array
+        A 2D array of target y values with shape (n_datasets, n_points).
+        Each row is a target that will be kept constant by morphing.
+    xmin: float, optional
+        A value to specify lower x-limit of morph operations.
+    xmax: float, optional
+        A value to specify upper x-limit of morph operations.
+    xstep: float, optional
+        A value to specify xstep of morph operations.
+    fixed_operations: list, optional
+        A list of string specifying operations will be keep fixed during
+        morphing. Default is None.
+    refine: bool, optional
+        Option to execute the minimization step in morphing. If False,
+        the morphing will be applied with parameter values specified in
+        `morph_config`. Default to True.
+    kwargs: dict, optional
+        A dictionary with morph parameters as keys and initial
+        values of morph parameters as values. An initial value is either
+        shared by all targets or an array with one value per target.
+        Supported morph parameters are the same as for `morph`.
+
+    Returns
+    -------
+    morph_rv_dict: dict
+        A dictionary contains following key-value pairs:
+
+        - morph_chain: diffpy.morph.morphs.morphchain.MorphChain
+              The instance of processed morph chain. The y arrays of
+              ``morph_chain.xyallout`` have one row for each target.
+        - morphed_config: list
+              A list with the dictionary of refined morphing parameters
+              of each target.
+        - rw: numpy.array
+              The agreement factor of each target.
+        - pcc: numpy.array
+              The pearson correlation coefficient of each target.
+
+    Examples
+    --------
+    # morph (x_morph, y_morph) to each row of y_target with scaling
+    from diffpy.morph.morph_api import morph_batch, morph_default_config
+
+    morph_cfg = morph_default_config(scale=1.01, stretch=0.001)
+    morph_rv_dict = morph_batch(
+        x_morph, y_morph, x_target, y_target, **morph_cfg
+    )
+    print(morph_rv_dict['morphed_config'][0])
+    print(morph_rv_dict['rw'])
+    """
+    y_target = numpy.atleast_2d(y_target)
+    nbatch = len(y_target)
+    if fixed_operations and not isinstance(fixed_operations, Iterable):
+        fixed_operations = [fixed_operations]
+    rv_cfg, chain, refpars = _build_morph_chain(
+        xmin, xmax, xstep, fixed_operations or [], kwargs
+    )
+    # one column of parameter values per target
+    for k, v in rv_cfg.items():
+        if k in chain.parnames and k not in ["xmin", "xmax", "xstep"]:
+            rv_cfg[k] = _batch_column(v, nbatch)
+    refiner = ref.BatchRefiner(chain, x_morph, y_morph, x_target, y_target)
+    # execute morphing
+    if refpars and refine:
+        # This works better when we adjust scale and smear first.
+        if "smear" in refpars:
+            rptemp = ["smear"]
+            if "scale" in refpars:
+                rptemp.append("scale")
+            refiner.refine(*rptemp)
+        # Refine all params
+        refiner.refine(*refpars)
+    else:
+        # no operation if refine=False or refpars is empty list
+        chain(x_morph, y_morph, x_target, y_target)
+
+    # summary
+    rw = tools.get_rw(chain)
+    pcc = tools.get_pearson(chain)
+    # restore rgrid
+    chain[0] = morphs.Morph()
+    chain(x_morph, y_morph, x_target, y_target)
+    # fill in the outputs of each morph of the returned chain
+    chain.expand_fused()
+
+    morphed_configs = [
+        {k: _batch_row(v, idx) for k, v in rv_cfg.items()}
+        for idx in range(nbatch)
+    ]
+    rv_dict = dict(
+        morph_chain=chain, morphed_config=morphed_configs, rw=rw, pcc=pcc
+    )
+    return rv_dict
+
+
+def scan(
+    x_morph,
+    y_morph,
+    x_target,
+    y_target,
+    grid,
+    xmin=None,
+    xmax=None,
+    xstep=None,
+    chunk_size=256,
+    jobs=1,
+    save=None,
+    **kwargs,
+):
+    """Function to evaluate Rw and Pearson over a grid of morph
+    parameters.
+
+    The landscape shows whether the agreement has several minima and
+    where to start a refinement with `morph`. All grid points are
+    evaluated with batched morph chains rather than one morph at a time.
+
+    Parameters
+    ----------
+    x_morph: numpy.array
+        An array of morphed x values, i.e., those will be manipulated by
+        morphing.
+    y_morph: numpy.array
+        An array of morphed y values, i.e., those will be manipulated by
+        morphing.
+    x_target: numpy.array
+        An array of target x values, i.e., those will be kept constant by
+        morphing.
+    y_target: numpy.array
+        An array of target y values, i.e., those will be kept constant by
+        morphing.
+    grid: dict or str
+        A dictionary with the scanned morph parameters as keys and arrays
+        of their values as values, or a string such as
+        'stretch=-0.01:0.01:201,smear=0:0.2:101' with NUM values from START
+        to STOP for each NAME=START:STOP:NUM.
+    xmin: float, optional
+        A value to specify lower x-limit of morph operations.
+    xmax: float, optional
+        A value to specify upper x-limit of morph operations.
+    xstep: float, optional
+        A value to specify xstep of morph operations.
+    chunk_size: int, optional
+        Number of grid points evaluated at once. Default to 256.
+    jobs: int, optional
+        Number of processes used to evaluate the grid. Default to 1.
+    save: str, optional
+        Name of a .npz file to save the parameter values, 'rw' and
+        'pearson' to. Default is None, not saving.
+    kwargs: dict, optional
+        A dictionary with morph parameters as keys and the values of the
+        morph parameters that are not scanned as values. Supported morph
+        parameters are the same as for `morph`.
+
+    Returns
+    -------
+    scan_rv_dict: dict
+        A dictionary contains following key-value pairs:
+
+        - grid: dict
+              The values of each scanned parameter.
+        - rw: numpy.array
+              The agreement factor at each grid point, with one axis per
+              scanned parameter in the order of grid.
+        - pcc: numpy.array
+              The pearson correlation coefficient at each grid point.
+        - best_config: dict
+              The morph parameters at the grid point with the lowest Rw.
+
+    Examples
+    --------
+    # scan stretch and smear, then refine from the best grid point
+    from diffpy.morph.morph_api import morph, scan
+
+    scan_rv_dict = scan(
+        x_morph, y_morph, x_target, y_target,
+        "stretch=-0.01:0.01:201,smear=0:0.2:101", scale=1.0,
+    )
+    morph_rv_dict = morph(
+        x_morph, y_morph, x_target, y_target,
+        **scan_rv_dict['best_config']
+    )
+    """
+    if isinstance(grid, str):
+        grid = tools.parse_scan(grid)
+    # the morph of a scanned parameter needs an initial value to be used
+    cfg = dict(kwargs)
+    for k, values in grid.items():
+        if cfg.get(k) is None:
+            cfg[k] = float(values[0])
+    rv_cfg, chain, _ = _build_morph_chain(xmin, xmax, xstep, [], cfg)
+    refiner = ref.Refiner(chain, x_morph, y_morph, x_target, y_target)
+    rw, pcc = refiner.scan(grid, chunk_size=chunk_size, jobs=jobs)
+    if save is not None:
+        morph_io.save_scan(save, grid, rw, pcc)
+
+    best = numpy.unravel_index(numpy.nanargmin(rw), rw.shape)
+    best_config = {k: rv_cfg[k] for k in cfg}
+    for k, idx in zip(grid, best):
+        best_config[k] = float(grid[k][idx])
+    rv_dict = dict(grid=grid, rw=rw, pcc=pcc, best_config=best_config)
+    return rv_dict
+
+
+def _batch_column(value, nbatch):
+    """Convert a parameter value to a column of values for each target."""
+    if isinstance(value, dict):
+        return {k: _batch_column(v, nbatch) for k, v in value.items()}
+    if value is None:
+        return value
+    column = numpy.array(value, dtype=float).reshape(-1, 1)
+    return numpy.broadcast_to(column, (nbatch, 1)).copy()
+
+
 def plot_morph(chain, ax=None, **kwargs):
     """Plot the morphed PDF and the target PDF of a morphing operation.
 
@@ -290,6 +624,8 @@ def plot_morph(chain, ax=None, **kwargs):
         plotted data.
     """
     if ax is None:
+        import matplotlib.pyplot as plt
+
         fig, ax = plt.subplots()
     rfit, grfit = chain.xy_morph_out
     rdat, grdat = chain.xy_target_out
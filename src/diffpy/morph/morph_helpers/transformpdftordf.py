@@ -39,6 +39,8 @@ class TransformXtalPDFtoRDF(Morph):
     xoutlabel = LABEL_RA
     youtlabel = LABEL_RR
     parnames = ["baselineslope"]
+    jacobian_parnames = ["baselineslope"]
+    batchable = True
 
     def morph(self, x_morph, y_morph, x_target, y_target):
         """Return corresponding RDF given PDF."""
@@ -51,5 +53,14 @@ class TransformXtalPDFtoRDF(Morph):
         )
         return self.xyallout
 
+    def jacobian(self, pars, dy_morph, dy_target):
+        """Propagate derivatives through the PDF to RDF transform."""
+        dy_morph = dy_morph * self.x_morph_in[:, None]
+        dy_target = dy_target * self.x_target_in[:, None]
+        for col in self._parameter_columns(pars, "baselineslope"):
+            dy_morph[:, col] -= self.x_morph_in**2
+            dy_target[:, col] -= self.x_target_in**2
+        return dy_morph, dy_target
+
 
 # End of class TransformXtalPDFtoRDF
@@ -41,6 +41,8 @@ class TransformXtalRDFtoPDF(Morph):
     xoutlabel = LABEL_RA
     youtlabel = LABEL_GR
     parnames = ["baselineslope"]
+    jacobian_parnames = ["baselineslope"]
+    batchable = True
 
     def morph(self, x_morph, y_morph, x_target, y_target):
         """Return corresponding PDF given RDF."""
@@ -51,13 +53,31 @@ class TransformXtalRDFtoPDF(Morph):
             self.y_target_out = (
                 self.y_target_in / self.x_target_in + target_baseline
             )
-        self.y_target_out[self.x_target_in == 0] = 0
+        self.y_target_out[..., self.x_target_in == 0] = 0
         with numpy.errstate(divide="ignore", invalid="ignore"):
             self.y_morph_out = (
                 self.y_morph_in / self.x_morph_in + morph_baseline
             )
-        self.y_morph_out[self.x_morph_in == 0] = 0
+        self.y_morph_out[..., self.x_morph_in == 0] = 0
         return self.xyallout
 
+    def jacobian(self, pars, dy_morph, dy_target):
+        """Propagate derivatives through the RDF to PDF transform."""
+        dy_morph = _rdftopdf_derivative(pars, self.x_morph_in, dy_morph)
+        dy_target = _rdftopdf_derivative(pars, self.x_target_in, dy_target)
+        return dy_morph, dy_target
+
 
 # End of class MorphScale
+
+
+def _rdftopdf_derivative(pars, r, drr):
+    """Derivative of G(r) = R(r) / r + r * s given the derivative of
+    R(r)."""
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        dgr = drr / r[:, numpy.newaxis]
+    for col, (name, _) in enumerate(pars):
+        if name == "baselineslope":
+            dgr[:, col] += r
+    dgr[r == 0] = 0
+    return dgr
@@ -523,6 +523,85 @@ def tabulate_results(multiple_morph_results):
     return tabulated_results
 
 
+def save_scan(save_file, grid, rw, pearson):
+    """Save the result of a parameter scan to a .npz file.
+
+    Parameters
+    ----------
+    save_file: str or Path
+        Name of the .npz file.
+    grid: dict
+        The values of each scanned parameter.
+    rw, pearson: numpy.ndarray
+        Rw and Pearson coefficient with one axis per scanned parameter.
+
+    Notes
+    -----
+        The file holds the array of values of each parameter under its
+        name, the parameter names in axis order as 'parameters', and the
+        arrays 'rw' and 'pearson'.
+    """
+    arrays = {name: numpy.asarray(values) for name, values in grid.items()}
+    numpy.savez(
+        save_file,
+        parameters=numpy.array(list(grid)),
+        rw=rw,
+        pearson=pearson,
+        **arrays,
+    )
+    return
+
+
+def save_trace(save_file, trace):
+    """Save the trajectory of a refinement to a .npz or CSV file.
+
+    Parameters
+    ----------
+    save_file: str or Path
+        Name of the file. A name ending in .csv is saved as CSV, any
+        other name in NumPy .npz format.
+    trace: Trace
+        The recorded refinement.
+
+    Notes
+    -----
+        The CSV file has one row per residual evaluation with the columns
+        evaluation, time, residual_norm, pearson and the value of each
+        parameter, named in the header. The .npz file holds the arrays
+        time, residual_norm, pearson and values, and the parameter names
+        in column order of values as 'parameters'.
+    """
+    if Path(save_file).suffix.lower() == ".csv":
+        columns = ["evaluation", "time", "residual_norm", "pearson"]
+        table = numpy.column_stack(
+            [
+                numpy.arange(len(trace)),
+                trace.time,
+                trace.residual_norm,
+                trace.pearson,
+                trace.values,
+            ]
+        )
+        numpy.savetxt(
+            save_file,
+            table,
+            delimiter=",",
+            header=",".join(columns + trace.names),
+            comments="",
+            fmt=["%d"] + ["%.17g"] * (table.shape[1] - 1),
+        )
+    else:
+        numpy.savez(
+            save_file,
+            parameters=numpy.array(trace.names, dtype=str),
+            time=trace.time,
+            residual_norm=trace.residual_norm,
+            pearson=trace.pearson,
+            values=trace.values,
+        )
+    return
+
+
 def handle_extrapolation_warnings(morph):
     if morph is not None:
         extrapolation_info = morph.extrapolation_info
@@ -17,6 +17,9 @@ from __future__ import print_function
 
 import copy
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
 
 import numpy
@@ -24,10 +27,11 @@ import numpy
 import diffpy.morph.morph_helpers as helpers
 import diffpy.morph.morph_io as io
 import diffpy.morph.morphs as morphs
-import diffpy.morph.plot as plot
 import diffpy.morph.refine as refine
 import diffpy.morph.tools as tools
 from diffpy.morph import __save_morph_as__
+from diffpy.morph.profiler import Profiler
+from diffpy.morph.trace import Trace
 from diffpy.morph.version import __version__
 
 
@@ -175,6 +179,142 @@ def create_option_parser():
             "minimizing the residual."
         ),
     )
+    parser.add_option(
+        "--separable",
+        action="store_true",
+        dest="separable",
+        help=(
+            "Solve the linear parameters (--scale and --vshift) exactly at "
+            "each step of the refinement of the remaining parameters. "
+            "Ignored with --pearson and --addpearson."
+        ),
+    )
+    parser.add_option(
+        "--fuse-maps",
+        action="store_true",
+        dest="fuse_maps",
+        help=(
+            "Evaluate consecutive --scale, --stretch, --hshift and --vshift "
+            "morphs with a single resampling of the morph function. This "
+            "is faster and avoids the smoothing of repeated linear "
+            "interpolation, so the results differ slightly. After "
+            "--squeeze the morphs are evaluated with the cubic spline of "
+            "the squeeze instead, which is more accurate but slower."
+        ),
+    )
+    parser.add_option(
+        "--optimizer",
+        type="choice",
+        choices=["leastsq", "trf", "dogbox"],
+        metavar="OPTIMIZER",
+        help=(
+            "Minimizer used for refinement: leastsq, trf or dogbox. "
+            "trf and dogbox keep parameters such as --smear and --radius "
+            "within their physical bounds and scale the parameters by the "
+            "Jacobian. Default: leastsq."
+        ),
+    )
+    parser.add_option(
+        "--max-nfev",
+        type="int",
+        metavar="NFEV",
+        dest="max_nfev",
+        help=(
+            "Maximum number of residual evaluations of each refinement. "
+            "Default: the scipy default of the optimizer."
+        ),
+    )
+    parser.add_option(
+        "--scan",
+        metavar="SCAN",
+        dest="scan",
+        help=(
+            "Evaluate Rw and the Pearson coefficient on a grid of parameter "
+            "values before refining. SCAN is a comma-separated list of "
+            "NAME=START:STOP:NUM entries, e.g. "
+            "--scan=stretch=-0.01:0.01:201,smear=0:0.2:101, where each NAME "
+            "is the parameter of an applied manipulation and takes NUM "
+            "values from START to STOP. The refinement starts from the grid "
+            "point with the lowest Rw. Use --scan-file to save the grid and "
+            "--jobs to evaluate it in parallel."
+        ),
+    )
+    parser.add_option(
+        "--scan-file",
+        metavar="SCANFILE",
+        dest="scan_file",
+        help=(
+            "Save the parameter values, Rw and Pearson coefficients of "
+            "--scan to SCANFILE in NumPy .npz format."
+        ),
+    )
+    parser.add_option(
+        "--multistart",
+        metavar="RANGES",
+        dest="multistart",
+        help=(
+            "Repeat the refinement from several starting points and keep "
+            "the best minimum. RANGES is a comma-separated list of "
+            "NAME=LOWER:UPPER entries, e.g. "
+            "--multistart=stretch=-0.01:0.01,radius=5:20, giving the range "
+            "of the starting values of each parameter. The spread of the "
+            "minima is reported, leaving out minima outside of the "
+            "physical parameter bounds or with Rw of 1 or more. Use --jobs "
+            "to refine the starts in parallel."
+        ),
+    )
+    parser.add_option(
+        "--starts",
+        type="int",
+        metavar="NSTARTS",
+        dest="starts",
+        help=(
+            "Number of starting points drawn for --multistart, in addition "
+            "to the initial values. Default: 8."
+        ),
+    )
+    parser.add_option(
+        "--sampling",
+        type="choice",
+        choices=["lhs", "sobol"],
+        metavar="SAMPLING",
+        dest="sampling",
+        help=(
+            "How the starting points of --multistart are drawn: lhs (Latin "
+            "hypercube) or sobol (scrambled Sobol sequence). Default: lhs."
+        ),
+    )
+    parser.add_option(
+        "--seed",
+        type="int",
+        metavar="SEED",
+        dest="seed",
+        help="Seed of the starting points of --multistart.",
+    )
+    parser.add_option(
+        "--profile",
+        action="store_true",
+        dest="profile",
+        help=(
+            "Print the number of calls, time and allocated memory of each "
+            "morph, of the residual and Jacobian evaluations and of the "
+            "file reading after the morph summary. With "
+            "--multiple-<targets/morphs> the morphs are profiled together. "
+            "Work is then done in a single process regardless of --jobs."
+        ),
+    )
+    parser.add_option(
+        "--trace",
+        metavar="TRACEFILE",
+        dest="trace",
+        help=(
+            "Save the parameter values, residual norm, Pearson coefficient "
+            "and elapsed time of each residual evaluation of the "
+            "refinement to TRACEFILE, as CSV if TRACEFILE ends in .csv and "
+            "in NumPy .npz format otherwise. Not supported with "
+            "--multiple-<targets/morphs>."
+        ),
+    )
 
     # Manipulations
     group = optparse.OptionGroup(
@@ -518,6 +658,44 @@ def create_option_parser():
             "will be displayed as the vertical axis label for the plot."
         ),
     )
+    group.add_option(
+        "--jobs",
+        type="int",
+        metavar="NJOBS",
+        dest="jobs",
+        help=(
+            "Used with --multiple-<targets/morphs> to perform the morphs in "
+            "NJOBS parallel processes. "
+            "Results are reported in the same order as a serial run. "
+            "For a single morph, evaluate --scan and refine the starts of "
+            "--multistart in NJOBS processes. "
+            "Default is 1 (serial)."
+        ),
+    )
+    group.add_option(
+        "--warm-start",
+        dest="warm_start",
+        action="store_true",
+        help=(
+            "Used with --multiple-<targets/morphs>. Start the refinement "
+            "of each morph from the refined parameters of the previous "
+            "file in the sorted DIRECTORY instead of the initial values. "
+            "Useful for series where neighbouring files are similar, e.g. "
+            "when using --sort-by temperature. "
+            "See --anchor to start from a file other than the first."
+        ),
+    )
+    group.add_option(
+        "--anchor",
+        metavar="ANCHOR",
+        dest="anchor",
+        help=(
+            "Used with --warm-start. Name of the file in DIRECTORY that "
+            "is refined from the initial values. Files after ANCHOR in the "
+            "sorted order are warm started forwards and files before it "
+            "backwards."
+        ),
+    )
 
     # Defaults
     parser.set_defaults(multiple=False)
@@ -526,49 +704,45 @@ def create_option_parser():
     parser.set_defaults(refine=True)
     parser.set_defaults(pearson=False)
     parser.set_defaults(addpearson=False)
+    parser.set_defaults(separable=False)
+    parser.set_defaults(fuse_maps=False)
+    parser.set_defaults(optimizer="leastsq")
+    parser.set_defaults(jobs=1)
+    parser.set_defaults(starts=8)
+    parser.set_defaults(sampling="lhs")
+    parser.set_defaults(warm_start=False)
     parser.set_defaults(mag=5)
     parser.set_defaults(lwidth=1.5)
 
     return parser
 
 
-def single_morph(
-    parser, opts, pargs, stdout_flag=True, python_wrap=False, pymorphs=None
-):
-    if len(pargs) < 2:
-        parser.morph_error(
-            "You must supply MORPHFILE and TARGETFILE.", TypeError
-        )
-    elif len(pargs) > 2 and not python_wrap:
-        parser.morph_error(
-            "Too many arguments. Make sure you only supply "
-            "MORPHFILE and TARGETFILE.",
-            TypeError,
-        )
-    elif not (len(pargs) == 2 or len(pargs) == 6) and python_wrap:
-        parser.morph_error("Python wrapper error.", RuntimeError)
-
-    # Get the PDFs
-    # If we get from python, we may wrap, which has input size 4
-    if len(pargs) == 6 and python_wrap:
-        x_morph = pargs[2]
-        y_morph = pargs[3]
-        x_target = pargs[4]
-        y_target = pargs[5]
-    else:
-        x_morph, y_morph = get_two_column_from_file(pargs[0])
-        x_target, y_target = get_two_column_from_file(pargs[1])
-
-    if y_morph is None:
-        parser.morph_error(f"No data table found in: {pargs[0]}.", ValueError)
-    if y_target is None:
-        parser.morph_error(f"No data table found in: {pargs[1]}.", ValueError)
-
-    # Get tolerance
-    tolerance = 1e-08
-    if opts.tolerance is not None:
-        tolerance = opts.tolerance
-
+def build_single_morph_chain(parser, opts, pymorphs=None):
+    """Build the morph chain of a single morph from the options.
+
+    Parameters
+    ----------
+    parser
+        The option parser, used to report errors.
+    opts
+        The parsed options.
+    pymorphs: dict, optional
+        The Python-specific funcxy, funcx and funcy morphs, each a tuple
+        of the function and the dictionary of its parameters.
+
+    Returns
+    -------
+    chain: MorphChain
+        The chain of the requested morphs, ending with a MorphRGrid. The
+        initial parameter values are in chain.config.
+    refpars: list
+        The names of the parameters to refine.
+    mrg: MorphRGrid
+        The r-range morph at the end of chain.
+    squeeze_morph, shift_morph, stretch_morph
+        The morphs whose extrapolation is reported, or None if they are
+        not applied.
+    """
     # Get configuration values
     scale_in = "None"
     stretch_in = "None"
@@ -586,6 +760,9 @@ def single_morph(
 
     # Set up the morphs
     chain = morphs.MorphChain(config)
+    chain.fuse_maps = opts.fuse_maps
+    # Fused envelopes give the same results with fewer temporary arrays
+    chain.fuse_envelopes = True
     refpars = []
 
     # Python-Specific Morphs
@@ -742,14 +919,136 @@ def single_morph(
         if "stretch" in opts.exclude:
             stretch_morph = None
 
-    # Refine or execute the morph
+    return chain, refpars, mrg, squeeze_morph, shift_morph, stretch_morph
+
+
+class SingleMorphChain(object):
+    """The morph chain of single morphs with the same options.
+
+    The chain is built once by build_single_morph_chain and reset to the
+    initial parameter values before each morph. The morphs of a batch
+    and those of a MorphSession reuse a chain this way.
+
+    Parameters
+    ----------
+    parser
+        The option parser, used to report errors.
+    opts
+        The parsed options.
+    pymorphs: dict, optional
+        The Python-specific morphs, see build_single_morph_chain.
+
+    Attributes
+    ----------
+    chain, refpars, mrg, squeeze_morph, shift_morph, stretch_morph
+        As returned by build_single_morph_chain.
+    initial_config: dict
+        The initial parameter values.
+    """
+
+    def __init__(self, parser, opts, pymorphs=None):
+        (
+            self.chain,
+            self.refpars,
+            self.mrg,
+            self.squeeze_morph,
+            self.shift_morph,
+            self.stretch_morph,
+        ) = build_single_morph_chain(parser, opts, pymorphs)
+        self.initial_config = copy.deepcopy(self.chain.config)
+        return
+
+    def reset(self, seed=None):
+        """Reset the chain for a new morph.
+
+        Parameters
+        ----------
+        seed: dict, optional
+            The results of a previous morph. The refined parameters then
+            start from their values in seed.
+
+        Returns
+        -------
+        tuple
+            The chain, refpars, mrg, squeeze_morph, shift_morph and
+            stretch_morph, as returned by build_single_morph_chain.
+        """
+        config = self.chain.config
+        config.update(copy.deepcopy(self.initial_config))
+        if seed is not None:
+            for name in self.refpars:
+                if name in seed:
+                    config[name] = copy.deepcopy(seed[name])
+        # The r-range morph is replaced when keeping the original grid, and
+        # remembers the grid of the last functions
+        self.chain[-1] = self.mrg
+        self.mrg.xmin_origin = None
+        self.mrg.xmax_origin = None
+        self.mrg.xstep_origin = None
+        return (
+            self.chain,
+            self.refpars,
+            self.mrg,
+            self.squeeze_morph,
+            self.shift_morph,
+            self.stretch_morph,
+        )
+
+
+# End class SingleMorphChain
+
+
+def refine_single_morph(
+    parser,
+    opts,
+    chain,
+    refpars,
+    x_morph,
+    y_morph,
+    x_target,
+    y_target,
+    stdout_flag=True,
+    profile=None,
+):
+    """Refine the morph chain of a single morph, or apply it if the
+    refinement is disabled.
+
+    The chain and the refiner record their work in profile when given.
+
+    Returns
+    -------
+    refiner: Refiner
+        The refiner of the chain.
+    unc: dict or None
+        The estimated uncertainty of each refined parameter, or None if
+        no parameters were refined.
+    """
+    config = chain.config
+    # Get tolerance
+    tolerance = 1e-08
+    if opts.tolerance is not None:
+        tolerance = opts.tolerance
+    if opts.max_nfev is not None and opts.max_nfev < 1:
+        parser.morph_error(
+            "--max-nfev must be a positive integer.", ValueError
+        )
+
     refiner = refine.Refiner(
         chain, x_morph, y_morph, x_target, y_target, tolerance=tolerance
     )
+    refiner.optimizer = opts.optimizer
+    refiner.max_nfev = opts.max_nfev
+    refiner.profile = profile
+    chain.profile = profile
+    trace = None
+    if opts.trace is not None:
+        trace = Trace()
     if opts.pearson:
         refiner.residual = refiner._pearson
     if opts.addpearson:
         refiner.residual = refiner._add_pearson
+    if opts.scan is not None:
+        _scan_initial_values(parser, opts, refiner, stdout_flag)
     unc = None
     if opts.refine and refpars:
         try:
@@ -758,28 +1057,19 @@ def single_morph(
                 rptemp = ["smear"]
                 if "scale" in refpars:
                     rptemp.append("scale")
-                refiner.refine(*rptemp)
+                refiner.refine(*rptemp, separable=opts.separable, trace=trace)
             # Adjust all parameters
-            unc = refiner.refine(*refpars, estimate_uncertainty=True)
-            # If one parameter is causing trouble with uncertainty estimate
-            # compute all uncertainties individually
-            if unc is None:
-                unc = {}
-                for param in refpars:
-                    refiner_single_param = type(refiner)(
-                        refiner.chain,
-                        refiner.x_morph,
-                        refiner.y_morph,
-                        refiner.x_target,
-                        refiner.y_target,
-                        tolerance=refiner.tolerance,
-                    )
-                    refiner_single_param.chain.config = copy.deepcopy(config)
-                    unc_param = refiner_single_param.refine(
-                        *[param], estimate_uncertainty=True
-                    )
-                    if unc_param is not None:
-                        unc.update(unc_param)
+            if opts.multistart is not None:
+                unc = _multistart_refine(
+                    parser, opts, refiner, refpars, stdout_flag, trace
+                )
+            else:
+                unc = refiner.refine(
+                    *refpars,
+                    estimate_uncertainty=True,
+                    separable=opts.separable,
+                    trace=trace,
+                )
         except ValueError as e:
             parser.morph_error(str(e), ValueError)
     # Smear is not being refined, but baselineslope needs to refined to apply
@@ -793,13 +1083,56 @@ def single_morph(
             refiner.refine(
                 "baselineslope",
                 baselineslope=config["baselineslope"],
+                trace=trace,
             )
         except ValueError as e:
             parser.morph_error(str(e), ValueError)
     else:
         chain(x_morph, y_morph, x_target, y_target)
 
+    if trace is not None:
+        try:
+            io.save_trace(opts.trace, trace)
+        except (FileNotFoundError, RuntimeError) as e:
+            parser.morph_error(
+                "Unable to save trace to designated location.", type(e)
+            )
+        if stdout_flag:
+            print(
+                f"# Trace of {len(trace)} residual evaluations saved to "
+                f"{opts.trace}"
+            )
+    return refiner, unc
+
+
+def finish_single_morph(
+    opts, chain, mrg, checked_morphs, x_morph, y_morph, x_target, y_target
+):
+    """Report the warnings of a refined single morph and evaluate it for
+    output.
+
+    Parameters
+    ----------
+    opts
+        The parsed options.
+    chain, mrg
+        The refined chain and its r-range morph, see
+        build_single_morph_chain. With --original-grid, the r-range
+        morph is replaced by the identity in chain.
+    checked_morphs: list
+        The squeeze, shift and stretch morphs, whose extrapolation
+        warnings are reported.
+    x_morph, y_morph, x_target, y_target
+        The functions of the morph.
+
+    Returns
+    -------
+    morph_results: dict
+        The config values of chain followed by Rw and the Pearson
+        coefficient on the refined range.
+    """
     # THROW ANY WARNINGS HERE
+    squeeze_morph, shift_morph, stretch_morph = checked_morphs
     io.handle_extrapolation_warnings(squeeze_morph)
     io.handle_check_increase_warning(squeeze_morph)
     io.handle_extrapolation_warnings(shift_morph)
@@ -814,6 +1147,158 @@ def single_morph(
         chain[chain.index(mrg)] = morphs.Morph()
     chain(x_morph, y_morph, x_target, y_target)
 
+    # Output morph parameters
+    morph_results = dict(chain.config.items())
+    # Ensure Rw, Pearson last two outputs
+    morph_results.update({"rw": rw})
+    morph_results.update({"pearson": pcc})
+    return morph_results
+
+
+def single_morph_python_output(opts, chain, morph_results, unc):
+    """Get the morph information and the morphed table of a single morph
+    returned to Python.
+
+    The estimated uncertainties unc are added to morph_results when
+    requested.
+    """
+    morph_info = morph_results
+    if opts.estimate_uncertainty is not None and unc is not None:
+        morph_info.update({"uncertainties": unc})
+    morph_table = numpy.array(single_morph_xy(opts, chain)).T
+    return morph_info, morph_table
+
+
+def single_morph_xy(opts, chain):
+    """Get the morphed function of a single morph to save or return.
+
+    This is the difference from the target function with --get-diff.
+    """
+    if opts.get_diff is None:
+        return [chain.x_morph_out, chain.y_morph_out]
+    diff_chain = morphs.MorphChain({"xmin": None, "xmax": None, "xstep": None})
+    diff_chain.append(morphs.MorphRGrid())
+    diff_chain(
+        chain.x_morph_out,
+        chain.y_morph_out,
+        chain.x_target_in,
+        chain.y_target_in,
+    )
+    return [
+        diff_chain.x_morph_out,
+        diff_chain.y_morph_out - diff_chain.y_target_out,
+    ]
+
+
+def single_morph(
+    parser,
+    opts,
+    pargs,
+    stdout_flag=True,
+    python_wrap=False,
+    pymorphs=None,
+    profile=None,
+    compiled=None,
+    seed=None,
+    tables=None,
+):
+    """Morph the function of one file onto that of another.
+
+    Parameters
+    ----------
+    parser
+        The option parser, used to report errors.
+    opts
+        The parsed options.
+    pargs: list
+        The morph and target files, or with python_wrap also the
+        x_morph, y_morph, x_target and y_target arrays.
+    stdout_flag: bool
+        Print the morph summary.
+    python_wrap: bool
+        Return the morph information and the morphed table.
+    pymorphs: dict, optional
+        The Python-specific morphs, see build_single_morph_chain.
+    profile: Profiler, optional
+        Records the morph when given. With --profile and no profile,
+        the profile of this morph is printed.
+    compiled: SingleMorphChain, optional
+        The chain built for opts and pymorphs by an earlier morph, reset
+        and reused instead of building a new chain.
+    seed: dict, optional
+        The results of a previous morph to start the refined parameters
+        from, see SingleMorphChain.reset.
+    tables: dict, optional
+        The (x, y) arrays of files parsed earlier, keyed by file path.
+        The files of pargs found in tables are not read again.
+    """
+    if len(pargs) < 2:
+        parser.morph_error(
+            "You must supply MORPHFILE and TARGETFILE.", TypeError
+        )
+    elif len(pargs) > 2 and not python_wrap:
+        parser.morph_error(
+            "Too many arguments. Make sure you only supply "
+            "MORPHFILE and TARGETFILE.",
+            TypeError,
+        )
+    elif not (len(pargs) == 2 or len(pargs) == 6) and python_wrap:
+        parser.morph_error("Python wrapper error.", RuntimeError)
+
+    # A profile passed by a multiple morph is printed by the caller
+    own_profile = profile is None and opts.profile
+    if own_profile:
+        profile = Profiler(trace_memory=True)
+
+    # Get the PDFs
+    # If we get from python, we may wrap, which has input size 4
+    if len(pargs) == 6 and python_wrap:
+        x_morph = pargs[2]
+        y_morph = pargs[3]
+        x_target = pargs[4]
+        y_target = pargs[5]
+    else:
+        section = nullcontext()
+        if profile is not None:
+            section = profile.section("file I/O")
+        with section:
+            x_morph, y_morph = _get_table(pargs[0], tables)
+            x_target, y_target = _get_table(pargs[1], tables)
+
+    if y_morph is None:
+        parser.morph_error(f"No data table found in: {pargs[0]}.", ValueError)
+    if y_target is None:
+        parser.morph_error(f"No data table found in: {pargs[1]}.", ValueError)
+
+    # Set up and refine the morphs
+    if compiled is None:
+        compiled = SingleMorphChain(parser, opts, pymorphs)
+    chain, refpars, mrg, *checked_morphs = compiled.reset(seed)
+    _, unc = refine_single_morph(
+        parser,
+        opts,
+        chain,
+        refpars,
+        x_morph,
+        y_morph,
+        x_target,
+        y_target,
+        stdout_flag=stdout_flag,
+        profile=profile,
+    )
+
+    morph_results = finish_single_morph(
+        opts,
+        chain,
+        mrg,
+        checked_morphs,
+        x_morph,
+        y_morph,
+        x_target,
+        y_target,
+    )
+    rw = morph_results["rw"]
+
     # FOR FUTURE MAINTAINERS
     # Any new morph should have their input morph parameters updated here
     # You should also update the IO in morph_io
@@ -851,29 +1336,8 @@ def single_morph(
                     {f"funcx {funcy_param}": pymorphs["funcx"][1][funcy_param]}
                 )
 
-    # Output morph parameters
-    morph_results = dict(config.items())
-    # Ensure Rw, Pearson last two outputs
-    morph_results.update({"rw": rw})
-    morph_results.update({"pearson": pcc})
-
     # Print summary to terminal and save morph to file if requested
-    xy_save = [chain.x_morph_out, chain.y_morph_out]
-    if opts.get_diff is not None:
-        diff_chain = morphs.MorphChain(
-            {"xmin": None, "xmax": None, "xstep": None}
-        )
-        diff_chain.append(morphs.MorphRGrid())
-        diff_chain(
-            chain.x_morph_out,
-            chain.y_morph_out,
-            chain.x_target_in,
-            chain.y_target_in,
-        )
-        xy_save = [
-            diff_chain.x_morph_out,
-            diff_chain.y_morph_out - diff_chain.y_target_out,
-        ]
+    xy_save = single_morph_xy(opts, chain)
     try:
         io.single_morph_output(
             morph_inputs,
@@ -890,7 +1354,14 @@ def single_morph(
         save_fail_message = "Unable to save to designated location."
         parser.morph_error(save_fail_message, type(e))
 
+    if own_profile:
+        profile.stop()
+        if stdout_flag:
+            print(profile.summary())
+
     if opts.plot:
+        import diffpy.morph.plot as plot
+
         pairlist = [chain.xy_target_out, chain.xy_morph_out]
         labels = [pargs[1], pargs[0]]  # Default is to use file names
 
@@ -919,16 +1390,333 @@ def single_morph(
 
     # Return different things depending on whether it is python interfaced
     if python_wrap:
-        morph_info = morph_results
-        if opts.estimate_uncertainty is not None and unc is not None:
-            morph_info.update({"uncertainties": unc})
-        morph_table = numpy.array(xy_save).T
+        morph_info, morph_table = single_morph_python_output(
+            opts, chain, morph_results, unc
+        )
+        if own_profile:
+            morph_info.update({"profile": profile.as_dict()})
         return morph_info, morph_table
     else:
         return morph_results, unc
 
 
+def _get_table(fname, tables=None):
+    """The x and y arrays of a file, taken from tables when parsed
+    earlier."""
+    if tables is not None and fname in tables:
+        return tables[fname]
+    return get_two_column_from_file(fname)
+
+
+def _single_morph_jobs(parser, opts):
+    """Number of processes used by --scan and --multistart."""
+    # Multiple morphs are parallelized over the morphs instead, and a
+    # profile only records the work of this process
+    if opts.multiple_targets or opts.multiple_morphs or opts.profile:
+        return 1
+    if opts.jobs is None or opts.jobs < 1:
+        parser.morph_error("--jobs must be a positive integer.", ValueError)
+    return opts.jobs
+
+
+def _scan_initial_values(parser, opts, refiner, stdout_flag):
+    """Set the initial parameters to the grid point of --scan with the
+    lowest Rw."""
+    jobs = _single_morph_jobs(parser, opts)
+    try:
+        grid = tools.parse_scan(opts.scan)
+        rw, pcc = refiner.scan(grid, jobs=jobs)
+        best = numpy.unravel_index(numpy.nanargmin(rw), rw.shape)
+    except ValueError as e:
+        parser.morph_error(str(e), ValueError)
+    for name, idx in zip(grid, best):
+        refiner.chain.config[name] = float(grid[name][idx])
+    if opts.scan_file is not None:
+        try:
+            io.save_scan(opts.scan_file, grid, rw, pcc)
+        except (FileNotFoundError, RuntimeError) as e:
+            parser.morph_error(
+                "Unable to save scan to designated location.", type(e)
+            )
+    if stdout_flag:
+        values = ", ".join(
+            f"{name} = {refiner.chain.config[name]:.6f}" for name in grid
+        )
+        print(f"# Scan minimum Rw = {rw[best]:.6f} at {values}")
+    return
+
+
+def _multistart_refine(
+    parser, opts, refiner, refpars, stdout_flag, trace=None
+):
+    """Refine from the starting points of --multistart and report the
+    spread of the minima."""
+    jobs = _single_morph_jobs(parser, opts)
+    if opts.starts is None or opts.starts < 1:
+        parser.morph_error("--starts must be a positive integer.", ValueError)
+    ranges = tools.parse_ranges(opts.multistart)
+    unc = refiner.multistart(
+        ranges,
+        *refpars,
+        starts=opts.starts,
+        sampling=opts.sampling,
+        seed=opts.seed,
+        jobs=jobs,
+        estimate_uncertainty=True,
+        separable=opts.separable,
+        trace=trace,
+    )
+    if stdout_flag:
+        minima = refiner.minima
+        rws = numpy.array([minimum["rw"] for minimum in minima])
+        nbest = numpy.count_nonzero(numpy.isclose(rws, rws[0], atol=1e-8))
+        print(
+            f"# Multi-start: {nbest} of {len(minima)} physical minima "
+            f"reached the minimum Rw = {rws[0]:.6f}"
+        )
+        print(
+            f"# Multi-start Rw of the minima: median = "
+            f"{numpy.median(rws):.6f}, max = {rws.max():.6f}"
+        )
+        for name in refpars:
+            values = [minimum["config"][name] for minimum in minima]
+            if numpy.ndim(values[0]) == 0:
+                print(
+                    f"# Multi-start {name} of the minima: "
+                    f"{min(values):.6f} to {max(values):.6f}"
+                )
+    return unc
+
+
+# Parser, chain and parsed files of a multiple morph in a worker process
+_single_morph_args = None
+
+
+def _single_morph_init(opts, tables):
+    """Initialize a worker process of a multiple morph.
+
+    The chain is built here, once per worker, as the worker need not
+    share the memory of the parent process.
+    """
+    global _single_morph_args
+    parser = create_option_parser()
+    compiled = SingleMorphChain(parser, opts)
+    _single_morph_args = (parser, compiled, tables)
+    return
+
+
+def _single_morph_job(opts, pargs):
+    """Perform one morph of a multiple morph in a worker process."""
+    parser, compiled, tables = _single_morph_args
+    return single_morph(
+        parser,
+        opts,
+        pargs,
+        stdout_flag=False,
+        compiled=compiled,
+        tables=tables,
+    )
+
+
+def _warm_start_morphs(
+    opts_list,
+    pargs_list,
+    seed=None,
+    compiled=None,
+    parser=None,
+    profile=None,
+    tables=None,
+):
+    """Perform morphs in order, starting each refinement from the refined
+    parameters of the previous morph.
+
+    Parameters
+    ----------
+    opts_list: list
+        Options for each morph.
+    pargs_list: list
+        List of [morph_file, target_file] pairs.
+    seed: dict
+        Morph results used to start the first refinement. When None, the
+        first morph starts from its own options.
+    compiled: SingleMorphChain
+        The chain reused by the morphs. Built from the first options when
+        None.
+    parser: optparse.OptionParser
+        Parser used for error reporting. Created when None, as when
+        running in a worker process.
+    profile: Profiler
+        Profiler recording the morphs, or None.
+    tables: dict
+        The (x, y) arrays of files parsed earlier, see single_morph.
+
+    Returns
+    -------
+    list
+        The (morph_result, uncertainties) tuple of each morph.
+    """
+    if parser is None:
+        parser = create_option_parser()
+    results = []
+    for job_opts, pargs in zip(opts_list, pargs_list):
+        if compiled is None:
+            compiled = SingleMorphChain(parser, job_opts)
+        result = single_morph(
+            parser,
+            job_opts,
+            pargs,
+            stdout_flag=False,
+            profile=profile,
+            compiled=compiled,
+            seed=seed,
+            tables=tables,
+        )
+        results.append(result)
+        seed = result[0]
+    return results
+
+
+def _get_warm_start_anchor(parser, opts, file_list):
+    """Index in file_list of the file to start a warm start refinement
+    from, or None when --warm-start is not enabled."""
+    if not opts.warm_start:
+        return None
+    if opts.anchor is None:
+        return 0
+    for idx, file in enumerate(file_list):
+        if file.name == Path(opts.anchor).name:
+            return idx
+    parser.morph_error(
+        f"Anchor file {opts.anchor} is not in the directory.",
+        FileNotFoundError,
+    )
+
+
+def _run_single_morphs(
+    parser,
+    opts,
+    pargs_list,
+    save_paths,
+    anchor=None,
+    profile=None,
+    tables=None,
+):
+    """Perform a single morph for each pair of files in pargs_list.
+
+    Parameters
+    ----------
+    parser: optparse.OptionParser
+        Parser used for error reporting.
+    opts
+        Options shared by every morph. Not modified.
+    pargs_list: list
+        List of [morph_file, target_file] pairs.
+    save_paths: list
+        Where to save each morphed function. Entries are None when not
+        saving.
+    anchor: int
+        When given, warm start the refinements. The morph at index anchor
+        starts from the parameters in opts. The morphs after (before) it
+        start from the refined parameters of the previous (next) morph.
+    profile: Profiler
+        Profiler recording the morphs, or None. The morphs are then
+        performed in this process.
+    tables: dict
+        The (x, y) arrays of files parsed earlier, see single_morph. They
+        are passed to the worker processes.
+
+    Returns
+    -------
+    list
+        The (morph_result, uncertainties) tuple of each morph in the order
+        of pargs_list.
+    """
+    if opts.jobs is None or opts.jobs < 1:
+        parser.morph_error("--jobs must be a positive integer.", ValueError)
+
+    # Give each morph its own options so the save location is not shared
+    opts_list = []
+    for save_path in save_paths:
+        job_opts = copy.copy(opts)
+        job_opts.slocation = save_path
+        opts_list.append(job_opts)
+    # The chain is the same for every morph and is built once per process
+    compiled = SingleMorphChain(parser, opts)
+
+    if anchor is not None:
+        results = _warm_start_morphs(
+            opts_list[anchor : anchor + 1],
+            pargs_list[anchor : anchor + 1],
+            compiled=compiled,
+            parser=parser,
+            profile=profile,
+            tables=tables,
+        )
+        seed = results[0][0]
+        # The morphs on either side of the anchor are independent
+        forward = (opts_list[anchor + 1 :], pargs_list[anchor + 1 :], seed)
+        backward = (opts_list[:anchor][::-1], pargs_list[:anchor][::-1], seed)
+        parallel = opts.jobs > 1 and profile is None
+        if parallel and forward[1] and backward[1]:
+            # Each worker builds its own chain
+            with ProcessPoolExecutor(max_workers=2) as executor:
+                after, before = executor.map(
+                    partial(_warm_start_morphs, tables=tables),
+                    *zip(forward, backward),
+                )
+        else:
+            after = _warm_start_morphs(
+                *forward,
+                compiled=compiled,
+                parser=parser,
+                profile=profile,
+                tables=tables,
+            )
+            before = _warm_start_morphs(
+                *backward,
+                compiled=compiled,
+                parser=parser,
+                profile=profile,
+                tables=tables,
+            )
+        return before[::-1] + results + after
+
+    njobs = min(opts.jobs, len(pargs_list))
+    if njobs <= 1 or profile is not None:
+        return [
+            single_morph(
+                parser,
+                job_opts,
+                pargs,
+                stdout_flag=False,
+                profile=profile,
+                compiled=compiled,
+                tables=tables,
+            )
+            for job_opts, pargs in zip(opts_list, pargs_list)
+        ]
+    # Executor.map yields results in submission order, so the output does
+    # not depend on which worker finishes first
+    chunksize = max(1, len(pargs_list) // (4 * njobs))
+    with ProcessPoolExecutor(
+        max_workers=njobs,
+        initializer=_single_morph_init,
+        initargs=(opts, tables),
+    ) as executor:
+        return list(
+            executor.map(
+                _single_morph_job, opts_list, pargs_list, chunksize=chunksize
+            )
+        )
+
+
 def multiple_targets(parser, opts, pargs, stdout_flag=True, python_wrap=False):
+    # Each file is parsed once for sorting and morphing
+    with tools.file_cache():
+        return _multiple_targets(parser, opts, pargs, stdout_flag, python_wrap)
+
+
+def _multiple_targets(parser, opts, pargs, stdout_flag, python_wrap):
     # Custom error messages since usage is distinct when --multiple tag is
     # applied
     if len(pargs) < 2:
@@ -942,6 +1730,11 @@ def multiple_targets(parser, opts, pargs, stdout_flag=True, python_wrap=False):
             "Too many arguments. You must only supply a FILE and a DIRECTORY.",
             TypeError,
         )
+    if opts.trace is not None:
+        parser.morph_error(
+            "--trace is not supported with --multiple-<targets/morphs>.",
+            ValueError,
+        )
 
     # Parse paths
     morph_file = Path(pargs[0])
@@ -956,6 +1749,10 @@ def multiple_targets(parser, opts, pargs, stdout_flag=True, python_wrap=False):
             f"{target_directory} is not a directory. Go to --help for usage.",
             NotADirectoryError,
         )
+    # Parse the fixed file once for all targets and pass its arrays to
+    # each morph, also in worker processes. Cropping it and its norm
+    # depend on the common grid of each pair, so they are not shared.
+    tables = {morph_file: get_two_column_from_file(morph_file)}
 
     # Get list of files from target directory
     target_list = list(target_directory.iterdir())
@@ -1034,22 +1831,33 @@ def multiple_targets(parser, opts, pargs, stdout_flag=True, python_wrap=False):
             parser.morph_error(save_fail_message, FileNotFoundError)
 
     # Morph morph_file against all other files in target_directory
+    pargs_list = []
+    save_paths = []
+    for target_file in target_list:
+        # Set the save file destination to be a file within the SLOC
+        # directory
+        save_path = None
+        if save_directory is not None:
+            save_as = save_names[target_file.name][__save_morph_as__]
+            save_path = Path(save_morphs_here).joinpath(save_as)
+        pargs_list.append([morph_file, target_file])
+        save_paths.append(save_path)
+    anchor = _get_warm_start_anchor(parser, opts, target_list)
+    profile = Profiler(trace_memory=True) if opts.profile else None
+    results = _run_single_morphs(
+        parser,
+        opts,
+        pargs_list,
+        save_paths,
+        anchor=anchor,
+        profile=profile,
+        tables=tables,
+    )
     morph_results = {}
     uncs = {}
-    for target_file in target_list:
-        if target_file.is_file:
-            # Set the save file destination to be a file within the SLOC
-            # directory
-            if save_directory is not None:
-                save_as = save_names[target_file.name][__save_morph_as__]
-                opts.slocation = Path(save_morphs_here).joinpath(save_as)
-            # Perform a morph of morph_file against target_file
-            pargs = [morph_file, target_file]
-            morph_result, unc = single_morph(
-                parser, opts, pargs, stdout_flag=False
-            )
-            morph_results.update({target_file.name: morph_result})
-            uncs.update({target_file.name: unc})
+    for target_file, (morph_result, unc) in zip(target_list, results):
+        morph_results.update({target_file.name: morph_result})
+        uncs.update({target_file.name: unc})
 
     target_file_names = []
     for key in morph_results.keys():
@@ -1084,6 +1892,11 @@ def multiple_targets(parser, opts, pargs, stdout_flag=True, python_wrap=False):
         save_fail_message = "Unable to save summary to directory."
         parser.morph_error(save_fail_message, type(e))
 
+    if profile is not None:
+        profile.stop()
+        if stdout_flag:
+            print(profile.summary())
+
     # Plot the values of some parameter for each target if requested
     if plot_opt:
         plot_results = io.tabulate_results(morph_results)
@@ -1104,6 +1917,8 @@ def multiple_targets(parser, opts, pargs, stdout_flag=True, python_wrap=False):
                 KeyError,
             )
         else:
+            import diffpy.morph.plot as plot
+
             try:
                 if field_list is not None:
                     plot.plot_param(field_list, param_list, param_name, field)
@@ -1123,6 +1938,12 @@ def multiple_targets(parser, opts, pargs, stdout_flag=True, python_wrap=False):
 
 
 def multiple_morphs(parser, opts, pargs, stdout_flag=True, python_wrap=False):
+    # Each file is parsed once for sorting and morphing
+    with tools.file_cache():
+        return _multiple_morphs(parser, opts, pargs, stdout_flag, python_wrap)
+
+
+def _multiple_morphs(parser, opts, pargs, stdout_flag, python_wrap):
     # Custom error messages since usage is distinct when --multiple tag is
     # applied
     if len(pargs) < 2:
@@ -1136,6 +1957,11 @@ def multiple_morphs(parser, opts, pargs, stdout_flag=True, python_wrap=False):
             "Too many arguments. You must only supply a DIRECTORY and FILE.",
             TypeError,
         )
+    if opts.trace is not None:
+        parser.morph_error(
+            "--trace is not supported with --multiple-<targets/morphs>.",
+            ValueError,
+        )
 
     # Parse paths
     target_file = Path(pargs[1])
@@ -1150,6 +1976,10 @@ def multiple_morphs(parser, opts, pargs, stdout_flag=True, python_wrap=False):
             f"{morph_directory} is not a directory. Go to --help for usage.",
             NotADirectoryError,
         )
+    # Parse the fixed file once for all morphs and pass its arrays to
+    # each morph, also in worker processes. Cropping it and its norm
+    # depend on the common grid of each pair, so they are not shared.
+    tables = {target_file: get_two_column_from_file(target_file)}
 
     # Get list of files from morph directory
     morph_list = list(morph_directory.iterdir())
@@ -1227,23 +2057,34 @@ def multiple_morphs(parser, opts, pargs, stdout_flag=True, python_wrap=False):
             save_fail_message = "\nUnable to read from save names file"
             parser.morph_error(save_fail_message, FileNotFoundError)
 
-    # Morph morph_file against all other files in target_directory
+    # Morph all files in morph_directory against target_file
+    pargs_list = []
+    save_paths = []
+    for morph_file in morph_list:
+        # Set the save file destination to be a file within the SLOC
+        # directory
+        save_path = None
+        if save_directory is not None:
+            save_as = save_names[morph_file.name][__save_morph_as__]
+            save_path = Path(save_morphs_here).joinpath(save_as)
+        pargs_list.append([morph_file, target_file])
+        save_paths.append(save_path)
+    anchor = _get_warm_start_anchor(parser, opts, morph_list)
+    profile = Profiler(trace_memory=True) if opts.profile else None
+    results = _run_single_morphs(
+        parser,
+        opts,
+        pargs_list,
+        save_paths,
+        anchor=anchor,
+        profile=profile,
+        tables=tables,
+    )
     morph_results = {}
     uncs = {}
-    for morph_file in morph_list:
-        if morph_file.is_file:
-            # Set the save file destination to be a file within the SLOC
-            # directory
-            if save_directory is not None:
-                save_as = save_names[morph_file.name][__save_morph_as__]
-                opts.slocation = Path(save_morphs_here).joinpath(save_as)
-            # Perform a morph of morph_file against target_file
-            pargs = [morph_file, target_file]
-            morph_result, unc = single_morph(
-                parser, opts, pargs, stdout_flag=False
-            )
-            morph_results.update({morph_file.name: morph_result})
-            uncs.update({morph_file.name: unc})
+    for morph_file, (morph_result, unc) in zip(morph_list, results):
+        morph_results.update({morph_file.name: morph_result})
+        uncs.update({morph_file.name: unc})
 
     morph_file_names = []
     for key in morph_results.keys():
@@ -1279,6 +2120,11 @@ def multiple_morphs(parser, opts, pargs, stdout_flag=True, python_wrap=False):
         save_fail_message = "Unable to save summary to directory."
         parser.morph_error(save_fail_message, type(e))
 
+    if profile is not None:
+        profile.stop()
+        if stdout_flag:
+            print(profile.summary())
+
     # Plot the values of some parameter for each target if requested
     if plot_opt:
         plot_results = io.tabulate_results(morph_results)
@@ -1299,6 +2145,8 @@ def multiple_morphs(parser, opts, pargs, stdout_flag=True, python_wrap=False):
                 KeyError,
             )
         else:
+            import diffpy.morph.plot as plot
+
             try:
                 if field_list is not None:
                     plot.plot_param(field_list, param_list, param_name, field)
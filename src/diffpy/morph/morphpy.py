@@ -1,8 +1,19 @@
 #!/usr/bin/env python
 
+from contextlib import nullcontext
+
 import numpy as np
 
-from diffpy.morph.morphapp import create_option_parser, single_morph
+from diffpy.morph.morphapp import (
+    SingleMorphChain,
+    create_option_parser,
+    finish_single_morph,
+    get_two_column_from_file,
+    refine_single_morph,
+    single_morph,
+    single_morph_python_output,
+)
+from diffpy.morph.profiler import Profiler
 
 
 def get_args(parser, params, kwargs):
@@ -50,10 +61,13 @@ def __get_morph_opts__(parser, scale, stretch, smear, plot, **kwargs):
         "verbose",
         "pearson",
         "addpearson",
+        "separable",
+        "fuse-maps",
         "apply",
         "reverse",
         "diff",
         "get-diff",
+        "profile",
     ]
     opts_to_ignore = ["multiple-morphs", "multiple-targets"]
     for opt in opts_storing_values:
@@ -194,3 +208,139 @@ def morph_arrays(
         python_wrap=True,
         pymorphs=pymorphs,
     )
+
+
+class MorphSession(object):
+    """Reusable in-process morph with fixed options.
+
+    The options are parsed and the morph chain is built once, when the
+    session is created. Each morph then refines the chain from the
+    initial parameter values for new functions, without building an
+    option parser, converting the options to strings or formatting the
+    terminal output. The results are the same as those of `morph` and
+    `morph_arrays` with the same options.
+
+    Parameters
+    ----------
+    scale: float, optional
+        Initial guess for the scaling parameter.
+        Refinement is done only for parameter that are not None.
+    stretch: float, optional
+        Initial guess for the stretching parameter.
+    smear: float, optional
+        Initial guess for the smearing parameter.
+    kwargs: str, float, list, tuple, bool
+        See the diffpy.morph website for full list of options. Plotting
+        is not supported.
+
+    Attributes
+    ----------
+    chain: MorphChain
+        The morph chain, holding the functions of the last morph.
+    refpars: list
+        The names of the refined parameters.
+    profile: Profiler
+        With profile=True, the Profiler recording the morphs of this
+        session, otherwise None. See Profiler.summary and
+        Profiler.as_dict.
+
+    Examples
+    --------
+    session = MorphSession(scale=1.0, stretch=0.0, xmin=1, xmax=20)
+    for morph_table, target_table in pairs:
+        morph_info, morph_table = session.morph_arrays(
+            morph_table, target_table
+        )
+    """
+
+    def __init__(self, scale=None, stretch=None, smear=None, **kwargs):
+        self.parser = create_option_parser()
+        self.opts, pymorphs = __get_morph_opts__(
+            self.parser, scale, stretch, smear, False, **kwargs
+        )
+        self._compiled = SingleMorphChain(self.parser, self.opts, pymorphs)
+        self.chain = self._compiled.chain
+        self.refpars = self._compiled.refpars
+        self.profile = None
+        if self.opts.profile:
+            self.profile = Profiler(trace_memory=True)
+        return
+
+    def morph(self, morph_file, target_file):
+        """Morph the function of morph_file onto that of target_file.
+
+        Returns
+        -------
+        morph_info, morph_table
+            As for `morph`.
+        """
+        section = nullcontext()
+        if self.profile is not None:
+            section = self.profile.section("file I/O")
+        with section:
+            x_morph, y_morph = get_two_column_from_file(morph_file)
+            x_target, y_target = get_two_column_from_file(target_file)
+        if y_morph is None:
+            self.parser.morph_error(
+                f"No data table found in: {morph_file}.", ValueError
+            )
+        if y_target is None:
+            self.parser.morph_error(
+                f"No data table found in: {target_file}.", ValueError
+            )
+        return self._morph(x_morph, y_morph, x_target, y_target)
+
+    def morph_arrays(self, morph_table, target_table):
+        """Morph the function of morph_table onto that of target_table.
+
+        Parameters
+        ----------
+        morph_table: numpy.array
+            Two-column array of (r, gr) for morphed function.
+        target_table: numpy.array
+            Two-column array of (r, gr) for target function.
+
+        Returns
+        -------
+        morph_info, morph_table
+            As for `morph_arrays`.
+        """
+        morph_table = np.array(morph_table)
+        target_table = np.array(target_table)
+        return self._morph(
+            morph_table[:, 0],
+            morph_table[:, 1],
+            target_table[:, 0],
+            target_table[:, 1],
+        )
+
+    def _morph(self, x_morph, y_morph, x_target, y_target):
+        """Refine the chain from the initial values for new functions."""
+        opts = self.opts
+        chain, refpars, mrg, *checked_morphs = self._compiled.reset()
+        _, unc = refine_single_morph(
+            self.parser,
+            opts,
+            chain,
+            refpars,
+            x_morph,
+            y_morph,
+            x_target,
+            y_target,
+            stdout_flag=False,
+            profile=self.profile,
+        )
+        morph_results = finish_single_morph(
+            opts,
+            chain,
+            mrg,
+            checked_morphs,
+            x_morph,
+            y_morph,
+            x_target,
+            y_target,
+        )
+        return single_morph_python_output(opts, chain, morph_results, unc)
+
+
+# End class MorphSession
@@ -45,6 +45,33 @@ class Morph(object):
         Descriptive label for the y output array.
     parnames: list
         Names of configuration variables.
+    jacobian_parnames: list or None
+        Names of configuration variables for which the morph provides
+        analytic derivatives. None if the morph does not implement
+        jacobian.
+    batchable: bool
+        True if morph evaluates a batch of functions at once. A batch
+        holds the y arrays of n functions on a shared x grid as arrays of
+        shape (n, len(x)), and the parameters of each function as arrays
+        of shape (n, 1). MorphChain evaluates morphs that are not
+        batchable one function at a time.
+    maps_coordinates: bool
+        True if the morph keeps the x grid and resamples the morph
+        function as y_out(x) = a * y_in(u(x)) + b, see coordinate_map.
+        MorphChain can fuse consecutive morphs of this kind, so that the
+        function is resampled only once.
+    interpolates_output: bool
+        True if the morph can evaluate its output between the grid
+        points, see interpolate_output. MorphChain can fuse the
+        coordinate maps that follow the morph into this interpolation.
+    applies_envelope: bool
+        True if the morph keeps the x grid and multiplies the morph
+        function by an envelope, see envelope. MorphChain can fuse
+        consecutive morphs of this kind into a single multiplication.
+    memoizable: bool
+        True if the outputs of the morph only depend on its inputs and
+        the config values of its parnames. MorphChain can then reuse an
+        earlier evaluation, see MorphChain.memo_size.
 
     Instance Attributes
     -------------------
@@ -89,6 +116,12 @@ class Morph(object):
     xoutlabel = "x"
     youtlabel = "y"
     parnames = []
+    jacobian_parnames = None
+    batchable = False
+    maps_coordinates = False
+    interpolates_output = False
+    applies_envelope = False
+    memoizable = True
 
     # Properties
 
@@ -158,15 +191,21 @@ class Morph(object):
         tuple
             A tuple of numpy arrays
             (x_morph_out, y_morph_out, x_target_out, y_target_out)
+
+        Notes
+        -----
+            The outputs are read-only views of the inputs. A derived class
+            replaces the outputs it changes by new arrays instead of
+            modifying them in place.
         """
         self.x_morph_in = x_morph
         self.y_morph_in = y_morph
         self.x_target_in = x_target
         self.y_target_in = y_target
-        self.x_morph_out = x_morph.copy()
-        self.y_morph_out = y_morph.copy()
-        self.x_target_out = x_target.copy()
-        self.y_target_out = y_target.copy()
+        self.x_morph_out = _readonly(x_morph)
+        self.y_morph_out = _readonly(y_morph)
+        self.x_target_out = _readonly(x_target)
+        self.y_target_out = _readonly(y_target)
         self.checkConfig()
         return self.xyallout
 
@@ -174,6 +213,252 @@ class Morph(object):
         """Alias for morph."""
         return self.morph(x_morph, y_morph, x_target, y_target)
 
+    def batch_size(self, y_morph, y_target):
+        """Get the number of functions in a batch.
+
+        Parameters
+        ----------
+        y_morph, y_target
+            Morphed and target y arrays.
+
+        Returns
+        -------
+        int or None
+            The number of functions, or None if neither the arrays nor
+            the parameters of this morph are batched.
+        """
+        for y in (y_morph, y_target):
+            if numpy.ndim(y) > 1:
+                return len(y)
+        for name in self.parnames:
+            value = self.config.get(name)
+            if isinstance(value, dict):
+                value = next(iter(value.values()), None)
+            if numpy.ndim(value) > 1:
+                return len(value)
+        return None
+
+    def morph_rows(self, x_morph, y_morph, x_target, y_target):
+        """Morph a batch of functions one function at a time.
+
+        This is how MorphChain evaluates morphs that are not batchable.
+        The outputs are stacked into arrays of shape (n, len(x)).
+
+        Parameters
+        ----------
+        x_morph, y_morph
+            Morphed arrays.
+        x_target, y_target
+            Target arrays.
+
+        Returns
+        -------
+        tuple
+            A tuple of numpy arrays
+            (x_morph_out, y_morph_out, x_target_out, y_target_out)
+
+        Raises
+        ------
+        ValueError
+            The morph changes the x grid differently for each function.
+        """
+        nbatch = self.batch_size(y_morph, y_target)
+        saved = {
+            name: self.config[name]
+            for name in self.parnames
+            if name in self.config
+        }
+        rows = []
+        try:
+            for idx in range(nbatch):
+                for name, value in saved.items():
+                    self.config[name] = _batch_row(value, idx)
+                rows.append(
+                    self.morph(
+                        x_morph,
+                        y_morph[idx] if numpy.ndim(y_morph) > 1 else y_morph,
+                        x_target,
+                        (
+                            y_target[idx]
+                            if numpy.ndim(y_target) > 1
+                            else y_target
+                        ),
+                    )
+                )
+        finally:
+            self.config.update(saved)
+        x_morph_out, _, x_target_out, _ = rows[0]
+        for row in rows[1:]:
+            if not (
+                numpy.array_equal(row[0], x_morph_out)
+                and numpy.array_equal(row[2], x_target_out)
+            ):
+                emsg = "%s does not keep a shared grid for a batch" % (
+                    type(self).__name__
+                )
+                raise ValueError(emsg)
+        self.x_morph_in = x_morph
+        self.y_morph_in = y_morph
+        self.x_target_in = x_target
+        self.y_target_in = y_target
+        self.x_morph_out = x_morph_out
+        self.y_morph_out = numpy.array([row[1] for row in rows])
+        self.x_target_out = x_target_out
+        self.y_target_out = numpy.array([row[3] for row in rows])
+        return self.xyallout
+
+    def coordinate_map(self, x):
+        """Get the coordinate map of the morph.
+
+        This should be overloaded in a derived class with
+        maps_coordinates.
+
+        Parameters
+        ----------
+        x
+            The points at which the morphed function is evaluated.
+
+        Returns
+        -------
+        tuple
+            (u, a, b) where u are the points at which the input function
+            is sampled, and a and b the factor and offset applied to the
+            sampled values.
+
+        Raises
+        ------
+        NotImplementedError
+            The morph is not a coordinate map.
+        """
+        emsg = "%s is not a coordinate map" % type(self).__name__
+        raise NotImplementedError(emsg)
+
+    def envelope(self, x):
+        """Get the envelope the morph multiplies the morph function by.
+
+        This should be overloaded in a derived class with
+        applies_envelope.
+
+        Parameters
+        ----------
+        x
+            The x grid of the morph function.
+
+        Returns
+        -------
+        float or numpy.ndarray
+            The envelope at x.
+
+        Raises
+        ------
+        NotImplementedError
+            The morph does not apply an envelope.
+        """
+        emsg = "%s does not apply an envelope" % type(self).__name__
+        raise NotImplementedError(emsg)
+
+    def interpolate_output(self, x):
+        """Evaluate the output of the last morph at the points x.
+
+        This should be overloaded in a derived class with
+        interpolates_output.
+
+        Parameters
+        ----------
+        x
+            Points within the x grid of the morph output.
+
+        Returns
+        -------
+        numpy.ndarray
+            The morphed function at x.
+
+        Raises
+        ------
+        NotImplementedError
+            The morph cannot interpolate its output.
+        """
+        emsg = "%s does not interpolate its output" % type(self).__name__
+        raise NotImplementedError(emsg)
+
+    def jacobian(self, pars, dy_morph, dy_target):
+        """Propagate parameter derivatives through the last morph.
+
+        This uses the arrays stored by the last call to morph, so it
+        must be called after morph with the same configuration.
+        This method should be overloaded in a derived class.
+
+        Parameters
+        ----------
+        pars: list
+            List of (name, subkey) tuples labelling the columns of the
+            derivative arrays. subkey is None for scalar parameters.
+        dy_morph, dy_target
+            Derivatives of y_morph_in and y_target_in with respect to the
+            parameters, with shape (len(y), len(pars)).
+
+        Returns
+        -------
+        tuple
+            Derivatives of y_morph_out and y_target_out
+            (dy_morph_out, dy_target_out).
+
+        Raises
+        ------
+        NotImplementedError
+            The morph does not provide analytic derivatives.
+        """
+        emsg = "%s does not provide a jacobian" % type(self).__name__
+        raise NotImplementedError(emsg)
+
+    def stationary_starts(self, pars, x_morph):
+        """Get starting values that move refined parameters off points
+        where the residual is stationary.
+
+        A refinement cannot leave a point where the derivative of the
+        residual with respect to a parameter vanishes. The Refiner tries
+        these values and keeps them if they lower the residual.
+        This method should be overloaded in a derived class with such
+        points.
+
+        Parameters
+        ----------
+        pars: list
+            List of (name, subkey) tuples of refined parameters.
+        x_morph
+            The x values of the morph function.
+
+        Returns
+        -------
+        dict
+            The starting value of each parameter at a stationary point.
+        """
+        return {}
+
+    def supports_jacobian(self, pars):
+        """Check if jacobian can provide derivatives for pars.
+
+        Parameters
+        ----------
+        pars: list
+            List of (name, subkey) tuples of refined parameters.
+
+        Returns
+        -------
+        bool
+            True if every refined parameter used by this morph has an
+            analytic derivative.
+        """
+        if self.jacobian_parnames is None:
+            return False
+        names = set(name for name, _ in pars)
+        used = names.intersection(self.parnames)
+        return used.issubset(self.jacobian_parnames)
+
+    def _parameter_columns(self, pars, name):
+        """Get the derivative columns that belong to parameter name."""
+        return [idx for idx, (pname, _) in enumerate(pars) if pname == name]
+
     def applyConfig(self, config):
         """Process any configuration data from a dictionary.
 
@@ -259,11 +544,16 @@ class Morph(object):
         x_extrapolate : array
             x values after a morphing process
         """
-        cutoff_low = min(x_true)
-        extrap_low_x = numpy.where(x_extrapolate < cutoff_low)[0]
+        x_low = x_high = x_extrapolate
+        if numpy.ndim(x_extrapolate) > 1:
+            # Report the extremes over a batch of functions
+            x_low = numpy.min(x_extrapolate, axis=0)
+            x_high = numpy.max(x_extrapolate, axis=0)
+        cutoff_low = numpy.min(x_true)
+        extrap_low_x = numpy.where(x_low < cutoff_low)[0]
         is_extrap_low = False if len(extrap_low_x) == 0 else True
-        cutoff_high = max(x_true)
-        extrap_high_x = numpy.where(x_extrapolate > cutoff_high)[0]
+        cutoff_high = numpy.max(x_true)
+        extrap_high_x = numpy.where(x_high > cutoff_high)[0]
         is_extrap_high = False if len(extrap_high_x) == 0 else True
         extrap_index_low = extrap_low_x[-1] if is_extrap_low else 0
         extrap_index_high = extrap_high_x[0] if is_extrap_high else -1
@@ -294,8 +584,10 @@ class Morph(object):
         AttributeError
             Name is not available from self.config.
         """
-        if name in self.config:
-            return self.config[name]
+        # config is missing while unpickling
+        config = self.__dict__.get("config", {})
+        if name in config:
+            return config[name]
         else:
             emsg = "Object has no attribute %r" % name
             raise AttributeError(emsg)
@@ -318,3 +610,92 @@ class Morph(object):
 
 
 # End class Morph
+
+
+def _readonly(a):
+    """Get a read-only view of the array a."""
+    view = numpy.asarray(a).view()
+    view.flags.writeable = False
+    return view
+
+
+def _interp_weights(x, xp):
+    """Get indices and weights that reproduce numpy.interp(x, xp, fp).
+
+    Parameters
+    ----------
+    x
+        The x-coordinates at which to interpolate.
+    xp
+        The increasing x-coordinates of the data points.
+
+    Returns
+    -------
+    tuple
+        (idx, w) such that interpolation is fp[idx] * (1 - w)
+        + fp[idx + 1] * w. Points outside of xp are clamped to the
+        end values like numpy.interp.
+    """
+    idx = numpy.searchsorted(xp, x, side="right") - 1
+    idx = numpy.clip(idx, 0, len(xp) - 2)
+    w = (x - xp[idx]) / (xp[idx + 1] - xp[idx])
+    w = numpy.clip(w, 0.0, 1.0)
+    return idx, w
+
+
+def _interp_apply(idx, w, fp):
+    """Interpolate fp (1D or 2D along axis 0) using _interp_weights."""
+    if fp.ndim > 1:
+        w = w[:, numpy.newaxis]
+    return fp[idx] * (1.0 - w) + fp[idx + 1] * w
+
+
+def _batch_interp(x, xp, fp):
+    """Compute numpy.interp(x, xp, fp) along the last axis.
+
+    Parameters
+    ----------
+    x
+        The x-coordinates at which to interpolate, with shape (len,) or
+        (n, len) for a batch.
+    xp
+        The increasing x-coordinates of the data points.
+    fp
+        The y-coordinates of the data points, with shape (len(xp),) or
+        (n, len(xp)) for a batch.
+    """
+    if numpy.ndim(x) == 1 and numpy.ndim(fp) == 1:
+        return numpy.interp(x, xp, fp)
+    idx, w = _interp_weights(x, xp)
+    if numpy.ndim(fp) == 1:
+        return fp[idx] * (1.0 - w) + fp[idx + 1] * w
+    if numpy.ndim(x) == 1:
+        return fp[:, idx] * (1.0 - w) + fp[:, idx + 1] * w
+    # Gather from the flattened rows of fp
+    idx = idx + len(xp) * numpy.arange(len(fp))[:, numpy.newaxis]
+    fp = fp.ravel()
+    return fp[idx] * (1.0 - w) + fp[idx + 1] * w
+
+
+def _batch_row(value, idx):
+    """Get the parameter value of function idx of a batch."""
+    if isinstance(value, dict):
+        return {key: _batch_row(val, idx) for key, val in value.items()}
+    if numpy.ndim(value) > 1:
+        return value[idx, 0]
+    return value
+
+
+def _interp_slope(x, xp, fp):
+    """Derivative of numpy.interp(x, xp, fp) with respect to x.
+
+    The slope of the linear segment containing each point of x. Points
+    that coincide with xp take the slope of the segment to their left,
+    which is the one-sided derivative for decreasing x. This is zero
+    outside of xp, where numpy.interp returns constant end values.
+    """
+    idx = numpy.searchsorted(xp, x, side="left") - 1
+    idx = numpy.clip(idx, 0, len(xp) - 2)
+    slope = (fp[idx + 1] - fp[idx]) / (xp[idx + 1] - xp[idx])
+    slope[(x < xp[0]) | (x > xp[-1])] = 0
+    return slope
@@ -14,7 +14,11 @@
 ##############################################################################
 """MorphChain -- Chain of morphs executed in order."""
 
-# Comment required to resolve black/docformatter conflict
+from contextlib import nullcontext
+
+import numpy
+
+from diffpy.morph.morphs.morph import _batch_interp, _readonly
 
 
 class MorphChain(list):
@@ -30,6 +34,35 @@ class MorphChain(list):
     -------------------
     config: dict
         All configuration variables.
+    fuse_maps: bool
+        Evaluate consecutive coordinate maps (see Morph.maps_coordinates)
+        with a single resampling of the morph function (default False).
+        Coordinate maps that follow a morph with interpolates_output are
+        evaluated with the interpolation of that morph. This saves the
+        cost and the smoothing of repeated interpolation. The inputs and
+        outputs of the fused morphs between the first and last one are
+        None until expand_fused is called.
+    fuse_envelopes: bool
+        Evaluate consecutive morphs that multiply the morph function by
+        an envelope (see Morph.applies_envelope) with a single
+        multiplication into one output array (default False). As with
+        fuse_maps, the intermediate inputs and outputs are None until
+        expand_fused is called.
+    memo_size: int
+        Number of evaluations of each morph kept for reuse (default 0,
+        which disables this). A Refiner enables it while refining. A
+        morph is not evaluated again when its inputs are the same arrays
+        and the config values of its parnames are the same as in a kept
+        evaluation; its outputs and attributes are restored instead.
+        When a single parameter changes, as in finite differences, only
+        the morphs from the first one that reads it are evaluated. This
+        assumes that the arrays are not modified in place. Morphs that
+        are not memoizable, such as those calling user functions, are
+        always evaluated.
+    profile: diffpy.morph.profiler.Profiler
+        When set, each morph is recorded as a section named after its
+        class, and fused runs as the class names joined by "+". Reused
+        evaluations are counted as "<class> reused" (default None).
 
     Properties
     ----------
@@ -123,6 +156,15 @@ class MorphChain(list):
             morphs.
         """
         self.config = config
+        self.fuse_maps = False
+        self.fuse_envelopes = False
+        self.memo_size = 0
+        self.profile = None
+        # index -> list of (morph, inputs, parameters, outputs, attributes)
+        # of the kept evaluations, the most recently used last
+        self._memo = {}
+        # (start, stop, inputs) of the fused runs of the last morph
+        self._fused = []
         self.extend(args)
         return
 
@@ -145,17 +187,328 @@ class MorphChain(list):
         Notes
         -----
             Config may be altered by the morphs.
+
+            The chain also morphs a batch of functions on shared x grids.
+            The y arrays then have shape (n, len(x)) and batched parameters
+            in config are arrays of shape (n, 1). Morphs that are not
+            batchable are evaluated one function at a time.
         """
         xyall = (x_morph, y_morph, x_target, y_target)
-        for morph in self:
+        self._fused = []
+        idx = 0
+        while idx < len(self):
+            morph = self[idx]
             morph.applyConfig(self.config)
-            xyall = morph(*xyall)
+            stop = self._map_run(idx) if self.fuse_maps else idx
+            if stop - idx > 1:
+                with self._section(idx, stop):
+                    xyall = self._morph_fused(idx, stop, xyall)
+                idx = stop
+                continue
+            stop = self._envelope_run(idx, xyall)
+            if stop - idx > 1:
+                with self._section(idx, stop):
+                    xyall = self._morph_envelopes(idx, stop, xyall)
+                idx = stop
+                continue
+            batched = morph.batch_size(xyall[1], xyall[3])
+            with self._section(idx, idx + 1):
+                xyall = self._morph_stage(idx, xyall, batched)
+            idx += 1
+            if morph.interpolates_output and not batched and self.fuse_maps:
+                stop = self._map_run(idx)
+                if stop > idx:
+                    with self._section(idx, stop):
+                        xyall = self._morph_fused(idx, stop, xyall, morph)
+                    idx = stop
         return xyall
 
+    def evaluate_batch(
+        self, P, x_morph, y_morph, x_target, y_target, pars=None
+    ):
+        """Evaluate the residuals of many parameter sets at once.
+
+        The chain is evaluated once for the whole batch, with the
+        parameters as batched config values of shape (n_sets, 1).
+
+        Parameters
+        ----------
+        P
+            Array of shape (n_sets, n_params) with one set of parameter
+            values per row.
+        x_morph, y_morph
+            Morphed arrays.
+        x_target, y_target
+            Target arrays.
+        pars: list, optional
+            Names of the config parameters set by the columns of P. A
+            parameter with a dict value, such as squeeze, takes one column
+            for each of its keys in the order of the dict. Defaults to
+            all config keys, as in Refiner.refine.
+
+        Returns
+        -------
+        numpy.ndarray
+            The residuals y_target_out - y_morph_out with shape
+            (n_sets, len(x_morph_out)).
+
+        Raises
+        ------
+        ValueError
+            P does not have one column for each parameter value.
+
+        Notes
+        -----
+            The config is restored afterwards.
+        """
+        if pars is None:
+            pars = list(self.config.keys())
+        P = numpy.asarray(P, dtype=float)
+        columns = []
+        for name in pars:
+            value = self.config[name]
+            if isinstance(value, dict):
+                columns.extend((name, key) for key in value)
+            else:
+                columns.append((name, None))
+        if P.ndim != 2 or P.shape[1] != len(columns):
+            emsg = "P must have shape (n_sets, %d), got %s" % (
+                len(columns),
+                P.shape,
+            )
+            raise ValueError(emsg)
+
+        saved = {name: self.config[name] for name in pars}
+        batch = {
+            name: dict(value) if isinstance(value, dict) else value
+            for name, value in saved.items()
+        }
+        for col, (name, key) in enumerate(columns):
+            if key is None:
+                batch[name] = P[:, col, numpy.newaxis]
+            else:
+                batch[name][key] = P[:, col, numpy.newaxis]
+        try:
+            self.config.update(batch)
+            _, y_morph_out, _, y_target_out = self.morph(
+                x_morph, y_morph, x_target, y_target
+            )
+        finally:
+            self.config.update(saved)
+        rvec = y_target_out - y_morph_out
+        if rvec.ndim == 1:
+            # None of the parameters changes the residual
+            rvec = numpy.tile(rvec, (len(P), 1))
+        return rvec
+
+    def _morph_stage(self, idx, xyall, batched):
+        """Evaluate morph idx, or reuse a kept evaluation."""
+        morph = self[idx]
+        if self.memo_size <= 0 or not morph.memoizable:
+            self._memo.pop(idx, None)
+            memo = []
+        else:
+            memo = self._memo.setdefault(idx, [])
+        params = {
+            name: _snapshot(self.config[name])
+            for name in morph.parnames
+            if name in self.config
+        }
+        for pos, entry in enumerate(memo):
+            if (
+                entry[0] is morph
+                and _same_arrays(entry[1], xyall)
+                and _same_value(entry[2], params)
+            ):
+                memo.append(memo.pop(pos))
+                morph.__dict__.update(entry[4])
+                if self.profile is not None:
+                    self.profile.count(f"{type(morph).__name__} reused")
+                return entry[3]
+        if not morph.batchable and batched:
+            xyallout = morph.morph_rows(*xyall)
+        else:
+            xyallout = morph(*xyall)
+        if self.memo_size > 0 and morph.memoizable:
+            entry = (morph, xyall, params, xyallout, dict(morph.__dict__))
+            memo.append(entry)
+            del memo[: -self.memo_size]
+        return xyallout
+
+    def clear_memo(self):
+        """Remove the kept evaluations of the morphs."""
+        self._memo.clear()
+        return
+
+    def _section(self, start, stop):
+        """Profile section of the morphs start to stop, if profiling."""
+        if self.profile is None:
+            return nullcontext()
+        name = "+".join(type(morph).__name__ for morph in self[start:stop])
+        return self.profile.section(name)
+
+    def _map_run(self, start):
+        """Get the end of the coordinate maps that begin at start."""
+        stop = start
+        while stop < len(self) and self[stop].maps_coordinates:
+            stop += 1
+        return stop
+
+    def _envelope_run(self, start, xyall):
+        """Get the end of the envelope morphs that begin at start."""
+        if not self.fuse_envelopes:
+            return start
+        stop = start
+        while stop < len(self) and self[stop].applies_envelope:
+            self[stop].applyConfig(self.config)
+            stop += 1
+        run = self[start:stop]
+        # Non-batchable envelopes cannot be evaluated for a batch at once
+        if not all(m.batchable for m in run) and any(
+            m.batch_size(xyall[1], xyall[3]) for m in run
+        ):
+            return start
+        return stop
+
+    def _morph_envelopes(self, start, stop, xyall):
+        """Multiply the morph function by the envelopes of morphs start
+        to stop at once."""
+        x_morph, y_morph, x_target, y_target = xyall
+        run = self[start:stop]
+        envelopes = [morph.envelope(x_morph) for morph in run]
+        shapes = [numpy.shape(e) for e in envelopes]
+        y = numpy.empty(numpy.broadcast_shapes(numpy.shape(y_morph), *shapes))
+        y[...] = y_morph
+        for e in envelopes:
+            y *= e
+
+        xyallout = (
+            _readonly(x_morph),
+            y,
+            _readonly(x_target),
+            _readonly(y_target),
+        )
+        self._set_fused_state(run, xyall, xyallout)
+        self._fused.append((start, stop, xyall))
+        return xyallout
+
+    def _set_fused_state(self, run, xyall, xyallout):
+        """Set the inputs and outputs of a fused run of morphs.
+
+        Only the first input and the last output of the morph function
+        are known, the others are set to None.
+        """
+        x_morph, y_morph, x_target, y_target = xyall
+        for morph in run:
+            morph.x_morph_in, morph.y_morph_in = x_morph, None
+            morph.x_target_in, morph.y_target_in = x_target, y_target
+            morph.x_morph_out, morph.y_morph_out = xyallout[0], None
+            morph.x_target_out, morph.y_target_out = xyallout[2:]
+        run[0].y_morph_in = y_morph
+        run[-1].y_morph_out = xyallout[1]
+        return
+
+    def _morph_fused(self, start, stop, xyall, head=None):
+        """Evaluate the coordinate maps of morphs start to stop at once.
+
+        The morph function is resampled with linear interpolation, or
+        with the interpolation of head, the morph that produced xyall.
+        """
+        x_morph, y_morph, x_target, y_target = xyall
+        run = self[start:stop]
+        # Compose the maps from the last to the first
+        u = x_morph
+        factor = 1
+        offset = 0
+        for morph in reversed(run):
+            morph.applyConfig(self.config)
+            u, a, b = morph.coordinate_map(u)
+            offset = offset + factor * b
+            factor = factor * a
+        if head is None:
+            y = _batch_interp(u, x_morph, y_morph)
+        else:
+            y = head.interpolate_output(u.clip(x_morph[0], x_morph[-1]))
+        y = factor * y + offset
+
+        xyallout = (
+            _readonly(x_morph),
+            y,
+            _readonly(x_target),
+            _readonly(y_target),
+        )
+        self._set_fused_state(run, xyall, xyallout)
+        for morph in run:
+            u = morph.coordinate_map(x_morph)[0]
+            if u is not x_morph:
+                morph.set_extrapolation_info(x_morph, u)
+        self._fused.append((start, stop, xyall))
+        return xyallout
+
+    def expand_fused(self):
+        """Evaluate the inputs and outputs of all fused morphs.
+
+        The outputs of the last morph of each fused run are kept, so the
+        chain output does not change.
+        """
+        for start, stop, xyall in self._fused:
+            last = self[stop - 1]
+            xyallout = last.xyallout
+            for morph in self[start:stop]:
+                morph.applyConfig(self.config)
+                xyall = morph(*xyall)
+            (
+                last.x_morph_out,
+                last.y_morph_out,
+                last.x_target_out,
+                last.y_target_out,
+            ) = xyallout
+        self._fused = []
+        return
+
     def __call__(self, x_morph, y_morph, x_target, y_target):
         """Alias for morph."""
         return self.morph(x_morph, y_morph, x_target, y_target)
 
+    def jacobian(self, pars, dy_morph, dy_target):
+        """Propagate parameter derivatives through the chain.
+
+        The derivatives of each morph are combined with the chain rule.
+        This uses the arrays stored by the last call to morph.
+
+        Parameters
+        ----------
+        pars: list
+            List of (name, subkey) tuples labelling the columns of the
+            derivative arrays. subkey is None for scalar parameters.
+        dy_morph, dy_target
+            Derivatives of y_morph and y_target input to the chain.
+
+        Returns
+        -------
+        tuple
+            Derivatives of the chain outputs (dy_morph_out, dy_target_out).
+        """
+        self.expand_fused()
+        for morph in self:
+            dy_morph, dy_target = morph.jacobian(pars, dy_morph, dy_target)
+        return dy_morph, dy_target
+
+    def supports_jacobian(self, pars):
+        """Check if every morph in the chain provides derivatives for
+        pars."""
+        for morph in self:
+            morph.applyConfig(self.config)
+        return all(morph.supports_jacobian(pars) for morph in self)
+
+    def stationary_starts(self, pars, x_morph):
+        """Collect the stationary_starts of the morphs in the chain."""
+        starts = {}
+        for morph in self:
+            morph.applyConfig(self.config)
+            starts.update(morph.stationary_starts(pars, x_morph))
+        return starts
+
     def __getattr__(self, name):
         """Obtain the value from self.config, when normal lookup fails.
 
@@ -173,8 +526,10 @@ class MorphChain(list):
         AttributeError
             Name is not available from self.config.
         """
-        if name in self.config:
-            return self.config[name]
+        # config is missing while unpickling
+        config = self.__dict__.get("config", {})
+        if name in config:
+            return config[name]
         else:
             emsg = "Object has no attribute %r" % name
             raise AttributeError(emsg)
@@ -197,3 +552,44 @@ class MorphChain(list):
 
 
 # End class MorphChain
+
+
+def _snapshot(value):
+    """Copy a config value for comparison with later values."""
+    if isinstance(value, dict):
+        return {key: _snapshot(val) for key, val in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_snapshot(val) for val in value)
+    if isinstance(value, numpy.ndarray):
+        return value.copy()
+    return value
+
+
+def _same_value(a, b):
+    """Check if the config values a and b are the same."""
+    if isinstance(a, dict) or isinstance(b, dict):
+        return (
+            isinstance(a, dict)
+            and isinstance(b, dict)
+            and a.keys() == b.keys()
+            and all(_same_value(a[key], b[key]) for key in a)
+        )
+    if isinstance(a, (list, tuple)) or isinstance(b, (list, tuple)):
+        return (
+            type(a) is type(b)
+            and len(a) == len(b)
+            and all(_same_value(x, y) for x, y in zip(a, b))
+        )
+    if isinstance(a, numpy.ndarray) or isinstance(b, numpy.ndarray):
+        return numpy.shape(a) == numpy.shape(b) and numpy.array_equal(a, b)
+    if a is b:
+        return True
+    try:
+        return bool(a == b)
+    except (TypeError, ValueError):
+        return False
+
+
+def _same_arrays(a, b):
+    """Check if the tuples a and b hold the same objects."""
+    return len(a) == len(b) and all(x is y for x, y in zip(a, b))
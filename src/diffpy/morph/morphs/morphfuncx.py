@@ -76,6 +76,8 @@ class MorphFuncx(Morph):
     xoutlabel = LABEL_RA
     youtlabel = LABEL_GR
     parnames = ["funcx_function", "funcx"]
+    # The user function may not be pure
+    memoizable = False
 
     def morph(self, x_morph, y_morph, x_target, y_target):
         """Apply the user-supplied Python function to the x-coordinates
@@ -74,6 +74,8 @@ class MorphFuncxy(Morph):
     xoutlabel = LABEL_RA
     youtlabel = LABEL_GR
     parnames = ["funcxy_function", "funcxy"]
+    # The user function may not be pure
+    memoizable = False
 
     def morph(self, x_morph, y_morph, x_target, y_target):
         """Apply the user-supplied Python function to the y-coordinates
@@ -67,6 +67,8 @@ class MorphFuncy(Morph):
     xoutlabel = LABEL_RA
     youtlabel = LABEL_GR
     parnames = ["funcy_function", "funcy"]
+    # The user function may not be pure
+    memoizable = False
 
     def morph(self, x_morph, y_morph, x_target, y_target):
         """Apply the user-supplied Python function to the y-coordinates
@@ -18,7 +18,12 @@ MorphISpheroid -- apply inverse spheroidal shape function."""
 import numpy
 
 from diffpy.morph.morphs.morph import LABEL_GR, LABEL_RA, Morph
-from diffpy.morph.morphs.morphshape import _sphericalCF, _spheroidalCF
+from diffpy.morph.morphs.morphshape import (
+    _central_difference,
+    _sphericalCF,
+    _sphericalCF_derivative,
+    _spheroidalCF,
+)
 
 
 class MorphISphere(Morph):
@@ -37,16 +42,33 @@ class MorphISphere(Morph):
     xoutlabel = LABEL_RA
     youtlabel = LABEL_GR
     parnames = ["iradius"]
+    jacobian_parnames = ["iradius"]
+    applies_envelope = True
 
     def morph(self, x_morph, y_morph, x_target, y_target):
         """Apply a scale factor."""
         Morph.morph(self, x_morph, y_morph, x_target, y_target)
         f = _sphericalCF(x_morph, 2 * self.iradius)
         with numpy.errstate(divide="ignore", invalid="ignore"):
-            self.y_morph_out /= f
+            self.y_morph_out = self.y_morph_in / f
         self.y_morph_out[f == 0] = 0
         return self.xyallout
 
+    def envelope(self, x):
+        """Inverse of the spherical characteristic function, zero where
+        the function vanishes."""
+        return _inverse(_sphericalCF(x, 2 * self.iradius))
+
+    def jacobian(self, pars, dy_morph, dy_target):
+        """Propagate derivatives through the inverse characteristic
+        function."""
+        r = self.x_morph_in
+        f = _sphericalCF(r, 2 * self.iradius)
+        dfdp = {}
+        if self._parameter_columns(pars, "iradius"):
+            dfdp["iradius"] = 2 * _sphericalCF_derivative(r, 2 * self.iradius)
+        return _inverse_cf_jacobian(self, pars, f, dfdp, dy_morph, dy_target)
+
 
 # End of class MorphISphere
 
@@ -69,15 +91,65 @@ class MorphISpheroid(Morph):
     xoutlabel = LABEL_RA
     youtlabel = LABEL_GR
     parnames = ["iradius", "ipradius"]
+    jacobian_parnames = ["iradius", "ipradius"]
+    applies_envelope = True
 
     def morph(self, x_morph, y_morph, x_target, y_target):
         """Apply a scale factor."""
         Morph.morph(self, x_morph, y_morph, x_target, y_target)
         f = _spheroidalCF(x_morph, self.iradius, self.ipradius)
         with numpy.errstate(divide="ignore", invalid="ignore"):
-            self.y_morph_out /= f
+            self.y_morph_out = self.y_morph_in / f
         self.y_morph_out[f == 0] = 0
         return self.xyallout
 
+    def envelope(self, x):
+        """Inverse of the spheroidal characteristic function, zero where
+        the function vanishes."""
+        return _inverse(_spheroidalCF(x, self.iradius, self.ipradius))
+
+    def supports_jacobian(self, pars):
+        """Check if jacobian can provide derivatives for pars.
+
+        As for MorphSpheroid, a refinement of the radii starting from a
+        sphere is left to finite differences.
+        """
+        if self.iradius == self.ipradius and any(
+            self._parameter_columns(pars, name) for name in self.parnames
+        ):
+            return False
+        return Morph.supports_jacobian(self, pars)
+
+    def jacobian(self, pars, dy_morph, dy_target):
+        """Propagate derivatives through the inverse characteristic
+        function."""
+        r = self.x_morph_in
+        radii = [self.iradius, self.ipradius]
+        f = _spheroidalCF(r, *radii)
+        dfdp = {}
+        for pidx, name in enumerate(self.parnames):
+            if self._parameter_columns(pars, name):
+                dfdp[name] = _central_difference(_spheroidalCF, r, radii, pidx)
+        return _inverse_cf_jacobian(self, pars, f, dfdp, dy_morph, dy_target)
+
 
 # End of class MorphSpheroid
+
+
+def _inverse_cf_jacobian(morph, pars, f, dfdp, dy_morph, dy_target):
+    """Propagate derivatives through division by a characteristic
+    function f, where dfdp maps parameter names to derivatives of f."""
+    finv = _inverse(f)
+    dy_morph = dy_morph * finv[:, numpy.newaxis]
+    for name, dfdx in dfdp.items():
+        for col in morph._parameter_columns(pars, name):
+            dy_morph[:, col] -= morph.y_morph_in * dfdx * finv**2
+    return dy_morph, dy_target
+
+
+def _inverse(f):
+    """Get 1 / f, with zeros where f is zero."""
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        finv = 1.0 / f
+    finv[f == 0] = 0
+    return finv
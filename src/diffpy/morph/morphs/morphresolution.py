@@ -40,13 +40,28 @@ class MorphResolutionDamping(Morph):
     xoutlabel = LABEL_RA
     youtlabel = LABEL_RR
     parnames = ["qdamp"]
+    jacobian_parnames = ["qdamp"]
+    batchable = True
+    applies_envelope = True
 
     def morph(self, x_morph, y_morph, x_target, y_target):
         """Apply a resolution damping."""
         Morph.morph(self, x_morph, y_morph, x_target, y_target)
-        b = numpy.exp(-0.5 * (self.x_morph_in * self.qdamp) ** 2)
-        self.y_morph_out *= b
+        self.y_morph_out = self.y_morph_out * self.envelope(self.x_morph_in)
         return self.xyallout
 
+    def envelope(self, x):
+        """Gaussian damping of width 1 / qdamp."""
+        return numpy.exp(-0.5 * (x * self.qdamp) ** 2)
+
+    def jacobian(self, pars, dy_morph, dy_target):
+        """Propagate derivatives through the resolution damping."""
+        x2 = self.x_morph_in**2
+        b = numpy.exp(-0.5 * x2 * self.qdamp**2)
+        dy_morph = dy_morph * b[:, numpy.newaxis]
+        for col in self._parameter_columns(pars, "qdamp"):
+            dy_morph[:, col] -= self.y_morph_in * x2 * self.qdamp * b
+        return dy_morph, dy_target
+
 
 # End of class MorphResolutionDamping
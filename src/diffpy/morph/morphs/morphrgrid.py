@@ -16,7 +16,14 @@
 
 import numpy
 
-from diffpy.morph.morphs.morph import LABEL_GR, LABEL_RA, Morph
+from diffpy.morph.morphs.morph import (
+    LABEL_GR,
+    LABEL_RA,
+    Morph,
+    _batch_interp,
+    _interp_weights,
+    _readonly,
+)
 
 
 class MorphRGrid(Morph):
@@ -49,15 +56,26 @@ class MorphRGrid(Morph):
     xoutlabel = LABEL_RA
     youtlabel = LABEL_GR
     parnames = ["xmin", "xmax", "xstep"]
+    # The grid itself is not differentiable, derivatives are only resampled
+    jacobian_parnames = []
+    batchable = True
 
     # Define xmin xmax holders for adaptive x-grid refinement
     # Without these, the program r-grid can only decrease in interval size
     xmin_origin = None
     xmax_origin = None
     xstep_origin = None
+    # The _ResamplingPlan of the last inputs
+    _plan = None
 
     def morph(self, x_morph, y_morph, x_target, y_target):
-        """Resample arrays onto specified grid."""
+        """Resample arrays onto specified grid.
+
+        The grid, the resampled target and the interpolation weights of
+        the morph are cached for the input arrays and reused while they
+        stay the same objects. The cache assumes the arrays are not
+        modified in place.
+        """
         if self.xmin is not None:
             self.xmin_origin = self.xmin
         if self.xmax is not None:
@@ -66,38 +84,147 @@ class MorphRGrid(Morph):
             self.xstep_origin = self.xstep
 
         Morph.morph(self, x_morph, y_morph, x_target, y_target)
-        xmininc = max(min(self.x_target_in), min(self.x_morph_in))
-        x_step_target = (max(self.x_target_in) - min(self.x_target_in)) / (
-            len(self.x_target_in) - 1
+        origin = (self.xmin_origin, self.xmax_origin, self.xstep_origin)
+        plan = self._plan
+        if plan is None or not plan.matches(
+            x_morph, x_target, y_target, origin
+        ):
+            plan = _ResamplingPlan(x_morph, x_target, y_target, origin)
+            self._plan = plan
+        self.xmin = plan.xmin
+        self.xmax = plan.xmax
+        self.xstep = plan.xstep
+        self.x_morph_out = plan.x
+        if plan.morph_weights is not None:
+            self.y_morph_out = plan.resample_morph(self.y_morph_in)
+        self.x_target_out = plan.x
+        self.y_target_out = plan.y_target
+        return self.xyallout
+
+    def jacobian(self, pars, dy_morph, dy_target):
+        """Resample derivatives onto the output grid."""
+        dy_morph = self._plan.resample_morph(dy_morph, axis=0)
+        dy_target = self._plan.resample_target(dy_target, axis=0)
+        return dy_morph, dy_target
+
+
+# End of class MorphRGrid
+
+
+class _ResamplingPlan(object):
+    """Output grid of MorphRGrid and interpolation onto it.
+
+    Attributes
+    ----------
+    x
+        The read-only output grid.
+    xmin, xmax, xstep
+        The bounds and spacing of x.
+    y_target
+        The target resampled onto x.
+    morph_weights, target_weights
+        Tuples (idx, 1 - w, w) of the linear interpolation from the morph
+        and target grids, see _interp_weights. None if the input grid is
+        the output grid.
+    """
+
+    def __init__(self, x_morph, x_target, y_target, origin):
+        self.x_morph = x_morph
+        self.x_target = x_target
+        self.y_target_in = y_target
+        self.origin = origin
+        xmin_origin, xmax_origin, xstep_origin = origin
+
+        xmininc = max(numpy.min(x_target), numpy.min(x_morph))
+        x_step_target = (numpy.max(x_target) - numpy.min(x_target)) / (
+            len(x_target) - 1
         )
-        x_step_morph = (max(self.x_morph_in) - min(self.x_morph_in)) / (
-            len(self.x_morph_in) - 1
+        x_step_morph = (numpy.max(x_morph) - numpy.min(x_morph)) / (
+            len(x_morph) - 1
         )
         xstepinc = max(x_step_target, x_step_morph)
         xmaxinc = min(
-            max(self.x_target_in) + x_step_target,
-            max(self.x_morph_in) + x_step_morph,
+            numpy.max(x_target) + x_step_target,
+            numpy.max(x_morph) + x_step_morph,
         )
-        if self.xmin_origin is None or self.xmin_origin < xmininc:
+        self.xmin = xmin_origin
+        self.xmax = xmax_origin
+        self.xstep = xstep_origin
+        if xmin_origin is None or xmin_origin < xmininc:
             self.xmin = xmininc
-        if self.xmax_origin is None or self.xmax_origin > xmaxinc:
+        if xmax_origin is None or xmax_origin > xmaxinc:
             self.xmax = xmaxinc
-        if self.xstep_origin is None or self.xstep_origin < xstepinc:
+        if xstep_origin is None or xstep_origin < xstepinc:
             self.xstep = xstepinc
         # roundoff tolerance for selecting bounds on arrays.
         epsilon = self.xstep / 2
         # Make sure that xmax is exclusive
-        self.x_morph_out = numpy.arange(
-            self.xmin, self.xmax - epsilon, self.xstep
-        )
-        self.y_morph_out = numpy.interp(
-            self.x_morph_out, self.x_morph_in, self.y_morph_in
-        )
-        self.x_target_out = self.x_morph_out.copy()
-        self.y_target_out = numpy.interp(
-            self.x_target_out, self.x_target_in, self.y_target_in
+        x = numpy.arange(self.xmin, self.xmax - epsilon, self.xstep)
+        self.morph_weights = _weights(x, x_morph)
+        self.target_weights = _weights(x, x_target)
+        # Keep the input grid if it is the output grid
+        if self.morph_weights is None:
+            x = x_morph
+        elif self.target_weights is None:
+            x = x_target
+        self.x = _readonly(x)
+        if self.target_weights is None:
+            self.y_target = _readonly(y_target)
+        else:
+            self.y_target = _batch_interp(self.x, x_target, y_target)
+            self.y_target.flags.writeable = False
+        return
+
+    def matches(self, x_morph, x_target, y_target, origin):
+        """Check if the plan was made for these inputs."""
+        return (
+            _same_array(x_morph, self.x_morph)
+            and _same_array(x_target, self.x_target)
+            and _same_array(y_target, self.y_target_in)
+            and origin == self.origin
         )
-        return self.xyallout
 
+    def resample_morph(self, y, axis=-1):
+        """Resample y from the morph grid along axis."""
+        return _resample(self.morph_weights, y, axis)
 
-# End of class MorphRGrid
+    def resample_target(self, y, axis=-1):
+        """Resample y from the target grid along axis."""
+        return _resample(self.target_weights, y, axis)
+
+
+# End of class _ResamplingPlan
+
+
+def _weights(x, xp):
+    """Get (idx, 1 - w, w) of interpolating from xp to x, or None if x
+    is xp."""
+    if len(x) == len(xp) and numpy.array_equal(x, xp):
+        return None
+    idx, w = _interp_weights(x, xp)
+    return idx, 1.0 - w, w
+
+
+def _resample(weights, y, axis):
+    """Interpolate y along axis with weights from _weights."""
+    if weights is None:
+        return y
+    idx, w0, w1 = weights
+    y = numpy.moveaxis(y, axis, -1)
+    yout = y[..., idx] * w0 + y[..., idx + 1] * w1
+    return numpy.moveaxis(yout, -1, axis)
+
+
+def _same_array(a, b):
+    """Check if a and b are views of the same data."""
+    if a is b:
+        return True
+    a = numpy.asarray(a)
+    b = numpy.asarray(b)
+    return (
+        a.shape == b.shape
+        and a.strides == b.strides
+        and a.dtype == b.dtype
+        and a.__array_interface__["data"][0]
+        == b.__array_interface__["data"][0]
+    )
@@ -39,12 +39,31 @@ class MorphScale(Morph):
     xoutlabel = LABEL_RA
     youtlabel = LABEL_GR
     parnames = ["scale"]
+    jacobian_parnames = ["scale"]
+    batchable = True
+    maps_coordinates = True
+    applies_envelope = True
 
     def morph(self, x_morph, y_morph, x_target, y_target):
         """Apply a scale factor."""
         Morph.morph(self, x_morph, y_morph, x_target, y_target)
-        self.y_morph_out *= self.scale
+        self.y_morph_out = self.y_morph_out * self.scale
         return self.xyallout
 
+    def envelope(self, x):
+        """The envelope is the scale factor."""
+        return self.scale
+
+    def coordinate_map(self, x):
+        """Sample the input at x and multiply by scale."""
+        return x, self.scale, 0
+
+    def jacobian(self, pars, dy_morph, dy_target):
+        """Propagate derivatives through the scale factor."""
+        dy_morph = dy_morph * self.scale
+        for idx in self._parameter_columns(pars, "scale"):
+            dy_morph[:, idx] += self.y_morph_in
+        return dy_morph, dy_target
+
 
 # End of class MorphScale
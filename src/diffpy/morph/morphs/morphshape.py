@@ -39,14 +39,29 @@ class MorphSphere(Morph):
     xoutlabel = LABEL_RA
     youtlabel = LABEL_GR
     parnames = ["radius"]
+    jacobian_parnames = ["radius"]
+    applies_envelope = True
 
     def morph(self, x_morph, y_morph, x_target, y_target):
         """Apply a scale factor."""
         Morph.morph(self, x_morph, y_morph, x_target, y_target)
-        f = _sphericalCF(x_morph, 2 * self.radius)
-        self.y_morph_out *= f
+        self.y_morph_out = self.y_morph_in * self.envelope(x_morph)
         return self.xyallout
 
+    def envelope(self, x):
+        """Spherical characteristic function."""
+        return _sphericalCF(x, 2 * self.radius)
+
+    def jacobian(self, pars, dy_morph, dy_target):
+        """Propagate derivatives through the characteristic function."""
+        r = self.x_morph_in
+        f = _sphericalCF(r, 2 * self.radius)
+        dy_morph = dy_morph * f[:, numpy.newaxis]
+        for col in self._parameter_columns(pars, "radius"):
+            dfdr = 2 * _sphericalCF_derivative(r, 2 * self.radius)
+            dy_morph[:, col] += self.y_morph_in * dfdr
+        return dy_morph, dy_target
+
 
 # End of class MorphSphere
 
@@ -70,14 +85,47 @@ class MorphSpheroid(Morph):
     xoutlabel = LABEL_RA
     youtlabel = LABEL_GR
     parnames = ["radius", "pradius"]
+    jacobian_parnames = ["radius", "pradius"]
+    applies_envelope = True
 
     def morph(self, x_morph, y_morph, x_target, y_target):
         """Apply a scale factor."""
         Morph.morph(self, x_morph, y_morph, x_target, y_target)
-        f = _spheroidalCF(x_morph, self.radius, self.pradius)
-        self.y_morph_out *= f
+        self.y_morph_out = self.y_morph_in * self.envelope(x_morph)
         return self.xyallout
 
+    def envelope(self, x):
+        """Spheroidal characteristic function."""
+        return _spheroidalCF(x, self.radius, self.pradius)
+
+    def supports_jacobian(self, pars):
+        """Check if jacobian can provide derivatives for pars.
+
+        The characteristic function switches to that of a sphere when
+        both radii are equal, where the central difference of jacobian
+        straddles the two forms. A refinement of the radii starting from
+        a sphere is left to finite differences.
+        """
+        if self.radius == self.pradius and any(
+            self._parameter_columns(pars, name) for name in self.parnames
+        ):
+            return False
+        return Morph.supports_jacobian(self, pars)
+
+    def jacobian(self, pars, dy_morph, dy_target):
+        """Propagate derivatives through the characteristic function."""
+        r = self.x_morph_in
+        radii = [self.radius, self.pradius]
+        f = _spheroidalCF(r, *radii)
+        dy_morph = dy_morph * f[:, numpy.newaxis]
+        for pidx, name in enumerate(self.parnames):
+            columns = self._parameter_columns(pars, name)
+            if columns:
+                dfdp = _central_difference(_spheroidalCF, r, radii, pidx)
+                for col in columns:
+                    dy_morph[:, col] += self.y_morph_in * dfdp
+        return dy_morph, dy_target
+
 
 # End of class MorphSpheroid
 
@@ -104,6 +152,47 @@ def _sphericalCF(r, psize):
     return f
 
 
+def _sphericalCF_derivative(r, psize):
+    """Derivative of _sphericalCF with respect to the particle diameter.
+
+    Parameters
+    ----------
+    r
+        Distance of interaction.
+    psize
+        The particle diameter.
+    """
+    dfdp = numpy.zeros_like(r)
+    if psize > 0:
+        x = r / psize
+        g = 1.5 * x * (1.0 - x * x) / psize
+        g[x > 1] = 0
+        dfdp += g
+    return dfdp
+
+
+def _central_difference(cf, r, args, index):
+    """Central difference derivative of a characteristic function.
+
+    Parameters
+    ----------
+    cf
+        Characteristic function called as cf(r, *args).
+    r
+        Distance of interaction.
+    args
+        Parameters of the characteristic function.
+    index
+        Index of the parameter in args to differentiate with respect to.
+    """
+    h = 1e-6 * max(abs(args[index]), 1.0)
+    up = list(args)
+    up[index] += h
+    down = list(args)
+    down[index] -= h
+    return (cf(r, *up) - cf(r, *down)) / (2 * h)
+
+
 def _spheroidalCF(r, erad, prad):
     """Spheroidal characteristic function specified using radii.
 
@@ -14,9 +14,15 @@
 ##############################################################################
 """Class MorphShift -- shift the morph."""
 
-import numpy
-
-from diffpy.morph.morphs.morph import LABEL_GR, LABEL_RA, Morph
+from diffpy.morph.morphs.morph import (
+    LABEL_GR,
+    LABEL_RA,
+    Morph,
+    _batch_interp,
+    _interp_apply,
+    _interp_slope,
+    _interp_weights,
+)
 
 
 class MorphShift(Morph):
@@ -40,6 +46,9 @@ class MorphShift(Morph):
     xoutlabel = LABEL_RA
     youtlabel = LABEL_GR
     parnames = ["hshift", "vshift"]
+    jacobian_parnames = ["hshift", "vshift"]
+    batchable = True
+    maps_coordinates = True
 
     def morph(self, x_morph, y_morph, x_target, y_target):
         """Apply the shifts."""
@@ -54,10 +63,39 @@ class MorphShift(Morph):
 
         Morph.morph(self, x_morph, y_morph, x_target, y_target)
         r = self.x_morph_in - hshift
-        self.y_morph_out = numpy.interp(r, self.x_morph_in, self.y_morph_in)
-        self.y_morph_out += vshift
+        self.y_morph_out = _batch_interp(r, self.x_morph_in, self.y_morph_in)
+        self.y_morph_out = self.y_morph_out + vshift
         self.set_extrapolation_info(self.x_morph_in, r)
         return self.xyallout
 
+    def coordinate_map(self, x):
+        """Sample the input at x - hshift and add vshift."""
+        try:
+            hshift = self.hshift
+        except AttributeError:
+            hshift = 0
+        try:
+            vshift = self.vshift
+        except AttributeError:
+            vshift = 0
+        return x - hshift, 1, vshift
+
+    def jacobian(self, pars, dy_morph, dy_target):
+        """Propagate derivatives through the shifts."""
+        try:
+            hshift = self.hshift
+        except AttributeError:
+            hshift = 0
+        r = self.x_morph_in - hshift
+        idx, w = _interp_weights(r, self.x_morph_in)
+        dy_morph = _interp_apply(idx, w, dy_morph)
+        if self._parameter_columns(pars, "hshift"):
+            slope = _interp_slope(r, self.x_morph_in, self.y_morph_in)
+            for col in self._parameter_columns(pars, "hshift"):
+                dy_morph[:, col] -= slope
+        for col in self._parameter_columns(pars, "vshift"):
+            dy_morph[:, col] += 1
+        return dy_morph, dy_target
+
 
 # End of class MorphShift
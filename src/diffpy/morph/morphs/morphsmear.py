@@ -14,10 +14,27 @@
 ##############################################################################
 """Class MorphSmear -- smear the morph."""
 
+from collections import OrderedDict
+
 import numpy
 
 from diffpy.morph.morphs.morph import LABEL_RA, LABEL_RR, Morph
 
+# Half width of the truncated Gaussian kernel in units of smear. The
+# Gaussian is below 2e-22 of its peak value outside of this range.
+KERNEL_HALF_WIDTH = 10
+# Longest kernel that is convoluted directly rather than with FFTs
+DIRECT_KERNEL_LENGTH = 64
+# Largest number of cached kernels and their largest total size in bytes
+KERNEL_CACHE_SIZE = 32
+KERNEL_CACHE_BYTES = 64 * 2**20
+# Largest relative deviation of the spacing of an equally spaced grid
+GRID_SPACING_RTOL = 1e-5
+
+# Cached smear kernels by grid size, grid spacing and smear, least recently
+# used first
+_kernel_cache = OrderedDict()
+
 
 class MorphSmear(Morph):
     """Smear the morph function.
@@ -29,6 +46,10 @@ class MorphSmear(Morph):
     -----------------------
     smear
         The smear factor to apply to y_morph_in.
+
+    The Gaussian kernel is built for equally spaced grids. On other grids
+    the morph is smeared with the Gaussian sampled on the grid, which is
+    much slower for long grids.
     """
 
     # Define input output types
@@ -38,6 +59,7 @@ class MorphSmear(Morph):
     xoutlabel = LABEL_RA
     youtlabel = LABEL_RR
     parnames = ["smear"]
+    jacobian_parnames = ["smear"]
 
     def morph(self, x_morph, y_morph, x_target, y_target):
         """Resample arrays onto specified grid."""
@@ -46,34 +68,274 @@ class MorphSmear(Morph):
         if self.smear == 0:
             return self.xyallout
 
-        # The Gaussian to convolute with. No need to normalize, we'll do that
-        # later.
-        r = self.x_morph_in
-        rr = self.y_morph_in
-        r0 = r[len(r) // 2]
-        gaussian = numpy.exp(-0.5 * ((r - r0) / self.smear) ** 2)
-
-        # Get the full convolution
-        c = numpy.convolve(rr, gaussian, mode="full")
-        # Find the centroid of the RDF, we don't want this to change from the
-        # convolution.
-        x1 = numpy.arange(len(rr), dtype=float)
-        c1idx = numpy.sum(rr * x1) / sum(rr)
-        # Find the centroid of the convolution
-        xc = numpy.arange(len(c), dtype=float)
-        ccidx = numpy.sum(c * xc) / sum(c)
-        # Interpolate the convolution such that the centroids line up. This
-        # uses linear interpolation.
-        shift = ccidx - c1idx
-        x1 += shift
-        rrbroad = numpy.interp(x1, xc, c)
-
-        # Normalize so that the integrated magnitude of the RDF doesn't change.
-        rrbroad /= sum(gaussian)
-
-        self.y_morph_out = rrbroad
+        # Convolute with the normalized Gaussian and shift the result such
+        # that the centroid of the RDF does not change.
+        kernel = _get_kernel(self.x_morph_in, self.smear)
+        if kernel is None:
+            self.y_morph_out = _smear_sampled(
+                self.x_morph_in, self.y_morph_in, self.smear
+            )
+        else:
+            self.y_morph_out = kernel.convolve(self.y_morph_in)
 
         return self.xyallout
 
+    def stationary_starts(self, pars, x_morph):
+        """Start a refinement of smear from zero at one grid step.
+
+        The smear is even in smear, so the residual is stationary at zero
+        smear.
+        """
+        if self.smear != 0 or not self._parameter_columns(pars, "smear"):
+            return {}
+        if len(x_morph) < 2:
+            return {}
+        return {"smear": (x_morph[-1] - x_morph[0]) / (len(x_morph) - 1)}
+
+    def supports_jacobian(self, pars):
+        """Check if jacobian can provide derivatives for pars.
+
+        The derivative with respect to smear vanishes at zero smear, so
+        a refinement of smear starting from zero is left to finite
+        differences.
+        """
+        if self.smear == 0 and self._parameter_columns(pars, "smear"):
+            return False
+        return Morph.supports_jacobian(self, pars)
+
+    def jacobian(self, pars, dy_morph, dy_target):
+        """Propagate derivatives through the smear.
+
+        The smear is linear in y_morph_in, so the derivatives of the input
+        are smeared with the same kernel. The derivative with respect to
+        smear is the convolution with the derivative of the kernel.
+        """
+        if self.smear == 0:
+            return dy_morph.copy(), dy_target
+
+        kernel = _get_kernel(self.x_morph_in, self.smear)
+        if kernel is None:
+            return self._sampled_jacobian(pars, dy_morph, dy_target)
+        dy_out = kernel.convolve(dy_morph)
+        for col in self._parameter_columns(pars, "smear"):
+            dy_out[:, col] += kernel.convolve(self.y_morph_in, derivative=True)
+        return dy_out, dy_target
+
+    def _sampled_jacobian(self, pars, dy_morph, dy_target):
+        """Propagate derivatives on a grid that is not equally spaced.
+
+        The derivative with respect to smear is a central difference.
+        """
+        r = self.x_morph_in
+        dy_out = numpy.zeros_like(dy_morph)
+        for col in range(dy_morph.shape[1]):
+            dy_out[:, col] = _smear_sampled(r, dy_morph[:, col], self.smear)
+        step = numpy.cbrt(numpy.finfo(float).eps) * abs(self.smear)
+        for col in self._parameter_columns(pars, "smear"):
+            plus = _smear_sampled(r, self.y_morph_in, self.smear + step)
+            minus = _smear_sampled(r, self.y_morph_in, self.smear - step)
+            dy_out[:, col] += (plus - minus) / (2 * step)
+        return dy_out, dy_target
+
 
 # End of class MorphSmear
+
+
+class _SmearKernel(object):
+    """Truncated Gaussian convolution of a function on an equally spaced
+    grid.
+
+    The kernel combines the Gaussian, its normalization and the linear
+    interpolation that keeps the centroid of the function in place, so
+    smearing is a single convolution. Its derivative with respect to the
+    smear is kept alongside. Long kernels are applied with FFTs, and the
+    transforms are computed once for each kernel.
+
+    Attributes
+    ----------
+    npoints
+        Number of points of the grid.
+    offset
+        Index of the convolution of the kernel with a function of npoints
+        values that corresponds to the first point of the grid.
+    kernel, dkernel
+        The kernel and its derivative with respect to smear.
+    nfft
+        Length of the FFTs, or None to convolute directly.
+    kernel_fft, dkernel_fft
+        Real FFTs of kernel and dkernel of length nfft. dkernel_fft is
+        computed when a derivative is first taken.
+    """
+
+    def __init__(self, npoints, dr, smear):
+        self.npoints = npoints
+        # The Gaussian is centered on the middle of the grid, indices ka to
+        # kb of which are within the truncation range.
+        center = npoints // 2
+        half_width = int(numpy.ceil(KERNEL_HALF_WIDTH * abs(smear) / dr))
+        ka = max(center - half_width, 0)
+        kb = min(center + half_width, npoints - 1)
+        k = numpy.arange(ka, kb + 1)
+        d2 = ((k - center) * dr) ** 2
+        gaussian = numpy.exp(-0.5 * d2 / smear**2)
+        dgaussian = gaussian * d2 / smear**3
+        gsum = gaussian.sum()
+        dgsum = dgaussian.sum()
+
+        # The centroid of the convolution is shifted by that of the Gaussian,
+        # gidx = m + delta. The convolution is interpolated at the grid
+        # points shifted by gidx. Integer shifts take the segment to their
+        # left, like numpy.interp.
+        gidx = numpy.dot(gaussian, k) / gsum
+        dgidx = numpy.dot(dgaussian, k - gidx) / gsum
+        m = int(numpy.ceil(gidx)) - 1
+        delta = gidx - m
+
+        # Kernel values at indices ka - 1 to kb of the Gaussian and of the
+        # Gaussian shifted by one index.
+        g0 = numpy.concatenate([[0], gaussian])
+        g1 = numpy.concatenate([gaussian, [0]])
+        dg0 = numpy.concatenate([[0], dgaussian])
+        dg1 = numpy.concatenate([dgaussian, [0]])
+        kernel = ((1 - delta) * g0 + delta * g1) / gsum
+        dkernel = ((1 - delta) * dg0 + delta * dg1 + dgidx * (g1 - g0)) / gsum
+        dkernel -= kernel * dgsum / gsum
+        self.kernel = kernel
+        self.dkernel = dkernel
+        self.offset = m - ka + 1
+
+        self.nfft = None
+        self.kernel_fft = None
+        self._dkernel_fft = None
+        if len(kernel) > DIRECT_KERNEL_LENGTH:
+            from scipy.fft import next_fast_len, rfft
+
+            self.nfft = next_fast_len(npoints + len(kernel) - 1, real=True)
+            self.kernel_fft = rfft(kernel, self.nfft)
+        for arr in (self.kernel, self.dkernel):
+            arr.flags.writeable = False
+        return
+
+    @property
+    def dkernel_fft(self):
+        """Real FFT of dkernel, computed when first needed."""
+        if self._dkernel_fft is None and self.nfft is not None:
+            from scipy.fft import rfft
+
+            self._dkernel_fft = rfft(self.dkernel, self.nfft)
+        return self._dkernel_fft
+
+    @property
+    def nbytes(self):
+        """Number of bytes held by the kernel arrays."""
+        arrays = [
+            self.kernel,
+            self.dkernel,
+            self.kernel_fft,
+            self._dkernel_fft,
+        ]
+        return sum(arr.nbytes for arr in arrays if arr is not None)
+
+    def convolve(self, y, derivative=False):
+        """Smear y, or take the derivative of the smear of y with respect
+        to smear.
+
+        Parameters
+        ----------
+        y: numpy.ndarray
+            Function values on the grid. For 2D arrays each column is
+            smeared.
+        derivative: bool
+            Use the derivative of the kernel with respect to smear.
+
+        Returns
+        -------
+        numpy.ndarray
+            Array of the shape of y.
+        """
+        kernel = self.dkernel if derivative else self.kernel
+        nconv = self.npoints + len(kernel) - 1
+        if self.nfft is None and numpy.ndim(y) == 1:
+            conv = numpy.convolve(y, kernel, mode="full")
+        elif self.nfft is None:
+            conv = numpy.apply_along_axis(
+                numpy.convolve, 0, y, kernel, mode="full"
+            )
+        else:
+            from scipy.fft import irfft, rfft
+
+            kernel_fft = self.dkernel_fft if derivative else self.kernel_fft
+            if numpy.ndim(y) > 1:
+                kernel_fft = kernel_fft[:, numpy.newaxis]
+            conv = irfft(rfft(y, self.nfft, axis=0) * kernel_fft, self.nfft, 0)
+            conv = conv[:nconv]
+        # Select the values on the grid. These are zero where the kernel
+        # does not reach the function.
+        lo = min(max(self.offset, 0), nconv)
+        hi = min(max(self.offset + self.npoints, 0), nconv)
+        out = numpy.zeros(numpy.shape(y))
+        out[lo - self.offset : hi - self.offset] = conv[lo:hi]
+        return out
+
+
+# End of class _SmearKernel
+
+
+def _cached_kernel(npoints, dr, smear):
+    """Get the smear kernel for the grid size, grid spacing and smear.
+
+    Kernels are cached. The least recently used kernels are dropped when
+    the cache holds more than KERNEL_CACHE_SIZE kernels or
+    KERNEL_CACHE_BYTES bytes.
+    """
+    key = (npoints, dr, smear)
+    kernel = _kernel_cache.get(key)
+    if kernel is not None:
+        _kernel_cache.move_to_end(key)
+        return kernel
+    kernel = _SmearKernel(npoints, dr, smear)
+    _kernel_cache[key] = kernel
+    nbytes = sum(cached.nbytes for cached in _kernel_cache.values())
+    while len(_kernel_cache) > 1 and (
+        len(_kernel_cache) > KERNEL_CACHE_SIZE or nbytes > KERNEL_CACHE_BYTES
+    ):
+        _, dropped = _kernel_cache.popitem(last=False)
+        nbytes -= dropped.nbytes
+    return kernel
+
+
+def _get_kernel(r, smear):
+    """Get the smear kernel of the grid r.
+
+    Returns
+    -------
+    _SmearKernel or None
+        The kernel, or None if r is not equally spaced.
+    """
+    npoints = len(r)
+    if npoints < 2:
+        return _cached_kernel(npoints, 1.0, float(smear))
+    dr = (r[-1] - r[0]) / (npoints - 1)
+    deviation = numpy.absolute(numpy.diff(r) - dr).max()
+    if deviation > GRID_SPACING_RTOL * abs(dr):
+        return None
+    return _cached_kernel(npoints, float(dr), float(smear))
+
+
+def _smear_sampled(r, rr, smear):
+    """Smear rr with the Gaussian sampled on the grid r.
+
+    This is the convolution with the Gaussian for grids that are not
+    equally spaced, with the centroid and integrated magnitude of rr kept
+    in place.
+    """
+    r0 = r[len(r) // 2]
+    gaussian = numpy.exp(-0.5 * ((r - r0) / smear) ** 2)
+    c = numpy.convolve(rr, gaussian, mode="full")
+    # The shift of the centroid of the convolution from that of rr is the
+    # centroid of the Gaussian
+    xg = numpy.arange(len(gaussian), dtype=float)
+    shift = numpy.dot(gaussian, xg) / gaussian.sum()
+    x1 = numpy.arange(len(rr), dtype=float) + shift
+    xc = numpy.arange(len(c), dtype=float)
+    return numpy.interp(x1, xc, c) / gaussian.sum()
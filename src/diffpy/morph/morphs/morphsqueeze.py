@@ -3,7 +3,6 @@ function."""
 
 import numpy
 from numpy.polynomial import Polynomial
-from scipy.interpolate import CubicSpline
 
 from diffpy.morph.morphs.morph import LABEL_GR, LABEL_RA, Morph
 
@@ -62,6 +61,8 @@ class MorphSqueeze(Morph):
     xoutlabel = LABEL_RA
     youtlabel = LABEL_GR
     parnames = ["squeeze"]
+    jacobian_parnames = ["squeeze"]
+    interpolates_output = True
     # extrap_index_low: last index before interpolation region
     # extrap_index_high: first index after interpolation region
     extrap_index_low = None
@@ -69,34 +70,49 @@ class MorphSqueeze(Morph):
     squeeze_cutoff_low = None
     squeeze_cutoff_high = None
     strictly_increasing = None
+    # Spline of the last squeezed morph, used by jacobian
+    squeeze_spline = None
+    # Squeezed grid and morph function of squeeze_spline, and the sorted
+    # grid without duplicates the spline is defined on
+    squeeze_x = None
+    squeeze_y = None
+    squeeze_grid = None
 
     def __init__(self, config=None):
         super().__init__(config)
 
     def _check_strictly_increasing(self, x, x_sorted):
-        if list(x) != list(x_sorted):
-            self.strictly_increasing = False
-        else:
-            self.strictly_increasing = True
+        self.strictly_increasing = numpy.array_equal(x, x_sorted)
+
+    def _sort_order(self, x):
+        """Get the stable order sorting x, or a slice of all x when x is
+        already sorted."""
+        if numpy.all(numpy.diff(x) >= 0):
+            return slice(None)
+        return numpy.argsort(x, kind="stable")
 
     def _sort_squeeze(self, x, y):
         """Sort x,y according to the value of x."""
-        xy = list(zip(x, y))
-        xy_sorted = sorted(xy, key=lambda pair: pair[0])
-        x_sorted, y_sorted = numpy.array(list(zip(*xy_sorted)))
-        return x_sorted, y_sorted
+        order = self._sort_order(x)
+        return x[order], y[order]
 
     def _handle_duplicates(self, x, y):
         """Remove duplicated x and use the mean value of y corresponded
         to the duplicated x."""
+        if numpy.all(numpy.diff(x) > 0):
+            return x, y
         x_unique, inv = numpy.unique(x, return_inverse=True)
         if len(x_unique) == len(x):
             return x, y
-        else:
-            y_avg = numpy.zeros_like(x_unique, dtype=float)
-            for idx, _ in enumerate(x_unique):
-                y_avg[idx] = y[inv == idx].mean()
-            return x_unique, y_avg
+        counts = numpy.bincount(inv, minlength=len(x_unique))
+        y_cols = numpy.reshape(y, (len(y), -1))
+        y_sum = numpy.empty((len(x_unique), y_cols.shape[1]))
+        for col in range(y_cols.shape[1]):
+            y_sum[:, col] = numpy.bincount(
+                inv, weights=y_cols[:, col], minlength=len(x_unique)
+            )
+        y_avg = y_sum / counts[:, numpy.newaxis]
+        return x_unique, y_avg.reshape((len(x_unique),) + y.shape[1:])
 
     def morph(self, x_morph, y_morph, x_target, y_target):
         """Apply a polynomial to squeeze the morph function.
@@ -109,16 +125,70 @@ class MorphSqueeze(Morph):
         coeffs = [self.squeeze[f"a{i}"] for i in range(len(self.squeeze))]
         squeeze_polynomial = Polynomial(coeffs)
         x_squeezed = self.x_morph_in + squeeze_polynomial(self.x_morph_in)
-        x_squeezed_sorted, y_morph_sorted = self._sort_squeeze(
-            x_squeezed, self.y_morph_in
-        )
-        self._check_strictly_increasing(x_squeezed, x_squeezed_sorted)
-        x_squeezed_sorted, y_morph_sorted = self._handle_duplicates(
-            x_squeezed_sorted, y_morph_sorted
-        )
-        self.y_morph_out = CubicSpline(x_squeezed_sorted, y_morph_sorted)(
-            self.x_morph_in
-        )
-        self.set_extrapolation_info(x_squeezed_sorted, self.x_morph_in)
+        # The spline only needs to be rebuilt if its data have changed
+        if not (
+            numpy.array_equal(x_squeezed, self.squeeze_x)
+            and numpy.array_equal(self.y_morph_in, self.squeeze_y)
+        ):
+            x_squeezed_sorted, y_morph_sorted = self._sort_squeeze(
+                x_squeezed, self.y_morph_in
+            )
+            self._check_strictly_increasing(x_squeezed, x_squeezed_sorted)
+            x_squeezed_sorted, y_morph_sorted = self._handle_duplicates(
+                x_squeezed_sorted, y_morph_sorted
+            )
+            from scipy.interpolate import CubicSpline
+
+            self.squeeze_spline = CubicSpline(
+                x_squeezed_sorted, y_morph_sorted
+            )
+            self.squeeze_x = x_squeezed
+            self.squeeze_y = numpy.array(self.y_morph_in, dtype=float)
+            self.squeeze_grid = x_squeezed_sorted
+        self.y_morph_out = self.squeeze_spline(self.x_morph_in)
+        self.set_extrapolation_info(self.squeeze_grid, self.x_morph_in)
 
         return self.xyallout
+
+    def interpolate_output(self, x):
+        """Evaluate the squeezed spline at x."""
+        return self.squeeze_spline(x)
+
+    def jacobian(self, pars, dy_morph, dy_target):
+        """Propagate derivatives through the squeeze.
+
+        For a squeeze x -> t(x) = x + p(x), the morph evaluates
+        y(u(x)) where u is the inverse of t. The derivative with respect
+        to coefficient ai is then -y'(u(x)) u(x)**i / t'(u(x)), where
+        y'(u) / t'(u) is the derivative of the squeezed spline.
+        """
+        x = self.x_morph_in
+        coeffs = [self.squeeze[f"a{i}"] for i in range(len(self.squeeze))]
+        squeeze_polynomial = Polynomial(coeffs)
+        x_squeezed = x + squeeze_polynomial(x)
+        order = self._sort_order(x_squeezed)
+
+        dy_out = numpy.zeros_like(dy_morph)
+        if numpy.any(dy_morph):
+            from scipy.interpolate import CubicSpline
+
+            x_sorted, dy_sorted = self._handle_duplicates(
+                x_squeezed[order], dy_morph[order]
+            )
+            dy_out += CubicSpline(x_sorted, dy_sorted)(x)
+
+        columns = [
+            (col, key)
+            for col, (name, key) in enumerate(pars)
+            if name == "squeeze"
+        ]
+        if columns:
+            # Invert the squeeze, then polish with one Newton step
+            u = numpy.interp(x, x_squeezed[order], x[order])
+            dtdu = 1 + squeeze_polynomial.deriv()(u)
+            newton = dtdu != 0
+            u[newton] -= (u + squeeze_polynomial(u) - x)[newton] / dtdu[newton]
+            dydx = self.squeeze_spline(x, 1)
+            for col, key in columns:
+                dy_out[:, col] -= dydx * u ** int(key[1:])
+        return dy_out, dy_target
@@ -16,7 +16,15 @@
 
 import numpy
 
-from diffpy.morph.morphs.morph import LABEL_GR, LABEL_RA, Morph
+from diffpy.morph.morphs.morph import (
+    LABEL_GR,
+    LABEL_RA,
+    Morph,
+    _batch_interp,
+    _interp_apply,
+    _interp_slope,
+    _interp_weights,
+)
 
 
 class MorphStretch(Morph):
@@ -38,17 +46,37 @@ class MorphStretch(Morph):
     xoutlabel = LABEL_RA
     youtlabel = LABEL_GR
     parnames = ["stretch"]
+    jacobian_parnames = ["stretch"]
+    batchable = True
+    maps_coordinates = True
 
     def morph(self, x_morph, y_morph, x_target, y_target):
         """Resample arrays onto specified grid."""
         Morph.morph(self, x_morph, y_morph, x_target, y_target)
-        if self.stretch == 0:
+        if numpy.all(self.stretch == 0):
             return self.xyallout
 
         r = self.x_morph_in / (1.0 + self.stretch)
-        self.y_morph_out = numpy.interp(r, self.x_morph_in, self.y_morph_in)
+        self.y_morph_out = _batch_interp(r, self.x_morph_in, self.y_morph_in)
         self.set_extrapolation_info(self.x_morph_in, r)
         return self.xyallout
 
+    def coordinate_map(self, x):
+        """Sample the input at x / (1 + stretch)."""
+        return x / (1.0 + self.stretch), 1, 0
+
+    def jacobian(self, pars, dy_morph, dy_target):
+        """Propagate derivatives through the stretch."""
+        r = self.x_morph_in / (1.0 + self.stretch)
+        idx, w = _interp_weights(r, self.x_morph_in)
+        dy_morph = _interp_apply(idx, w, dy_morph)
+        columns = self._parameter_columns(pars, "stretch")
+        if columns:
+            slope = _interp_slope(r, self.x_morph_in, self.y_morph_in)
+            drds = -self.x_morph_in / (1.0 + self.stretch) ** 2
+            for col in columns:
+                dy_morph[:, col] += slope * drds
+        return dy_morph, dy_target
+
 
 # End of class MorphSmear
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# diffpy.morph      by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2010 Trustees of the Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE.txt for license information.
+#
+##############################################################################
+"""Profiler -- count calls, time and allocations of parts of a morph."""
+
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class Profiler(object):
+    """Accumulate the calls, wall time and allocated memory of named
+    sections of a morph.
+
+    Assign a Profiler to the profile attribute of a MorphChain to record
+    each morph of the chain, and to that of a Refiner to record the
+    residual and Jacobian evaluations and the evaluation counts of the
+    optimizer.
+
+    Attributes
+    ----------
+    sections: dict
+        The [calls, seconds, bytes] of each section name. Bytes is the
+        sum over the calls of the peak memory allocated above that in use
+        when the call started, and 0 without trace_memory. The times and
+        bytes of nested sections are included in those of the enclosing
+        section.
+    counts: dict
+        Accumulated counts, such as the number of residual evaluations
+        reported by the optimizer (nfev) and of Jacobian evaluations
+        (njev).
+    trace_memory: bool
+        Trace memory allocations with tracemalloc. This slows down the
+        morphs, such that the times are longer than without tracing.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.sections = {}
+        self.counts = {}
+        self.trace_memory = trace_memory
+        # [memory in use at the start, peak memory] of the open sections
+        self._open = []
+        self._tracing = False
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        return
+
+    def stop(self):
+        """Stop the memory tracing started by this Profiler."""
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        return
+
+    @contextmanager
+    def section(self, name):
+        """Record the code run within the context as a call of section
+        name."""
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            self._update_peak(peak)
+            tracemalloc.reset_peak()
+            self._open.append([current, current])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            nbytes = 0
+            if tracing:
+                _, peak = tracemalloc.get_traced_memory()
+                self._update_peak(peak)
+                first, peak = self._open.pop()
+                nbytes = peak - first
+                self._update_peak(peak)
+                tracemalloc.reset_peak()
+            stats = self.sections.setdefault(name, [0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] += nbytes
+
+    def wrap(self, name, func):
+        """Return func recording each call as a call of section name."""
+
+        def wrapped(*args, **kwargs):
+            with self.section(name):
+                return func(*args, **kwargs)
+
+        return wrapped
+
+    def count(self, name, n=1):
+        """Add n to the count of name."""
+        self.counts[name] = self.counts.get(name, 0) + n
+        return
+
+    def merge(self, other):
+        """Add the sections and counts of another Profiler."""
+        for name, (calls, seconds, nbytes) in other.sections.items():
+            stats = self.sections.setdefault(name, [0, 0.0, 0])
+            stats[0] += calls
+            stats[1] += seconds
+            stats[2] += nbytes
+        for name, n in other.counts.items():
+            self.count(name, n)
+        return
+
+    def as_dict(self):
+        """Get the profile as a dictionary.
+
+        Returns
+        -------
+        dict
+            A dictionary with "sections", the calls, time in seconds and
+            allocated bytes of each section, and "counts".
+        """
+        sections = {
+            name: dict(calls=calls, time=seconds, bytes=nbytes)
+            for name, (calls, seconds, nbytes) in self.sections.items()
+        }
+        return dict(sections=sections, counts=dict(self.counts))
+
+    def summary(self):
+        """Get a table of the profile, slowest sections first."""
+        width = max([len(name) for name in self.sections] + [7])
+        lines = [
+            "# Profile:",
+            f"# {'section':<{width}} {'calls':>8} {'time [ms]':>12} "
+            f"{'alloc [kB]':>12}",
+        ]
+        ordered = sorted(self.sections.items(), key=lambda item: -item[1][1])
+        for name, (calls, seconds, nbytes) in ordered:
+            lines.append(
+                f"# {name:<{width}} {calls:>8d} {1e3 * seconds:>12.3f} "
+                f"{nbytes / 1024:>12.1f}"
+            )
+        for name, n in self.counts.items():
+            lines.append(f"# {name} = {n}")
+        return "\n".join(lines)
+
+    def _update_peak(self, peak):
+        """Raise the peak memory of the innermost open section."""
+        if self._open:
+            self._open[-1][1] = max(self._open[-1][1], peak)
+        return
+
+
+# End class Profiler
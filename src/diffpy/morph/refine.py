@@ -15,12 +15,58 @@
 """refine -- Refine a morph or morph chain"""
 
 import warnings
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from copy import deepcopy
 
-from numpy import array, concatenate, diag, dot, exp, ones_like, sqrt
-from scipy.optimize import leastsq
-from scipy.stats import pearsonr
+from numpy import (
+    absolute,
+    arange,
+    array,
+    broadcast_to,
+    concatenate,
+    diag,
+    diagonal,
+    dot,
+    einsum,
+    empty,
+    errstate,
+    exp,
+    eye,
+    finfo,
+    flatnonzero,
+    full,
+    inf,
+    isfinite,
+    meshgrid,
+    ndim,
+    newaxis,
+    ones,
+    ones_like,
+    outer,
+    sqrt,
+    stack,
+    vstack,
+    where,
+    zeros,
+)
+from numpy.linalg import norm, qr, solve, svd
+
+from diffpy.morph.morphs.morphchain import MorphChain
+from diffpy.morph.tools import (
+    estimate_scale,
+    estimate_scale_and_offset,
+    get_pearson,
+    get_rw,
+)
 
 # Map of scipy minimizer names to the method that uses them
+_OPTIMIZERS = {
+    "leastsq": "_minimize_leastsq",
+    "trf": "_minimize_least_squares",
+    "dogbox": "_minimize_least_squares",
+}
 
 
 class Refiner(object):
@@ -41,8 +87,72 @@ class Refiner(object):
     residual
         The residual function to optimize. Default _residual. Can be assigned
         to other functions.
+    analytic_jacobian
+        Use the analytic derivatives of the morphs when every morph in the
+        chain provides them (default True). Otherwise, the optimizer
+        estimates the Jacobian with finite differences.
+    cache_size
+        Maximum number of chain evaluations kept in the residual cache
+        (default 32). Set to 0 to disable caching. Evaluations are keyed
+        by the parameter values and the rest of the configuration.
+    cache_hits, cache_misses
+        Number of chain evaluations served from the residual cache and
+        number of chain evaluations that were computed.
+    singular_values
+        Singular values of the Jacobian at the solution, in decreasing
+        order. Set when uncertainties are estimated.
+    rank
+        Numerical rank of the Jacobian at the solution. Set when
+        uncertainties are estimated.
+    degenerate_directions
+        List of the parameter combinations that do not change the
+        residual at the solution, one dictionary of parameter name to
+        component for each missing rank. Set when uncertainties are
+        estimated.
+    optimizer
+        Name of the minimizer (default "leastsq"). "leastsq" uses
+        scipy.optimize.leastsq without bounds. "trf" and "dogbox" use the
+        methods of scipy.optimize.least_squares with the parameters
+        bounded and scaled by the norms of the Jacobian columns.
+    bounds
+        Dictionary of (lower, upper) bounds of parameters, overriding
+        parameter_bounds. Only supported by "trf" and "dogbox".
+    max_nfev
+        Maximum number of residual evaluations per minimization (default
+        None, the scipy default).
+    memo_size
+        Number of evaluations of each morph that a MorphChain keeps while
+        refining (default 8), see MorphChain.memo_size.
+    profile
+        A diffpy.morph.profiler.Profiler recording each evaluation of the
+        residual and the Jacobian by the optimizer, and counting the
+        evaluations reported by the optimizer as nfev and njev (default
+        None).
+    minima
+        List of the physical minima of the last multi-start refinement,
+        from the lowest chi2. Each is a dictionary with the start values,
+        the refined config values, chi2 and Rw.
+
+    Class Attributes
+    ----------------
+    linear_parnames
+        Names of parameters that enter the morph linearly. These are solved
+        in closed form by a separable refinement.
+    parameter_bounds
+        Physical (lower, upper) bounds of parameters used by the bounded
+        optimizers.
     """
 
+    linear_parnames = ["scale", "vshift"]
+    parameter_bounds = {
+        "stretch": (-1, inf),
+        "smear": (0, inf),
+        "radius": (0, inf),
+        "pradius": (0, inf),
+        "iradius": (0, inf),
+        "ipradius": (0, inf),
+    }
+
     def __init__(
         self, chain, x_morph, y_morph, x_target, y_target, tolerance=1e-08
     ):
@@ -54,7 +164,31 @@ class Refiner(object):
         self.tolerance = tolerance
         self.pars = []
         self.residual = self._residual
+        self.analytic_jacobian = True
         self.flat_to_grouped = {}
+        self.optimizer = "leastsq"
+        self.bounds = {}
+        self.max_nfev = None
+        self.profile = None
+        self._trace = None
+        self.memo_size = 8
+
+        # Chain outputs of recently evaluated parameter vectors
+        self.cache_size = 32
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache = OrderedDict()
+        self._current_key = None
+        self._fixed_key = None
+        self._last_xyall = None
+
+        # Rank diagnostics of the last uncertainty estimate
+        self.singular_values = None
+        self.rank = None
+        self.degenerate_directions = []
+
+        # Minima of the last multi-start refinement
+        self.minima = []
 
         # Padding required for the residual vector to ensure constant length
         # across the entire morph process
@@ -77,16 +211,89 @@ class Refiner(object):
         self.chain.config.update(updated)
         return
 
-    def _residual(self, pvals):
-        """Standard vector residual."""
+    def clear_cache(self):
+        """Remove all chain evaluations from the residual cache."""
+        self._cache.clear()
+        self._current_key = None
+        return
+
+    def _evaluate_chain(self, pvals, current=False):
+        """Evaluate the chain at pvals, reusing cached outputs.
+
+        Parameters
+        ----------
+        pvals
+            Flat array of parameter values.
+        current: bool
+            Make sure the morphs in the chain hold the arrays of this
+            evaluation, as needed by the chain jacobian. A cached
+            evaluation from an earlier parameter vector is then rerun.
+
+        Returns
+        -------
+        tuple
+            The chain outputs (x_morph, y_morph, x_target, y_target).
+        """
         self._update_chain(pvals)
-        _x_morph, _y_morph, _x_target, _y_target = self.chain(
+        fixed = self._fixed_key
+        if fixed is None:
+            fixed = self._fixed_config()
+        key = (array(pvals, dtype=float).tobytes(), fixed)
+        xyall = self._cache.get(key)
+        if xyall is not None and (key == self._current_key or not current):
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            self._last_xyall = xyall
+            return xyall
+
+        self.cache_misses += 1
+        xyall = self.chain(
             self.x_morph, self.y_morph, self.x_target, self.y_target
         )
+        self._current_key = key
+        if self.cache_size > 0:
+            self._cache[key] = xyall
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        self._last_xyall = xyall
+        return xyall
+
+    def _fixed_config(self):
+        """Get a representation of the configuration that is not set
+        from the parameter vector.
+
+        This is part of the key of cached evaluations, such that a change
+        of a fixed parameter in config is not served a stale evaluation.
+        The fixed parameters do not change during a refinement, which
+        computes this once.
+        """
+        refined = {param for param, _ in self.flat_to_grouped.values()}
+        return repr(
+            [
+                (name, value)
+                for name, value in self.chain.config.items()
+                if name not in refined
+            ]
+        )
+
+    def _residual(self, pvals):
+        """Standard vector residual."""
+        _x_morph, _y_morph, _x_target, _y_target = self._evaluate_chain(pvals)
         rvec = _y_target - _y_morph
-        if len(rvec) < len(pvals):
+        return self._fix_residual_length(rvec, len(pvals))
+
+    def _fix_residual_length(self, rvec, npars):
+        """Keep the residual vector at a constant length.
+
+        Raises
+        ------
+        ValueError
+            If the residual is shorter than the number of parameters.
+        """
+        if len(rvec) < npars:
             raise ValueError(
-                f"\nNumber of parameters (currently {len(pvals)}) cannot "
+                f"\nNumber of parameters (currently {npars}) cannot "
                 "exceed the number of shared grid points "
                 f"(currently {len(rvec)}). "
                 "Please reduce the number of morphing parameters or "
@@ -121,10 +328,9 @@ class Refiner(object):
         function. We seek to minimize this, which occurs when the
         correlation is the largest.
         """
-        self._update_chain(pvals)
-        _x_morph, _y_morph, _x_target, _y_target = self.chain(
-            self.x_morph, self.y_morph, self.x_target, self.y_target
-        )
+        from scipy.stats import pearsonr
+
+        _x_morph, _y_morph, _x_target, _y_target = self._evaluate_chain(pvals)
         pcc, pval = pearsonr(_y_morph, _y_target)
         return ones_like(_x_morph) * exp(-pcc)
 
@@ -135,7 +341,431 @@ class Refiner(object):
         res = concatenate([res1, res2])
         return res
 
-    def refine(self, *args, estimate_uncertainty=False, **kw):
+    def _chain_jacobian(self, pvals):
+        """Evaluate the chain and the derivatives of its outputs."""
+        xyall = self._evaluate_chain(pvals, current=True)
+        pars = [self.flat_to_grouped[idx] for idx in range(len(pvals))]
+        dy_morph = zeros((len(self.y_morph), len(pars)))
+        dy_target = zeros((len(self.y_target), len(pars)))
+        dy_morph, dy_target = self.chain.jacobian(pars, dy_morph, dy_target)
+        return xyall, dy_morph, dy_target
+
+    def _residual_jacobian(self, pvals):
+        """Jacobian of the standard vector residual."""
+        xyall, dy_morph, dy_target = self._chain_jacobian(pvals)
+        _x_morph, _y_morph, _x_target, _y_target = xyall
+        rvec = _y_target - _y_morph
+        jac = dy_target - dy_morph
+        return self._fix_jacobian_length(rvec, jac)
+
+    def _fix_jacobian_length(self, rvec, jac):
+        """Follow the padding and removal of _fix_residual_length."""
+        if self.res_length is not None:
+            if len(rvec) < self.res_length:
+                padding = zeros((self.res_length - len(rvec), jac.shape[1]))
+                jac = vstack([jac, padding])
+            elif len(rvec) > self.res_length:
+                davg_rms = 2 * dot(rvec, jac) / len(rvec)
+                jac = outer(ones_like(rvec[: self.res_length]), davg_rms)
+        return jac
+
+    def _pearson_jacobian(self, pvals):
+        """Jacobian of the Pearson correlation function."""
+        xyall, dy_morph, dy_target = self._chain_jacobian(pvals)
+        _x_morph, _y_morph, _x_target, _y_target = xyall
+        dmorph = _y_morph - _y_morph.mean()
+        dtarget = _y_target - _y_target.mean()
+        nmorph = sqrt(dot(dmorph, dmorph))
+        ntarget = sqrt(dot(dtarget, dtarget))
+        pcc = dot(dmorph, dtarget) / (nmorph * ntarget)
+        # Gradients of pcc with respect to the morph and target arrays
+        gmorph = dtarget / (nmorph * ntarget) - pcc * dmorph / nmorph**2
+        gtarget = dmorph / (nmorph * ntarget) - pcc * dtarget / ntarget**2
+        dpcc = dot(gmorph, dy_morph) + dot(gtarget, dy_target)
+        # The correlation does not depend on parameters that only scale or
+        # shift the morph, such as scale and vshift. Their derivatives are
+        # then rounding errors, which the optimizer would follow with huge
+        # steps, so set derivatives below the rounding error to zero.
+        rounding = (
+            len(_y_morph)
+            * finfo(float).eps
+            * (
+                norm(gmorph) * norm(dy_morph, axis=0)
+                + norm(gtarget) * norm(dy_target, axis=0)
+            )
+        )
+        dpcc[absolute(dpcc) <= rounding] = 0.0
+        return outer(ones_like(_x_morph), -exp(-pcc) * dpcc)
+
+    def _add_pearson_jacobian(self, pvals):
+        """Jacobian of the combined pearson and residual."""
+        jac1 = self._residual_jacobian(pvals)
+        jac2 = self._pearson_jacobian(pvals)
+        return vstack([jac1, jac2])
+
+    def _separable_residual(self, pvals):
+        """Residual of the nonlinear parameters in pvals.
+
+        The refined linear parameters are solved in closed form for each
+        pvals and placed in config. This relies on the morph being
+        affine in the linear parameters.
+        """
+        # Evaluate at scale 1 and vshift 0, then get the response of the
+        # morph to each linear parameter
+        base = {"scale": 1.0, "vshift": 0.0}
+        nlin = len(pvals)
+        pbase = concatenate([pvals, [base[p] for p in self._linear_pars]])
+        pars = [self.flat_to_grouped[idx] for idx in range(len(pbase))]
+        if self.analytic_jacobian and self.chain.supports_jacobian(pars):
+            xyall, dy_morph, dy_target = self._chain_jacobian(pbase)
+            basis = [dy_morph[:, idx] for idx in range(nlin, len(pbase))]
+        else:
+            xyall = self._evaluate_chain(pbase)
+            basis = []
+            for idx in range(nlin, len(pbase)):
+                pstep = pbase.copy()
+                pstep[idx] += 1.0
+                basis.append(self._evaluate_chain(pstep)[1] - xyall[1])
+        _x_morph, _y_morph, _x_target, _y_target = xyall
+
+        # The target for the linear parameters alone
+        rhs = _y_target - _y_morph
+        for p, response in zip(self._linear_pars, basis):
+            rhs = rhs + base[p] * response
+        if len(basis) == 2:
+            values = estimate_scale_and_offset(basis[0], rhs, basis[1])
+        else:
+            values = [estimate_scale(basis[0], rhs)]
+
+        config = self.chain.config
+        rvec = rhs
+        for p, response, value in zip(self._linear_pars, basis, values):
+            config[p] = value
+            rvec = rvec - value * response
+        return self._fix_residual_length(rvec, len(pbase))
+
+    def _separable_jacobian(self, pvals):
+        """Jacobian of _separable_residual.
+
+        This uses the approximation of Kaufman, the derivatives of the
+        residual at the solved linear parameters projected onto the
+        complement of the linear directions.
+        """
+        self._separable_residual(pvals)
+        config = self.chain.config
+        values = [config[p] for p in self._linear_pars]
+        xyall, dy_morph, dy_target = self._chain_jacobian(
+            concatenate([pvals, values])
+        )
+        _x_morph, _y_morph, _x_target, _y_target = xyall
+        nlin = len(pvals)
+        jac = (dy_target - dy_morph)[:, :nlin]
+        q, _ = qr(dy_morph[:, nlin:])
+        jac = jac - dot(q, dot(q.T, jac))
+        return self._fix_jacobian_length(_y_target - _y_morph, jac)
+
+    def _refine_separable(self):
+        """Refine the nonlinear parameters with the linear parameters
+        projected out (variable projection).
+
+        The refined values of all parameters are placed in config.
+        """
+        config = self.chain.config
+        self._linear_pars = [
+            p
+            for p in self.linear_parnames
+            if p in self.pars and not isinstance(config[p], dict)
+        ]
+        nonlinear = [p for p in self.pars if p not in self._linear_pars]
+        initial = self._flatten_pars(nonlinear + self._linear_pars)
+        pvals = array(initial[: len(initial) - len(self._linear_pars)])
+        jacobian = None
+        pars = list(self.flat_to_grouped.values())
+        if self.analytic_jacobian and self.chain.supports_jacobian(pars):
+            jacobian = self._separable_jacobian
+        if len(pvals) > 0:
+            pvals, _ = self._minimize(
+                self._separable_residual, pvals, jacobian
+            )
+        # Place the nonlinear solution and its linear parameters in config
+        self._separable_residual(pvals)
+        self.clear_cache()
+        return
+
+    def _leave_stationary_points(self):
+        """Move refined parameters off points where the residual is
+        stationary when this lowers the residual, see
+        Morph.stationary_starts."""
+        initial = self._flatten_pars(self.pars)
+        pars = list(self.flat_to_grouped.values())
+        starts = self.chain.stationary_starts(pars, self.x_morph)
+        if not starts:
+            return
+        config = self.chain.config
+        rvec = self.residual(array(initial))
+        chi2 = dot(rvec, rvec)
+        for name, value in starts.items():
+            previous = config[name]
+            config[name] = value
+            rvec = self.residual(array(self._flatten_pars(self.pars)))
+            if dot(rvec, rvec) < chi2:
+                chi2 = dot(rvec, rvec)
+            else:
+                config[name] = previous
+        return
+
+    def _minimize(self, residual, pvals, jacobian=None):
+        """Minimize the sum of squares of residual with the optimizer.
+
+        Parameters
+        ----------
+        residual
+            Function of the flat parameter array returning the residual
+            vector.
+        pvals
+            Flat array of initial parameter values.
+        jacobian
+            Function returning the Jacobian of residual, or None to use
+            finite differences.
+
+        Returns
+        -------
+        sol, fvec
+            The solution and the residual vector at the solution.
+
+        Raises
+        ------
+        ValueError
+            If the optimizer is unknown or a minimum cannot be found.
+        """
+        if self.optimizer not in _OPTIMIZERS:
+            raise ValueError(
+                f"Unknown optimizer '{self.optimizer}'. "
+                f"Choose from {', '.join(_OPTIMIZERS)}."
+            )
+        minimize = getattr(self, _OPTIMIZERS[self.optimizer])
+        if self.profile is not None:
+            residual = self.profile.wrap("residual", residual)
+            if jacobian is not None:
+                jacobian = self.profile.wrap("jacobian", jacobian)
+        if self._trace is not None:
+            residual = self._traced(residual)
+        return minimize(residual, pvals, jacobian)
+
+    def _traced(self, residual):
+        """Return residual recording each evaluation in the trace."""
+        # The separable residual evaluates the chain at unit scale
+        unit_scale = (
+            residual == self._separable_residual
+            and "scale" in self._linear_pars
+        )
+
+        def traced(pvals):
+            rvec = residual(pvals)
+            _x_morph, y_morph, _x_target, y_target = self._last_xyall
+            dmorph = y_morph - y_morph.mean()
+            dtarget = y_target - y_target.mean()
+            with errstate(divide="ignore", invalid="ignore"):
+                pcc = dot(dmorph, dtarget) / sqrt(
+                    dot(dmorph, dmorph) * dot(dtarget, dtarget)
+                )
+            config = self.chain.config
+            if unit_scale and config["scale"] < 0:
+                pcc = -pcc
+            self._trace.record(config, norm(rvec), pcc)
+            return rvec
+
+        return traced
+
+    def _minimize_leastsq(self, residual, pvals, jacobian):
+        """Minimize with scipy.optimize.leastsq."""
+        from scipy.optimize import leastsq
+
+        if self.bounds:
+            raise ValueError(
+                "Parameter bounds require the trf or dogbox optimizer."
+            )
+        sol, _, infodict, emesg, ier = leastsq(
+            residual,
+            pvals,
+            Dfun=jacobian,
+            full_output=True,
+            ftol=self.tolerance,
+            xtol=self.tolerance,
+            maxfev=self.max_nfev or 0,
+        )
+        self._count_evaluations(infodict["nfev"], infodict.get("njev", 0))
+        if ier not in (1, 2, 3, 4):
+            raise ValueError(emesg)
+        return sol, infodict["fvec"]
+
+    def _minimize_least_squares(self, residual, pvals, jacobian):
+        """Minimize with scipy.optimize.least_squares within the parameter
+        bounds."""
+        from scipy.optimize import least_squares
+
+        result = least_squares(
+            residual,
+            pvals,
+            jac=jacobian or "2-point",
+            bounds=self._flat_bounds(len(pvals)),
+            method=self.optimizer,
+            x_scale="jac",
+            ftol=self.tolerance,
+            xtol=self.tolerance,
+            max_nfev=self.max_nfev,
+        )
+        self._count_evaluations(result.nfev, result.njev or 0)
+        if result.status < 1:
+            raise ValueError(result.message)
+        return result.x, result.fun
+
+    def _count_evaluations(self, nfev, njev):
+        """Add the evaluation counts of the optimizer to the profile."""
+        if self.profile is not None:
+            self.profile.count("nfev", int(nfev))
+            self.profile.count("njev", int(njev))
+        return
+
+    def _flat_bounds(self, npars):
+        """Lower and upper bounds of the first npars flat parameters.
+
+        The bounds of a parameter with several values apply to each of
+        them.
+        """
+        bounds = dict(self.parameter_bounds)
+        bounds.update(self.bounds)
+        lower = full(npars, -inf)
+        upper = full(npars, inf)
+        for idx in range(npars):
+            param, _ = self.flat_to_grouped[idx]
+            lower[idx], upper[idx] = bounds.get(param, (-inf, inf))
+        return lower, upper
+
+    def _flatten_pars(self, pars):
+        """Build the flat list of values of pars and the flat_to_grouped
+        mapping."""
+        config = self.chain.config
+        initial = []
+        self.flat_to_grouped = {}
+        for p in pars:
+            val = config[p]
+            if isinstance(val, dict):
+                for k, v in val.items():
+                    initial.append(v)
+                    self.flat_to_grouped[len(initial) - 1] = (p, k)
+            else:
+                initial.append(val)
+                self.flat_to_grouped[len(initial) - 1] = (p, None)
+        return initial
+
+    def _get_jacobian(self):
+        """Get the analytic Jacobian of the residual, if available.
+
+        Returns None when the residual or any morph in the chain has no
+        analytic derivatives.
+        """
+        if not self.analytic_jacobian:
+            return None
+        jacobians = {
+            self._residual: self._residual_jacobian,
+            self._pearson: self._pearson_jacobian,
+            self._add_pearson: self._add_pearson_jacobian,
+        }
+        jacobian = jacobians.get(self.residual)
+        pars = list(self.flat_to_grouped.values())
+        if jacobian is None or not self.chain.supports_jacobian(pars):
+            return None
+        return jacobian
+
+    def _jacobian_at(self, pvals):
+        """Jacobian of the residual at pvals.
+
+        This uses the analytic Jacobian when available and forward
+        differences with the step size of leastsq otherwise.
+        """
+        jacobian = self._get_jacobian()
+        if jacobian is not None:
+            return jacobian(pvals)
+        pvals = array(pvals, dtype=float)
+        rvec = self.residual(pvals)
+        jac = empty((len(rvec), len(pvals)))
+        for idx in range(len(pvals)):
+            step = sqrt(finfo(float).eps) * (abs(pvals[idx]) or 1.0)
+            pstep = pvals.copy()
+            pstep[idx] += step
+            jac[:, idx] = (self.residual(pstep) - rvec) / step
+        return jac
+
+    def _estimate_uncertainty(self, pvals, par_names):
+        """Estimate the uncertainty of each parameter from the Jacobian at
+        the solution.
+
+        The covariance is the pseudo-inverse of J^T J computed from the
+        singular value decomposition of J. Directions in parameter space
+        whose singular values vanish do not contribute and are stored in
+        degenerate_directions.
+
+        Parameters
+        ----------
+        pvals
+            Flat array of refined parameter values.
+        par_names: list
+            Name of each parameter in pvals.
+
+        Returns
+        -------
+        dict or None
+            The uncertainty of each parameter, or None if there are not
+            more residual values than parameters.
+        """
+        rvec = self.residual(pvals)
+        dof = len(rvec) - len(pvals)
+        if dof <= 0:
+            warnings.warn(
+                "Warning: Could not estimate "
+                "uncertainty as the number of fit parameters "
+                "exceeds the number of data points.",
+                UserWarning,
+            )
+            return None
+        jac = self._jacobian_at(pvals)
+        # Place the solution back in config after the finite differences
+        self._evaluate_chain(pvals, current=True)
+        _, svals, vt = svd(jac, full_matrices=False)
+        # Same threshold as numpy.linalg.matrix_rank
+        cutoff = svals.max(initial=0) * max(jac.shape) * finfo(float).eps
+        kept = svals > cutoff
+        self.singular_values = svals
+        self.rank = int(kept.sum())
+        self.degenerate_directions = [
+            dict(zip(par_names, vec)) for vec in vt[~kept]
+        ]
+        if self.degenerate_directions:
+            directions = "; ".join(
+                _format_direction(direction)
+                for direction in self.degenerate_directions
+            )
+            warnings.warn(
+                "Warning: Estimated Hessian is singular. Uncertainties "
+                "are not reliable for parameters that vary along the "
+                f"degenerate directions: {directions}.",
+                UserWarning,
+            )
+        inv_svals = zeros(len(svals))
+        inv_svals[kept] = 1 / svals[kept]
+        cov = dot(vt.T * inv_svals**2, vt) * dot(rvec, rvec) / dof
+        return dict(zip(par_names, sqrt(diag(cov))))
+
+    def refine(
+        self,
+        *args,
+        estimate_uncertainty=False,
+        separable=False,
+        polish=False,
+        trace=None,
+        **kw,
+    ):
         """Refine the chain.
 
         Additional arguments are used to specify which parameters are to be
@@ -144,7 +774,17 @@ class Refiner(object):
         Keywords pass initial values to the parameters, whether or not they
         are refined.
 
-        This uses the leastsq algorithm from scipy.optimize.
+        This uses the leastsq algorithm from scipy.optimize, or the
+        bounded least_squares algorithm when optimizer is "trf" or
+        "dogbox". The analytic Jacobian of the residual is passed to the
+        optimizer when every morph in the chain provides one, otherwise it
+        is estimated by finite differences.
+
+        If separable is True and the standard residual is used, the linear
+        parameters (see linear_parnames) are solved in closed form at each
+        step of a refinement of the remaining parameters. All parameters
+        are then refined together from that solution only if polish is
+        True or the separable refinement does not converge.
 
         If estimate_uncertainty is True, return an estimated uncertainty
         for each parameter.
@@ -152,6 +792,9 @@ class Refiner(object):
         The parameters from the fit can be retrieved from the config
         dictionary of the morph or morph chain.
 
+        If a diffpy.morph.trace.Trace is given as trace, each residual
+        evaluation of the optimizer is recorded in it.
+
         Raises
         ------
         ValueError
@@ -160,74 +803,85 @@ class Refiner(object):
             If the number of shared grid points between morphed function and
             target function is smaller than the number of parameters.
         """
+        with self._chain_memo():
+            return self._refine(
+                *args,
+                estimate_uncertainty=estimate_uncertainty,
+                separable=separable,
+                polish=polish,
+                trace=trace,
+                **kw,
+            )
+
+    def _chain_memo(self):
+        """Context in which the chain keeps memo_size evaluations of each
+        morph, see MorphChain.memo_size."""
+        if not isinstance(self.chain, MorphChain):
+            return nullcontext()
+        return _chain_memo(self.chain, self.memo_size)
+
+    def _refine(
+        self,
+        *args,
+        estimate_uncertainty=False,
+        separable=False,
+        polish=False,
+        trace=None,
+        **kw,
+    ):
+        """Refine the chain, see refine."""
         self.pars = args or self.chain.config.keys()
 
         config = self.chain.config
         config.update(kw)
 
+        # Cached evaluations may be stale for the new configuration
+        self.clear_cache()
+        self._fixed_key = None
+
         if not self.pars:
             return 0.0
+        self._leave_stationary_points()
 
-        # Build flat list of initial parameters and flat_to_grouped mapping
-        initial = []
-        self.flat_to_grouped = {}
+        self._trace = trace
+        if trace is not None:
+            self._flatten_pars(self.pars)
+            trace.add_parameters(list(self.flat_to_grouped.values()))
 
-        for p in self.pars:
-            val = config[p]
-            if isinstance(val, dict):
-                for k, v in val.items():
-                    initial.append(v)
-                    self.flat_to_grouped[len(initial) - 1] = (p, k)
-            else:
-                initial.append(val)
-                self.flat_to_grouped[len(initial) - 1] = (p, None)
+        # Build flat list of initial parameters and flat_to_grouped mapping
+        initial = self._flatten_pars(self.pars)
+        # The fixed parameters keep their values until the refinement ends
+        self._fixed_key = self._fixed_config()
 
-        sol, hess_inv_sol, infodict, emesg, ier = leastsq(
-            self.residual,
-            array(initial),
-            full_output=True,
-            ftol=self.tolerance,
-            xtol=self.tolerance,
-        )
-        fvec = infodict["fvec"]
+        solved = False
+        if separable and self.residual == self._residual:
+            if any(p in self.linear_parnames for p in self.pars):
+                try:
+                    self._refine_separable()
+                    solved = True
+                except ValueError:
+                    # Refine all parameters together from the start
+                    self._flatten_pars(self.pars)
+                    self._update_chain(initial)
+                initial = self._flatten_pars(self.pars)
 
-        if ier not in (1, 2, 3, 4):
-            emesg
-            raise ValueError(emesg)
+        if solved and not polish:
+            sol = array(initial)
+            fvec = self.residual(sol)
+        else:
+            sol, fvec = self._minimize(
+                self.residual, array(initial), self._get_jacobian()
+            )
 
         # Place the fit parameters in config
         vals = sol
         if not hasattr(vals, "__iter__"):
             vals = [vals]
-        self._update_chain(vals)
+        self._evaluate_chain(vals, current=True)
+        self._fixed_key = None
 
         if estimate_uncertainty:
             par_names = list(self.pars)
-            if hess_inv_sol is None:
-                if len(par_names) == 1:
-                    warnings.warn(
-                        "Warning: Could not estimate "
-                        f"uncertainty of {par_names[0].lower()} parameter "
-                        "as estimated Hessian is singular.",
-                        UserWarning,
-                    )
-                else:
-                    warnings.warn(
-                        "Warning: Certain parameters may be "
-                        "missing uncertainties as estimated Hessian "
-                        "is singular.",
-                        UserWarning,
-                    )
-                return None
-            dof = len(fvec) - len(sol)
-            if dof <= 0:
-                warnings.warn(
-                    "Warning: Could not estimate "
-                    "uncertainty as the number of fit parameters "
-                    "exceeds the number of data points.",
-                    UserWarning,
-                )
-                return None
             # Handle squeeze morph params
             if "squeeze" in par_names and "squeeze" in config.keys():
                 squeeze_par_names = [
@@ -245,12 +899,490 @@ class Refiner(object):
                     ]
                     func_idx = par_names.index(func)
                     par_names[func_idx : func_idx + 1] = func_par_names
-            cov_sol = hess_inv_sol * dot(fvec, fvec) / dof
-            unc = sqrt(diag(cov_sol))
-
-            return dict(zip(par_names, unc))
+            return self._estimate_uncertainty(vals, par_names)
         else:
             return dot(fvec, fvec)
 
+    def multistart(
+        self,
+        ranges,
+        *args,
+        starts=8,
+        sampling="lhs",
+        seed=None,
+        jobs=1,
+        estimate_uncertainty=False,
+        separable=False,
+        trace=None,
+        **kw,
+    ):
+        """Refine the chain from several starting points and keep the best
+        minimum.
+
+        The starting values of the parameters in ranges are drawn from a
+        Latin hypercube or a scrambled Sobol sequence. The current config
+        values are refined as an additional start. The config holds the
+        best minimum afterwards, and every physical minimum found is
+        listed in minima. Minima with parameters outside of the bounds
+        (see parameter_bounds and bounds) or with an Rw of 1 or more, no
+        better than a vanishing morph, are discarded.
+
+        Parameters
+        ----------
+        ranges: dict
+            The (lower, upper) range of the starting values of each
+            parameter, see tools.parse_ranges. These parameters must have
+            scalar config values.
+        *args
+            The parameters to refine, as for refine.
+        starts: int
+            Number of starting points drawn from the ranges (default 8).
+        sampling: str
+            "lhs" for a Latin hypercube (default) or "sobol" for a
+            scrambled Sobol sequence.
+        seed: int, optional
+            Seed of the sampling, for reproducible starting points.
+        jobs: int
+            Number of processes that refine the starts (default 1). The
+            refiner must be picklable when jobs > 1.
+        estimate_uncertainty, separable, **kw
+            As for refine.
+        trace: Trace, optional
+            Records the refinement from the best minimum, as for refine.
+
+        Returns
+        -------
+        The result of refine from the best minimum.
+
+        Raises
+        ------
+        ValueError
+            The ranges or the sampling are invalid, or no start reaches
+            a physical minimum.
+        """
+        from scipy.stats import qmc
+
+        config = self.chain.config
+        config.update(kw)
+        names = list(ranges)
+        _check_scalar(config, names, "draw starting values for")
+        lower = array([ranges[name][0] for name in names], dtype=float)
+        upper = array([ranges[name][1] for name in names], dtype=float)
+        if not (lower < upper).all():
+            raise ValueError(
+                "The lower end of each range must be below its upper end."
+            )
+        if sampling == "lhs":
+            sampler = qmc.LatinHypercube(len(names), seed=seed)
+        elif sampling == "sobol":
+            sampler = qmc.Sobol(len(names), seed=seed)
+        else:
+            raise ValueError(
+                f"Unknown sampling '{sampling}'. Use 'lhs' or 'sobol'."
+            )
+        with warnings.catch_warnings():
+            # Sobol warns when starts is not a power of two
+            warnings.simplefilter("ignore", UserWarning)
+            points = qmc.scale(sampler.random(starts), lower, upper)
+        start_values = [{}]
+        start_values += [dict(zip(names, map(float, row))) for row in points]
+
+        base = deepcopy(dict(config))
+        self.clear_cache()
+        start_args = (self, base, args, separable)
+        njobs = min(jobs, len(start_values))
+        if njobs > 1:
+            with ProcessPoolExecutor(
+                max_workers=njobs,
+                initializer=_multistart_init,
+                initargs=start_args,
+            ) as executor:
+                results = list(executor.map(_multistart_worker, start_values))
+        else:
+            results = [
+                _refine_start(*start_args, start) for start in start_values
+            ]
+        minima = [
+            result
+            for result in results
+            if result is not None and self._is_physical(result)
+        ]
+        if not minima:
+            raise ValueError(
+                "None of the multi-start refinements converged to a "
+                "physical minimum."
+            )
+        minima.sort(key=lambda minimum: minimum["chi2"])
+        self.minima = minima
+
+        # Finish from the best minimum
+        config.update(base)
+        config.update(deepcopy(minima[0]["config"]))
+        return self.refine(
+            *args,
+            estimate_uncertainty=estimate_uncertainty,
+            separable=separable,
+            trace=trace,
+        )
+
+    def _is_physical(self, minimum):
+        """Check if a minimum of multistart lies within the bounds of
+        its parameters and fits better than a vanishing morph."""
+        if not isfinite(minimum["rw"]) or minimum["rw"] >= 1:
+            return False
+        bounds = dict(self.parameter_bounds)
+        bounds.update(self.bounds)
+        for name, value in minimum["config"].items():
+            lower, upper = bounds.get(name, (-inf, inf))
+            values = value.values() if isinstance(value, dict) else [value]
+            if not all(lower <= val <= upper for val in values):
+                return False
+        return True
+
+    def scan(self, grid, chunk_size=256, jobs=1):
+        """Evaluate Rw and the Pearson coefficient on a grid of parameter
+        values.
+
+        The grid points are evaluated in chunks of chunk_size parameter
+        sets with MorphChain.evaluate_batch. Parameters that are not
+        scanned keep their config values, and the config is not changed.
+
+        Parameters
+        ----------
+        grid: dict
+            The values of each scanned parameter, see tools.parse_scan.
+            Scanned parameters must have scalar config values.
+        chunk_size: int
+            Number of parameter sets evaluated at once (default 256).
+        jobs: int
+            Number of processes that evaluate the chunks (default 1). The
+            chain must be picklable when jobs > 1.
+
+        Returns
+        -------
+        rw, pearson: numpy.ndarray
+            Rw and the Pearson coefficient at each grid point, with one
+            axis per parameter in the order of grid.
+
+        Raises
+        ------
+        ValueError
+            A scanned parameter does not have a scalar config value.
+        """
+        config = self.chain.config
+        pars = list(grid)
+        _check_scalar(config, pars, "scan")
+        values = [array(grid[name], dtype=float).ravel() for name in pars]
+        shape = tuple(len(val) for val in values)
+        points = stack(
+            [axis.ravel() for axis in meshgrid(*values, indexing="ij")],
+            axis=-1,
+        )
+        chunks = [
+            points[start : start + chunk_size]
+            for start in range(0, len(points), chunk_size)
+        ]
+
+        chain = self.chain
+        if not isinstance(chain, MorphChain):
+            chain = MorphChain(config, chain)
+        args = (chain, self.x_morph, self.y_morph, self.x_target)
+        args += (self.y_target, pars)
+        njobs = min(jobs, len(chunks))
+        if njobs > 1:
+            with ProcessPoolExecutor(
+                max_workers=njobs, initializer=_scan_init, initargs=args
+            ) as executor:
+                results = list(executor.map(_scan_worker, chunks))
+        else:
+            results = [_scan_chunk(*args, pvals) for pvals in chunks]
+        rw = concatenate([result[0] for result in results]).reshape(shape)
+        pcc = concatenate([result[1] for result in results]).reshape(shape)
+        return rw, pcc
+
 
 # End class Refiner
+
+
+@contextmanager
+def _chain_memo(chain, memo_size):
+    """Set the memo_size of chain within the context and drop the kept
+    evaluations afterwards."""
+    saved = chain.memo_size
+    chain.memo_size = memo_size
+    try:
+        yield
+    finally:
+        chain.memo_size = saved
+        chain.clear_memo()
+
+
+def _check_scalar(config, names, action):
+    """Raise ValueError unless each name has a scalar config value."""
+    for name in names:
+        if name not in config or ndim(config[name]) != 0:
+            raise ValueError(
+                f"Cannot {action} '{name}'. Only parameters of the morph "
+                "with a scalar value are supported."
+            )
+    return
+
+
+# Refiner, initial config, parameters and separable flag of a multi-start
+# refinement in a worker process
+_multistart_args = None
+
+
+def _multistart_init(*args):
+    """Initialize a worker process of Refiner.multistart."""
+    global _multistart_args
+    _multistart_args = args
+    return
+
+
+def _multistart_worker(start):
+    """Refine one start of a multi-start refinement in a worker process."""
+    return _refine_start(*_multistart_args, start)
+
+
+def _refine_start(refiner, base, pars, separable, start):
+    """Refine from the initial config updated with the start values.
+
+    Return a dictionary with the start values, the refined config, chi2
+    and Rw, or None if the refinement fails.
+    """
+    config = refiner.chain.config
+    config.update(deepcopy(base))
+    config.update(start)
+    try:
+        chi2 = refiner.refine(*pars, separable=separable)
+    except ValueError:
+        return None
+    refined = {name: deepcopy(config[name]) for name in refiner.pars}
+    rw = get_rw(refiner.chain)
+    return dict(start=start, config=refined, chi2=chi2, rw=rw)
+
+
+# Chain, data and parameter names of a scan in a worker process
+_scan_args = None
+
+
+def _scan_init(*args):
+    """Initialize a worker process of Refiner.scan."""
+    global _scan_args
+    _scan_args = args
+    return
+
+
+def _scan_worker(pvals):
+    """Evaluate a chunk of a scan in a worker process."""
+    return _scan_chunk(*_scan_args, pvals)
+
+
+def _scan_chunk(chain, x_morph, y_morph, x_target, y_target, pars, pvals):
+    """Rw and Pearson coefficient of each row of pvals."""
+    chain.evaluate_batch(pvals, x_morph, y_morph, x_target, y_target, pars)
+    rw = broadcast_to(get_rw(chain), (len(pvals),))
+    pcc = broadcast_to(get_pearson(chain), (len(pvals),))
+    return rw, pcc
+
+
+def _format_direction(direction):
+    """Describe a direction in parameter space by its main components."""
+    return " ".join(
+        f"{component:+.3g}*({name})"
+        for name, component in direction.items()
+        if abs(component) > 1e-3
+    )
+
+
+class BatchRefiner(Refiner):
+    """Class for refining a MorphChain against a batch of target
+    functions at once.
+
+    The target functions share the grid x_target and are the rows of
+    y_target, which has shape (n, len(x_target)). The parameters of each
+    target are refined independently, but every residual evaluation runs
+    the chain once for the whole batch. The refined parameters are placed
+    in config as arrays of shape (n, 1).
+
+    Since the parameters of one target do not affect the residual of
+    another, the Jacobian is block diagonal. Each block is estimated with
+    one batched forward difference per parameter, and the refinement is a
+    Levenberg-Marquardt iteration carried out for all blocks at once.
+    Only the standard residual is supported, and the optimizer, bounds
+    and max_nfev attributes are not used.
+
+    Attributes
+    ----------
+    max_iterations
+        Maximum number of Levenberg-Marquardt iterations (default 100).
+    converged
+        Boolean array marking the targets whose refinement converged in
+        the last call to refine.
+    """
+
+    def __init__(
+        self, chain, x_morph, y_morph, x_target, y_target, tolerance=1e-08
+    ):
+        Refiner.__init__(
+            self, chain, x_morph, y_morph, x_target, y_target, tolerance
+        )
+        self.max_iterations = 100
+        self.converged = None
+        return
+
+    def _update_chain(self, pvals):
+        """Update the parameters in the chain.
+
+        pvals has shape (n, number of parameters).
+        """
+        Refiner._update_chain(self, pvals.T[:, :, newaxis])
+        return
+
+    def _batch_residual(self, pvals, rows):
+        """Residual of the targets in rows, with shape (len(rows), number
+        of points).
+
+        pvals holds the parameters of these targets.
+        """
+        config = self.chain.config
+        for key, value in self._batch_config.items():
+            config[key] = _take_rows(value, rows)
+        self._update_chain(pvals)
+        _x_morph, _y_morph, _x_target, _y_target = self.chain(
+            self.x_morph, self.y_morph, self.x_target, self.y_target[rows]
+        )
+        return _y_target - _y_morph
+
+    def _batch_jacobian(self, pvals, rvec, rows):
+        """Forward difference estimate of the Jacobian blocks of the
+        targets in rows, with shape (len(rows), number of points, number
+        of parameters)."""
+        npars = pvals.shape[1]
+        step = sqrt(finfo(float).eps) * where(pvals != 0, absolute(pvals), 1)
+        jac = empty(rvec.shape + (npars,))
+        for idx in range(npars):
+            pstep = pvals.copy()
+            pstep[:, idx] += step[:, idx]
+            jac[:, :, idx] = self._batch_residual(pstep, rows) - rvec
+            jac[:, :, idx] /= step[:, idx, newaxis]
+        return jac
+
+    def refine(self, *args, **kw):
+        """Refine the chain for every target function.
+
+        Additional arguments are used to specify which parameters are to be
+        refined.
+        If no arguments are passed, then all parameters will be refined.
+        Keywords pass initial values to the parameters, whether or not they
+        are refined. Initial values can be scalars shared by all targets or
+        arrays with one value per target.
+
+        Targets are dropped from the batch once their refinement has
+        converged, so the remaining iterations only evaluate the chain for
+        the targets that still need them.
+
+        Return the final squared residual of each target. The parameters
+        from the fit can be retrieved from the config dictionary of the
+        morph chain.
+        """
+        self.pars = args or self.chain.config.keys()
+
+        config = self.chain.config
+        config.update(kw)
+
+        nbatch = len(self.y_target)
+        if not self.pars:
+            return zeros(nbatch)
+
+        initial = self._flatten_pars(self.pars)
+        pvals = array(
+            [
+                broadcast_to(array(val, dtype=float).ravel(), (nbatch,))
+                for val in initial
+            ]
+        ).T
+        npars = pvals.shape[1]
+        # Parameters with one value per target, including fixed ones
+        self._update_chain(pvals)
+        self._batch_config = {
+            key: value for key, value in config.items() if _is_batched(value)
+        }
+
+        rows = arange(nbatch)
+        rvec = self._batch_residual(pvals, rows)
+        chi2 = einsum("ij,ij->i", rvec, rvec)
+        damping = full(nbatch, 1e-3)
+        done = zeros(nbatch, dtype=bool)
+        for _ in range(self.max_iterations):
+            active = flatnonzero(~done)
+            if len(active) == 0:
+                break
+            jac = self._batch_jacobian(pvals[active], rvec[active], active)
+            jtj = einsum("ijk,ijl->ikl", jac, jac)
+            jtr = einsum("ijk,ij->ik", jac, rvec[active])
+            scaling = diagonal(jtj, axis1=1, axis2=2).copy()
+            scaling[scaling <= 0] = 1
+            # Increase the damping of each target until its step reduces
+            # the residual or becomes negligible
+            pending = ones(len(active), dtype=bool)
+            for _ in range(10):
+                rows = active[pending]
+                lhs = jtj[pending] + damping[rows, newaxis, newaxis] * (
+                    scaling[pending, :, newaxis] * eye(npars)
+                )
+                step = -solve(lhs, jtr[pending, :, newaxis])[:, :, 0]
+                new_pvals = pvals[rows] + step
+                new_rvec = self._batch_residual(new_pvals, rows)
+                new_chi2 = einsum("ij,ij->i", new_rvec, new_rvec)
+
+                better = new_chi2 <= chi2[rows]
+                small_f = better & (
+                    chi2[rows] - new_chi2 <= self.tolerance * chi2[rows]
+                )
+                small_x = norm(step, axis=1) <= self.tolerance * (
+                    norm(pvals[rows], axis=1) + self.tolerance
+                )
+                accepted = rows[better]
+                pvals[accepted] = new_pvals[better]
+                rvec[accepted] = new_rvec[better]
+                chi2[accepted] = new_chi2[better]
+                damping[accepted] /= 10
+                damping[rows[~better]] *= 10
+                done[rows[small_f | small_x]] = True
+                pending[pending] = ~better & ~small_x
+                if not pending.any():
+                    break
+
+        self.converged = done
+        if not done.all():
+            warnings.warn(
+                f"Warning: Refinement of {nbatch - done.sum()} of {nbatch} "
+                "targets did not converge.",
+                UserWarning,
+            )
+
+        # Place the fit parameters of all targets in config
+        self._batch_residual(pvals, arange(nbatch))
+        return chi2
+
+
+# End class BatchRefiner
+
+
+def _is_batched(value):
+    """Check if a parameter value holds one value per target."""
+    if isinstance(value, dict):
+        return any(_is_batched(v) for v in value.values())
+    return getattr(value, "ndim", 0) > 1
+
+
+def _take_rows(value, rows):
+    """Select the rows of a parameter value that holds one value per
+    target."""
+    if isinstance(value, dict):
+        return {k: _take_rows(v, rows) for k, v in value.items()}
+    if getattr(value, "ndim", 0) > 1:
+        return value[rows]
+    return value
@@ -14,10 +14,13 @@
 ##############################################################################
 """Tools used in morphs and morph chains."""
 
+from contextlib import contextmanager
+from pathlib import Path
+
 import numpy
 
-from diffpy.utils.parsers import load_data
-from diffpy.utils.parsers.serialization import deserialize_data
+# Parsed files by path while a file cache is active, see file_cache
+_file_cache = None
 
 
 def estimate_scale(y_morph_in, y_target_in):
@@ -27,6 +30,36 @@ def estimate_scale(y_morph_in, y_target_in):
     return scale
 
 
+def estimate_scale_and_offset(y_morph_in, y_target_in, y_offset_in=None):
+    """Set the scale and offset that best match the morph to the target.
+
+    This solves the linear least squares problem
+    y_target_in = scale * y_morph_in + offset * y_offset_in.
+
+    Parameters
+    ----------
+    y_morph_in
+        The morph to be scaled.
+    y_target_in
+        The target.
+    y_offset_in
+        The response of the morph to a unit offset. If this is None
+        (default), then a constant vertical shift is used.
+
+    Returns
+    -------
+    scale, offset: float
+        The best scale and offset.
+    """
+    if y_offset_in is None:
+        y_offset_in = numpy.ones_like(y_morph_in)
+    basis = numpy.column_stack([y_morph_in, y_offset_in])
+    (scale, offset), _, _, _ = numpy.linalg.lstsq(
+        basis, y_target_in, rcond=None
+    )
+    return scale, offset
+
+
 def estimate_baseline_slope(r, gr, rmin=None, rmax=None):
     """Estimate the slope of the linear baseline of a PDF.
 
@@ -85,10 +118,18 @@ def estimate_baseline_slope(r, gr, rmin=None, rmax=None):
 
 
 def get_rw(chain):
-    """Get Rw from the outputs of a morph or chain."""
+    """Get Rw from the outputs of a morph or chain.
+
+    For a batch of functions, return an array with the Rw of each
+    function.
+    """
     # Make sure we put these on the proper grid
     x_morph, y_morph, x_target, y_target = chain.xyallout
     diff = y_target - y_morph
+    if diff.ndim > 1:
+        rw = numpy.sum(diff * diff, axis=-1)
+        rw /= numpy.sum(y_target * y_target, axis=-1)
+        return rw**0.5
     rw = numpy.dot(diff, diff)
     rw /= numpy.dot(y_target, y_target)
     rw = rw**0.5
@@ -99,10 +140,89 @@ def get_pearson(chain):
     from scipy.stats import pearsonr
 
     x_morph, y_morph, x_target, y_target = chain.xyallout
+    if numpy.ndim(y_morph) > 1 or numpy.ndim(y_target) > 1:
+        # One coefficient for each function of a batch
+        y_morph, y_target = numpy.broadcast_arrays(y_morph, y_target)
+        pcc, pval = pearsonr(y_morph, y_target, axis=-1)
+        return pcc
     pcc, pval = pearsonr(y_morph, y_target)
     return pcc
 
 
+def parse_scan(spec):
+    """Parse a grid of parameter values to scan.
+
+    Parameters
+    ----------
+    spec: str
+        Comma-separated entries NAME=START:STOP:NUM, for example
+        'stretch=-0.01:0.01:201,smear=0:0.2:101'. Each parameter takes NUM
+        equally spaced values from START to STOP inclusive.
+
+    Returns
+    -------
+    dict
+        The array of values of each parameter, in the order of spec.
+
+    Raises
+    ------
+    ValueError
+        spec is not of this form.
+    """
+
+    def values(start, stop, num):
+        values = numpy.linspace(float(start), float(stop), int(num))
+        if len(values) < 1:
+            raise ValueError
+        return values
+
+    return _parse_entries(spec, "scan", "NAME=START:STOP:NUM", values)
+
+
+def parse_ranges(spec):
+    """Parse ranges of parameter values.
+
+    Parameters
+    ----------
+    spec: str
+        Comma-separated entries NAME=LOWER:UPPER, for example
+        'stretch=-0.01:0.01,radius=5:20'.
+
+    Returns
+    -------
+    dict
+        The (lower, upper) range of each parameter, in the order of spec.
+
+    Raises
+    ------
+    ValueError
+        spec is not of this form.
+    """
+
+    def bounds(lower, upper):
+        return float(lower), float(upper)
+
+    return _parse_entries(spec, "range", "NAME=LOWER:UPPER", bounds)
+
+
+def _parse_entries(spec, kind, form, convert):
+    """Parse comma-separated NAME=A:B:... entries with convert(A, B,
+    ...)."""
+    parsed = {}
+    for entry in spec.split(","):
+        name, _, values = entry.partition("=")
+        name = name.strip()
+        try:
+            if not name or name in parsed:
+                raise ValueError
+            parsed[name] = convert(*values.split(":"))
+        except (TypeError, ValueError):
+            raise ValueError(
+                f"Invalid {kind} entry '{entry}'. Expected {form}."
+            )
+    return parsed
+
+
 def read_two_column(fname):
     """Reads a two-column data file, loads x and f(x) vectors.
 
@@ -116,12 +236,68 @@ def read_two_column(fname):
     x,fx
         Arrays read from data.
     """
-    rv = load_data(fname, unpack=True)
+    rv = load_file(fname)
     if len(rv) >= 2:
         return rv[:2]
     return (None, None)
 
 
+def load_file(fname, headers=False):
+    """Read a file with load_data of diffpy.utils.
+
+    The result is reused while a file_cache is active. It must not be
+    modified.
+
+    Parameters
+    ----------
+    fname
+        Name of the file we want to read.
+    headers: bool
+        Read the header values instead of the data columns.
+
+    Returns
+    -------
+    dict or numpy.ndarray
+        The header values, or the unpacked columns of the data block.
+    """
+    from diffpy.utils.parsers import load_data
+
+    path = Path(fname)
+    key = None
+    if _file_cache is not None and path.is_file():
+        stat = path.stat()
+        key = (path.resolve(), stat.st_mtime_ns, stat.st_size, headers)
+        if key in _file_cache:
+            return _file_cache[key]
+    if headers:
+        loaded = load_data(fname, headers=True)
+    else:
+        loaded = load_data(fname, unpack=True)
+    if key is not None:
+        _file_cache[key] = loaded
+    return loaded
+
+
+@contextmanager
+def file_cache():
+    """Reuse the files parsed by load_file within the context.
+
+    The header and the data of each file are then parsed once, however
+    often they are read, unless the file changes. The cache belongs to
+    the current process and is not shared with worker processes. The
+    cached files are released at the end of the outermost context.
+    """
+    global _file_cache
+    if _file_cache is not None:
+        yield
+        return
+    _file_cache = {}
+    try:
+        yield
+    finally:
+        _file_cache = None
+
+
 def nn_value(val, name):
     """Convenience function for ensuring certain non-negative inputs."""
     if val < 0:
@@ -147,6 +323,8 @@ def deserialize(serial_file):
     dict
         Data read from serial file.
     """
+    from diffpy.utils.parsers.serialization import deserialize_data
+
     return deserialize_data(serial_file)
 
 
@@ -200,11 +378,13 @@ def field_sort(
         Sorted list of paths. When get_fv is true, also return an associated
         field list.
     """
+    from diffpy.utils.parsers.serialization import deserialize_data
+
     # Get the field from each file
     files_field_values = []
     if serfile is None:
         for path in filepaths:
-            fhd = load_data(path, headers=True)
+            fhd = load_file(path, headers=True)
             files_field_values.append(
                 [path, case_insensitive_dictionary_search(field, fhd)]
             )
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# diffpy.morph      by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2010 Trustees of the Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE.txt for license information.
+#
+##############################################################################
+"""Trace -- record the trajectory of a refinement."""
+
+import time
+
+import numpy
+
+
+class Trace(object):
+    """Record the parameters, residual norm, Pearson coefficient and
+    elapsed time of each residual evaluation of a refinement.
+
+    Pass a Trace to Refiner.refine to record the evaluations of the
+    optimizer. A Trace can record several refinements in turn. The
+    records are kept in a preallocated array that doubles its capacity
+    when full.
+
+    Attributes
+    ----------
+    names: list
+        Names of the recorded parameters, in column order of values. The
+        values of a parameter with a dictionary of values, such as
+        squeeze, are named by the parameter and the key, e.g. "squeeze
+        a0".
+    """
+
+    # Columns of the records before the parameter values
+    _columns = ["time", "residual_norm", "pearson"]
+
+    def __init__(self, capacity=256):
+        self.names = []
+        self._parameters = []
+        self._data = numpy.empty((max(capacity, 1), len(self._columns)))
+        self._size = 0
+        self._start = None
+        return
+
+    def __len__(self):
+        return self._size
+
+    def add_parameters(self, parameters):
+        """Add columns for parameters that are not yet recorded.
+
+        Earlier records hold NaN as the values of the added parameters.
+
+        Parameters
+        ----------
+        parameters: list
+            The (name, key) of each parameter value, with key None for a
+            scalar parameter.
+        """
+        added = [par for par in parameters if par not in self._parameters]
+        if not added:
+            return
+        data = numpy.full(
+            (len(self._data), self._data.shape[1] + len(added)), numpy.nan
+        )
+        data[: self._size, : self._data.shape[1]] = self._data[: self._size]
+        self._data = data
+        self._parameters.extend(added)
+        self.names.extend(
+            name if key is None else f"{name} {key}" for name, key in added
+        )
+        return
+
+    def record(self, config, residual_norm, pearson):
+        """Record one evaluation.
+
+        Parameters
+        ----------
+        config: dict
+            The configuration holding the evaluated parameter values.
+        residual_norm: float
+            The norm of the residual vector.
+        pearson: float
+            The Pearson coefficient of the morphed and target functions.
+        """
+        if self._size == len(self._data):
+            data = numpy.empty((2 * len(self._data), self._data.shape[1]))
+            data[: self._size] = self._data[: self._size]
+            self._data = data
+        now = time.perf_counter()
+        if self._start is None:
+            self._start = now
+        row = self._data[self._size]
+        row[0] = now - self._start
+        row[1] = residual_norm
+        row[2] = pearson
+        for idx, (name, key) in enumerate(self._parameters, start=3):
+            value = config[name]
+            row[idx] = value if key is None else value[key]
+        self._size += 1
+        return
+
+    @property
+    def time(self):
+        """Seconds from the first recorded evaluation to each
+        evaluation."""
+        return self._data[: self._size, 0]
+
+    @property
+    def residual_norm(self):
+        """The norm of the residual vector of each evaluation."""
+        return self._data[: self._size, 1]
+
+    @property
+    def pearson(self):
+        """The Pearson coefficient of each evaluation."""
+        return self._data[: self._size, 2]
+
+    @property
+    def values(self):
+        """The parameter values of each evaluation, one column for each
+        of names."""
+        return self._data[: self._size, len(self._columns) :]
+
+    def as_dict(self):
+        """Get the records as a dictionary.
+
+        Returns
+        -------
+        dict
+            The arrays time, residual_norm, pearson and values, each with
+            one row per evaluation, and the list of parameter names.
+        """
+        return dict(
+            names=list(self.names),
+            time=self.time.copy(),
+            residual_norm=self.residual_norm.copy(),
+            pearson=self.pearson.copy(),
+            values=self.values.copy(),
+        )
+
+
+# End class Trace
@@ -3,7 +3,12 @@
 
 import numpy as np
 
-from diffpy.morph.morph_api import morph, morph_default_config
+from diffpy.morph.morph_api import (
+    morph,
+    morph_batch,
+    morph_default_config,
+    scan,
+)
 from tests.test_morphstretch import heaviside
 
 
@@ -82,6 +87,39 @@ def test_scale_with_morphfunc():
     assert np.allclose(scale, 1 / morphed_cfg["scale"], atol=1e-1)
 
 
+def test_fuse_maps_with_morphfunc():
+    x_target = np.linspace(0.5, 20, 1000)
+    y_target = 1.5 * np.sin(3 * x_target / 1.01)
+    x_morph = x_target.copy()
+    y_morph = np.sin(3 * x_morph)
+    cfg = morph_default_config(scale=1.0, stretch=0.0)
+    unfused = morph(x_morph, y_morph, x_target, y_target, **cfg)
+    fused = morph(x_morph, y_morph, x_target, y_target, fuse_maps=True, **cfg)
+    for name in ["scale", "stretch"]:
+        assert np.allclose(
+            fused["morphed_config"][name],
+            unfused["morphed_config"][name],
+            atol=1e-3,
+        )
+    # The returned chain holds the outputs of every morph
+    assert all(m.y_morph_out is not None for m in fused["morph_chain"])
+
+
+def test_fused_envelopes_with_morphfunc():
+    x_target = np.linspace(0.5, 20, 1000)
+    y_target = np.sin(3 * x_target)
+    x_morph = x_target.copy()
+    y_morph = y_target.copy()
+    cfg = morph_default_config(scale=1.5, qdamp=0.02)
+    morph_rv = morph(x_morph, y_morph, x_target, y_target, refine=False, **cfg)
+    chain = morph_rv["morph_chain"]
+    assert chain.fuse_envelopes
+    expected = 1.5 * y_morph * np.exp(-0.5 * (0.02 * x_morph) ** 2)
+    assert np.allclose(chain.y_morph_out, expected, rtol=0, atol=1e-15)
+    # The returned chain holds the outputs of every morph
+    assert np.allclose(chain[1].y_morph_out, 1.5 * y_morph)
+
+
 def test_smear_with_morph_func():
     # gaussian func
     sigma0 = 0.1
@@ -103,6 +141,34 @@ def test_smear_with_morph_func():
     assert np.allclose(smear, morphed_cfg["smear"], atol=1e-1)
 
 
+def test_bounded_smear_with_morph_func():
+    sigma0 = 0.1
+    smear = 0.15
+    sigbroad = (sigma0**2 + smear**2) ** 0.5
+    r0 = 7 * np.pi / 22.0 * 2
+    x_target = np.arange(0.01, 5, 0.01)
+    y_target = np.exp(-0.5 * ((x_target - r0) / sigbroad) ** 2)
+    x_morph = x_target.copy()
+    y_morph = np.exp(-0.5 * ((x_morph - r0) / sigma0) ** 2)
+    cfg = morph_default_config(smear=0.1, scale=1.1, stretch=0.1)
+    for optimizer in ["trf", "dogbox"]:
+        morph_rv = morph(
+            x_morph,
+            y_morph,
+            x_target,
+            y_target,
+            optimizer=optimizer,
+            bounds={"stretch": (-0.2, 0.2)},
+            **cfg,
+        )
+        morphed_cfg = morph_rv["morphed_config"]
+        x1, y1, x0, y0 = morph_rv["morph_chain"].xyallout
+        assert np.allclose(y0, y1, atol=1e-3)
+        assert np.allclose(smear, morphed_cfg["smear"], atol=1e-1)
+        assert morphed_cfg["smear"] >= 0
+        assert abs(morphed_cfg["stretch"]) <= 0.2
+
+
 def test_squeeze_with_morph_func():
     squeeze_init = {"a0": 0, "a1": -0.001, "a2": -0.0001, "a3": 0.0001}
     x_morph = np.linspace(0, 10, 101)
@@ -156,3 +222,92 @@ def test_funcy_with_morph_func():
     fitted_parameters = morphed_cfg["funcy"]
     assert np.allclose(fitted_parameters["scale"], 2, atol=1e-6)
     assert np.allclose(fitted_parameters["offset"], 0.4, atol=1e-6)
+
+
+def test_morph_batch_with_morphfunc():
+    lb, ub = 1, 2
+    x_target = np.arange(0.01, 5, 0.01)
+    x_morph = x_target.copy()
+    y_morph = heaviside(x_target, lb, ub)
+    # targets with different scale and smear
+    targets = []
+    for scale in [0.5, 1.0, 3.0]:
+        cfg = morph_default_config(scale=scale, smear=0.05)
+        morph_rv = morph(
+            x_morph, y_morph, x_target, y_morph, refine=False, **cfg
+        )
+        targets.append(morph_rv["morph_chain"].y_morph_out)
+    y_target = np.array(targets)
+
+    cfg = morph_default_config(scale=1.5, smear=0.1)  # off init
+    batch_rv = morph_batch(x_morph, y_morph, x_target, y_target, **cfg)
+    x1, y1, x0, y0 = batch_rv["morph_chain"].xyallout
+    assert y1.shape == y0.shape == (3, len(x0))
+    assert batch_rv["rw"].shape == (3,)
+    assert batch_rv["pcc"].shape == (3,)
+    # same result as morphing each target on its own
+    for idx in range(3):
+        morph_rv = morph(x_morph, y_morph, x_target, y_target[idx], **cfg)
+        morphed_cfg = morph_rv["morphed_config"]
+        batch_cfg = batch_rv["morphed_config"][idx]
+        for par in ["scale", "smear", "baselineslope"]:
+            assert np.allclose(batch_cfg[par], morphed_cfg[par], atol=1e-5)
+        assert np.allclose(batch_rv["rw"][idx], morph_rv["rw"], atol=1e-6)
+        assert np.allclose(y1[idx], morph_rv["morph_chain"].y_morph_out)
+
+
+def test_scan_with_morphfunc(tmp_path):
+    x_morph = np.linspace(0.01, 10, 1000)
+    y_morph = np.sin(3 * x_morph) * np.exp(-0.1 * x_morph)
+    x_target = x_morph.copy()
+    y_target = 1.5 * np.interp(x_morph / 1.004, x_morph, y_morph)
+    save = tmp_path / "scan.npz"
+    scan_rv = scan(
+        x_morph,
+        y_morph,
+        x_target,
+        y_target,
+        "scale=1:2:5,stretch=0:0.008:3",
+        xmin=1,
+        xmax=9,
+        save=save,
+    )
+    assert scan_rv["rw"].shape == scan_rv["pcc"].shape == (5, 3)
+    best = scan_rv["best_config"]
+    assert np.isclose(best["scale"], 1.5)
+    assert np.isclose(best["stretch"], 0.004)
+    assert np.isclose(np.nanmin(scan_rv["rw"]), 0, atol=1e-3)
+
+    saved = np.load(save)
+    assert list(saved["parameters"]) == ["scale", "stretch"]
+    assert np.allclose(saved["rw"], scan_rv["rw"])
+    assert np.allclose(saved["stretch"], scan_rv["grid"]["stretch"])
+
+
+def test_multistart_with_morphfunc():
+    x_morph = np.linspace(0.01, 10, 1000)
+    y_morph = np.sin(3 * x_morph) * np.exp(-0.1 * x_morph)
+    x_target = x_morph.copy()
+    y_target = 1.5 * np.interp(x_morph / 1.05, x_morph, y_morph)
+    cfg = morph_default_config(scale=1.0, stretch=-0.3)
+    morph_rv = morph(
+        x_morph, y_morph, x_target, y_target, xmin=1, xmax=9, **cfg
+    )
+    assert morph_rv["rw"] > 0.5
+    assert "minima" not in morph_rv
+
+    morph_rv = morph(
+        x_morph,
+        y_morph,
+        x_target,
+        y_target,
+        xmin=1,
+        xmax=9,
+        multistart="stretch=-0.1:0.1",
+        starts=4,
+        seed=0,
+        **cfg,
+    )
+    assert morph_rv["rw"] < 0.05
+    assert np.isclose(morph_rv["morphed_config"]["stretch"], 0.05, atol=1e-4)
+    assert len(morph_rv["minima"]) == 5
@@ -1,10 +1,16 @@
 #!/usr/bin/env python
 
+import multiprocessing
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 
 import numpy as np
 import pytest
 
+import diffpy.morph.morphapp as morphapp
 from diffpy.morph.morphapp import (
     create_option_parser,
     multiple_targets,
@@ -47,6 +53,29 @@ class TestApp:
             self.testfiles.append(testsequence_dir.joinpath(filename))
         return
 
+    def test_lazy_imports(self):
+        """Importing the app does not load the plotting, fitting and file
+        parsing modules."""
+        heavy = [
+            "matplotlib",
+            "scipy.fft",
+            "scipy.interpolate",
+            "scipy.optimize",
+            "scipy.stats",
+            "diffpy.utils.parsers",
+        ]
+        code = (
+            "import sys, diffpy.morph.morphapp, diffpy.morph.morph_api\n"
+            f"print([name for name in {heavy} if name in sys.modules])"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        assert result.stdout.strip() == "[]"
+
     def test_parser_numerical(self, setup_parser):
         renamed_dests = {"slope": "baselineslope"}
 
@@ -140,6 +169,14 @@ class TestApp:
             single_morph(self.parser, opts, pargs, stdout_flag=False)
         assert "xmin must be less than xmax" in str(excinfo.value)
 
+        # Make sure the number of evaluations is positive
+        opts, pargs = self.parser.parse_args(
+            [f"{nickel_PDF}", f"{nickel_PDF}", "--max-nfev", "0"]
+        )
+        with pytest.raises(ValueError) as excinfo:
+            single_morph(self.parser, opts, pargs, stdout_flag=False)
+        assert "--max-nfev must be a positive integer." in str(excinfo.value)
+
         # ###Tests exclusive to multiple morphs###
         # Make sure we save to a directory that exists
         # (user must create the directory if non-existing)
@@ -243,6 +280,36 @@ class TestApp:
             single_morph(self.parser, opts, pargs, stdout_flag=False)
         assert "a could not be converted to float." in str(excinfo.value)
 
+        # Number of parallel jobs must be positive
+        opts, pargs = self.parser.parse_args(
+            [f"{nickel_PDF}", f"{testsequence_dir}", "--jobs", "0"]
+        )
+        with pytest.raises(ValueError) as excinfo:
+            multiple_targets(self.parser, opts, pargs, stdout_flag=False)
+        assert "--jobs must be a positive integer." in str(excinfo.value)
+
+        # Malformed parameter scan
+        opts, pargs = self.parser.parse_args(
+            [f"{nickel_PDF}", f"{nickel_PDF}", "--scan", "stretch=0:1"]
+        )
+        with pytest.raises(ValueError) as excinfo:
+            single_morph(self.parser, opts, pargs, stdout_flag=False)
+        assert "Invalid scan entry 'stretch=0:1'." in str(excinfo.value)
+
+        # Number of multi-start starting points must be positive
+        opts, pargs = self.parser.parse_args(
+            [
+                f"{nickel_PDF}",
+                f"{nickel_PDF}",
+                "--stretch=0",
+                "--multistart=stretch=-0.01:0.01",
+                "--starts=0",
+            ]
+        )
+        with pytest.raises(ValueError) as excinfo:
+            single_morph(self.parser, opts, pargs, stdout_flag=False)
+        assert "--starts must be a positive integer." in str(excinfo.value)
+
     def test_morphsequence(self, setup_morphsequence):
         # Parse arguments sorting by field
         opts, pargs = self.parser.parse_args(
@@ -301,6 +368,236 @@ class TestApp:
         )
         assert s_sequence_results == sequence_results
 
+        # Check running the morphs in parallel produces the same result
+        opts, pargs = self.parser.parse_args(
+            [
+                "--scale",
+                "1",
+                "--stretch",
+                "0",
+                "-n",
+                "--sort-by",
+                "temperature",
+                "--jobs",
+                "2",
+            ]
+        )
+        pargs = [morph_file, testsequence_dir]
+        p_sequence_results = multiple_targets(
+            self.parser, opts, pargs, stdout_flag=False
+        )
+        assert p_sequence_results == sequence_results
+        assert list(p_sequence_results) == list(sequence_results)
+
+    def test_morphsequence_warm_start(self, setup_morphsequence):
+        morph_file = self.testfiles[0]
+        pargs = [morph_file, testsequence_dir]
+        args = [
+            "--scale",
+            "1",
+            "--stretch",
+            "0",
+            "-n",
+            "--sort-by",
+            "temperature",
+        ]
+        opts, _ = self.parser.parse_args(args)
+        cold_results = multiple_targets(
+            self.parser, opts, pargs, stdout_flag=False
+        )
+
+        # Warm start forwards, backwards and in both directions
+        for anchor_args in [
+            [],
+            ["--anchor", "b_204K.gr"],
+            ["--anchor", "d_192K.gr", "--jobs", "2"],
+        ]:
+            opts, _ = self.parser.parse_args(
+                args + ["--warm-start"] + anchor_args
+            )
+            warm_results = multiple_targets(
+                self.parser, opts, pargs, stdout_flag=False
+            )
+            assert list(warm_results) == list(cold_results)
+            for name in cold_results:
+                for param in ["scale", "stretch", "rw"]:
+                    assert warm_results[name][param] == pytest.approx(
+                        cold_results[name][param], rel=1e-4, abs=1e-6
+                    )
+
+        # Anchor must be one of the files being morphed
+        opts, _ = self.parser.parse_args(
+            args + ["--warm-start", "--anchor", "not_a_file.gr"]
+        )
+        with pytest.raises(FileNotFoundError) as excinfo:
+            multiple_targets(self.parser, opts, pargs, stdout_flag=False)
+        assert "is not in the directory." in str(excinfo.value)
+
+    def test_morphsequence_spawn(self, setup_morphsequence, monkeypatch):
+        """Worker processes do not rely on the state of the parent."""
+        morph_file = self.testfiles[0]
+        pargs = [morph_file, testsequence_dir]
+        args = ["--scale", "1", "--stretch", "0", "-n"]
+        opts, _ = self.parser.parse_args(args)
+        sequence_results = multiple_targets(
+            self.parser, opts, pargs, stdout_flag=False
+        )
+        monkeypatch.setattr(
+            morphapp,
+            "ProcessPoolExecutor",
+            partial(
+                ProcessPoolExecutor,
+                mp_context=multiprocessing.get_context("spawn"),
+            ),
+        )
+        for extra_args in [
+            ["--jobs", "2"],
+            ["--warm-start", "--anchor", "d_192K.gr", "--jobs", "2"],
+        ]:
+            opts, _ = self.parser.parse_args(args + extra_args)
+            p_sequence_results = multiple_targets(
+                self.parser, opts, pargs, stdout_flag=False
+            )
+            assert list(p_sequence_results) == list(sequence_results)
+            for name in sequence_results:
+                for param in ["scale", "stretch", "rw"]:
+                    assert p_sequence_results[name][param] == pytest.approx(
+                        sequence_results[name][param], rel=1e-4, abs=1e-6
+                    )
+
+        # Files parsed earlier are not read again
+        x, y = morphapp.get_two_column_from_file(morph_file)
+        missing_file = morph_file.with_name("missing.gr")
+        target_file = self.testfiles[1]
+        result = single_morph(
+            self.parser,
+            opts,
+            [missing_file, target_file],
+            stdout_flag=False,
+            tables={missing_file: (x, y)},
+        )[0]
+        expected = single_morph(
+            self.parser, opts, [morph_file, target_file], stdout_flag=False
+        )[0]
+        assert result == pytest.approx(expected)
+
+    def test_multiple_targets_grids(self, setup_parser, tmp_path):
+        """The chain reused across the targets does not keep the grid of
+        earlier targets."""
+
+        def gaussians(x, stretch):
+            centers = (1 + stretch) * np.array([3.0, 7.0, 12.0, 20.0])
+            return np.exp(-((x[:, None] - centers) ** 2) / 0.1).sum(axis=1)
+
+        x_morph = np.linspace(0.5, 25, 2451)
+        morph_file = tmp_path / "morph.gr"
+        np.savetxt(morph_file, np.array([x_morph, gaussians(x_morph, 0)]).T)
+        target_directory = tmp_path / "targets"
+        target_directory.mkdir()
+        for name, xmax in [("a.gr", 10), ("b.gr", 24), ("c.gr", 15)]:
+            x = np.linspace(0.5, xmax, 2001)
+            np.savetxt(
+                target_directory / name, np.array([x, gaussians(x, 0.01)]).T
+            )
+
+        args = ["--scale", "1", "--stretch", "0", "-n"]
+        opts, _ = self.parser.parse_args(args)
+        results = multiple_targets(
+            self.parser,
+            opts,
+            [morph_file, target_directory],
+            stdout_flag=False,
+        )
+        for name in ["a.gr", "b.gr", "c.gr"]:
+            expected = single_morph(
+                self.parser,
+                opts,
+                [morph_file, target_directory / name],
+                stdout_flag=False,
+            )[0]
+            for param in ["xmin", "xmax", "scale", "stretch", "rw"]:
+                assert results[name][param] == pytest.approx(expected[param])
+            assert results[name]["stretch"] == pytest.approx(0.01, abs=1e-4)
+
+    def test_fuse_maps(self, setup_parser, tmp_path):
+        x = np.linspace(0.5, 20, 1000)
+        morph_file = tmp_path / "morph.gr"
+        np.savetxt(morph_file, np.array([x, np.sin(3 * x)]).T)
+        target_file = tmp_path / "target.gr"
+        y_target = 1.5 * np.sin(3 * (x - 0.05) / 1.01) + 0.2
+        np.savetxt(target_file, np.array([x, y_target]).T)
+        args = ["--scale", "1", "--stretch", "0", "--hshift", "0"]
+        args += ["--vshift", "0", "--xmin", "1", "--xmax", "19", "-n"]
+        expected = dict(scale=1.5, stretch=0.01, hshift=0.05, vshift=0.2)
+        for fuse in [[], ["--fuse-maps"]]:
+            opts, pargs = self.parser.parse_args(
+                [str(morph_file), str(target_file)] + args + fuse
+            )
+            morph_info = single_morph(
+                self.parser, opts, pargs, stdout_flag=False
+            )[0]
+            for param, value in expected.items():
+                assert morph_info[param] == pytest.approx(value, abs=2e-3)
+
+    def test_profile(self, capsys, setup_parser):
+        morph_file = str(nickel_PDF)
+        target_file = str(testdata_dir.joinpath("nickel_ss0.02.cgr"))
+        opts, pargs = self.parser.parse_args(
+            [morph_file, target_file, "--scale", "1", "--smear", "0.1"]
+            + ["--profile", "-n"]
+        )
+        morph_info = single_morph(self.parser, opts, pargs, python_wrap=True)[
+            0
+        ]
+        out = capsys.readouterr().out
+        assert "# Profile:" in out
+        profile = morph_info["profile"]
+        assert profile["sections"]["file I/O"]["calls"] == 1
+        assert profile["sections"]["MorphSmear"]["calls"] > 0
+        assert profile["counts"]["nfev"] > 0
+
+        # Without --profile, nothing is recorded
+        opts, pargs = self.parser.parse_args(
+            [morph_file, target_file, "--scale", "1", "-n"]
+        )
+        morph_info = single_morph(
+            self.parser, opts, pargs, stdout_flag=False, python_wrap=True
+        )[0]
+        assert "profile" not in morph_info
+
+    def test_trace(self, setup_parser, tmp_path):
+        morph_file = str(nickel_PDF)
+        target_file = str(testdata_dir.joinpath("nickel_ss0.02.cgr"))
+        trace_file = tmp_path / "trace.npz"
+        opts, pargs = self.parser.parse_args(
+            [morph_file, target_file, "--scale", "1", "--smear", "0.1"]
+            + ["--stretch", "0", "--trace", str(trace_file), "-n"]
+        )
+        morph_info = single_morph(
+            self.parser, opts, pargs, stdout_flag=False, python_wrap=True
+        )[0]
+        trace = np.load(trace_file)
+        names = list(trace["parameters"])
+        assert sorted(names) == ["scale", "smear", "stretch"]
+        final = trace["values"][-1]
+        for name, value in zip(names, final):
+            assert value == pytest.approx(morph_info[name])
+        assert trace["pearson"][-1] == pytest.approx(
+            morph_info["pearson"], abs=1e-6
+        )
+
+        opts, pargs = self.parser.parse_args(
+            ["--multiple-targets", "--trace", str(trace_file)]
+        )
+        with pytest.raises(ValueError) as excinfo:
+            multiple_targets(
+                self.parser,
+                opts,
+                [morph_file, testsequence_dir],
+                stdout_flag=False,
+            )
+        assert "--trace is not supported" in str(excinfo.value)
+
     def test_morphsmear(self, setup_parser, tmp_path):
         def gaussian(x, mu, sigma):
             return np.exp(-((x - mu) ** 2) / (2 * sigma**2)) / (
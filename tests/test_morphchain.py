@@ -7,8 +7,18 @@ import numpy
 import pytest
 
 from diffpy.morph.morphs.morphchain import MorphChain
+from diffpy.morph.morphs.morphfuncy import MorphFuncy
+from diffpy.morph.morphs.morphishape import MorphISphere
+from diffpy.morph.morphs.morphresolution import MorphResolutionDamping
 from diffpy.morph.morphs.morphrgrid import MorphRGrid
 from diffpy.morph.morphs.morphscale import MorphScale
+from diffpy.morph.morphs.morphshape import MorphSphere, MorphSpheroid
+from diffpy.morph.morphs.morphshift import MorphShift
+from diffpy.morph.morphs.morphsmear import MorphSmear
+from diffpy.morph.morphs.morphsqueeze import MorphSqueeze
+from diffpy.morph.morphs.morphstretch import MorphStretch
+from diffpy.morph.profiler import Profiler
+from diffpy.morph.refine import Refiner
 
 # useful variables
 thisfile = locals().get("__file__", "file.py")
@@ -53,3 +63,304 @@ class TestMorphChain:
         pytest.approx(x_morph[1] - x_morph[0], mgrid.xstep)
         assert numpy.allclose(y_morph, y_target)
         return
+
+    def test_morph_batch(self, setup):
+        """Check MorphChain.morph() with a batch of functions."""
+        x = numpy.linspace(0.01, 10, 1000)
+        y_in = numpy.sin(3 * x) * numpy.exp(-0.1 * x)
+        y_targets = numpy.array([k * y_in for k in [1.0, 1.1, 0.9]])
+        batch_config = {
+            "xmin": 1,
+            "xmax": 9,
+            "xstep": None,
+            "scale": numpy.array([[1.0], [1.2], [0.8]]),
+            "stretch": numpy.array([[0.0], [0.01], [-0.02]]),
+            "smear": numpy.array([[0.1], [0.05], [0.2]]),
+            "hshift": numpy.array([[0.0], [0.1], [-0.05]]),
+            "vshift": 0.1,
+            "qdamp": numpy.array([[0.01], [0.02], [0.0]]),
+        }
+
+        def make_chain(config):
+            # MorphSmear is not batchable and is evaluated row by row
+            return MorphChain(
+                config,
+                MorphRGrid(),
+                MorphScale(),
+                MorphStretch(),
+                MorphSmear(),
+                MorphShift(),
+                MorphResolutionDamping(),
+            )
+
+        chain = make_chain(dict(batch_config))
+        x_morph, y_morph, x_target, y_target = chain(x, y_in, x, y_targets)
+        assert y_morph.shape == (3, len(x_morph))
+        assert y_target.shape == (3, len(x_target))
+
+        # Each row matches the morph of a single function
+        for idx in range(3):
+            config = {
+                key: value[idx, 0] if numpy.ndim(value) > 1 else value
+                for key, value in batch_config.items()
+            }
+            single = make_chain(config)(x, y_in, x, y_targets[idx])
+            assert numpy.allclose(single[0], x_morph)
+            assert numpy.allclose(single[1], y_morph[idx])
+            assert numpy.allclose(single[3], y_target[idx])
+        # Batched parameters are restored after row by row evaluation
+        assert chain.config["smear"].shape == (3, 1)
+        return
+
+    def test_morph_fused(self):
+        """Resample consecutive coordinate maps once."""
+        x = numpy.linspace(0, 30, 3001)
+
+        def func(r):
+            return numpy.sin(3 * r) * numpy.exp(-0.05 * r)
+
+        y = func(x)
+        config = {"scale": 1.3, "stretch": 0.02, "hshift": 0.0537}
+        config["vshift"] = 0.1
+        expected = 1.3 * func((x - 0.0537) / 1.02) + 0.1
+        sel = (x > 1) & (x < 29)
+
+        chain = MorphChain(config, MorphScale(), MorphStretch(), MorphShift())
+        xyall = chain(x, y, x, y)
+        infos = [m.extrapolation_info for m in chain]
+        chain.fuse_maps = True
+        xyfused = chain(x, y, x, y)
+        assert chain[1].y_morph_out is None
+        assert [m.extrapolation_info for m in chain] == infos
+        for arr, fused in zip(xyall, xyfused):
+            assert numpy.allclose(arr, fused, atol=1e-3)
+        # A single interpolation is more accurate
+        err = numpy.abs(xyall[1] - expected)[sel].max()
+        err_fused = numpy.abs(xyfused[1] - expected)[sel].max()
+        assert err_fused < err
+
+        # The intermediate outputs are available on request
+        chain.expand_fused()
+        stretched = numpy.interp(x / 1.02, x, 1.3 * y)
+        assert numpy.allclose(chain[1].y_morph_out, stretched)
+        assert numpy.array_equal(chain.y_morph_out, xyfused[1])
+        pars = [("stretch", None), ("hshift", None)]
+        dy = numpy.zeros((len(x), 2))
+        jac, _ = chain.jacobian(pars, dy, dy)
+        chain.fuse_maps = False
+        chain(x, y, x, y)
+        assert numpy.allclose(chain.jacobian(pars, dy, dy)[0], jac)
+
+        # Batches are fused too
+        batch_config = dict(config, stretch=numpy.array([[0.02], [0.01]]))
+        chain.config = batch_config
+        chain.fuse_maps = True
+        _, y_batch, _, _ = chain(x, y, x, y)
+        assert numpy.allclose(y_batch[0], xyfused[1])
+
+        # Coordinate maps are fused into the squeeze spline
+        config = {"squeeze": {"a0": 0.01, "a1": 0.01}, "stretch": 0.02}
+        chain = MorphChain(config, MorphSqueeze(), MorphStretch())
+        xyall = chain(x, y, x, y)
+        chain.fuse_maps = True
+        xyfused = chain(x, y, x, y)
+        expected = func((x / 1.02 - 0.01) / 1.01)
+        assert chain[0].y_morph_out is not None
+        assert numpy.allclose(xyfused[1], xyall[1], atol=1e-3)
+        err = numpy.abs(xyall[1] - expected)[sel].max()
+        err_fused = numpy.abs(xyfused[1] - expected)[sel].max()
+        assert err_fused < err
+
+    def test_morph_envelopes(self):
+        """Multiply consecutive envelopes into one output array."""
+        x = numpy.linspace(0, 30, 3001)
+        y = numpy.sin(3 * x)
+        config = {"scale": 1.3, "qdamp": 0.05, "iradius": 10.0}
+        config.update(radius=10.0, pradius=12.0)
+        chain = MorphChain(
+            config,
+            MorphScale(),
+            MorphResolutionDamping(),
+            MorphSpheroid(),
+            MorphISphere(),
+        )
+        xyall = chain(x, y, x, y)
+        chain.fuse_envelopes = True
+        xyfused = chain(x, y, x, y)
+        assert chain[1].y_morph_out is None
+        for arr, fused in zip(xyall, xyfused):
+            assert numpy.allclose(arr, fused, rtol=1e-13, atol=1e-13)
+        # The inverse sphere is zero beyond its diameter
+        assert numpy.all(xyfused[1][x >= 20] == 0)
+
+        chain.expand_fused()
+        damped = 1.3 * y * numpy.exp(-0.5 * (0.05 * x) ** 2)
+        assert numpy.allclose(chain[1].y_morph_out, damped)
+        assert numpy.array_equal(chain.y_morph_out, xyfused[1])
+        pars = [("qdamp", None), ("radius", None), ("iradius", None)]
+        dy = numpy.zeros((len(x), 3))
+        jac, _ = chain.jacobian(pars, dy, dy)
+        chain.fuse_envelopes = False
+        chain(x, y, x, y)
+        assert numpy.allclose(chain.jacobian(pars, dy, dy)[0], jac)
+
+        # Batches are fused when every envelope is batchable
+        batch_config = {"scale": numpy.array([[1.3], [0.5]]), "qdamp": 0.05}
+        chain = MorphChain(
+            batch_config, MorphScale(), MorphResolutionDamping()
+        )
+        chain.fuse_envelopes = True
+        _, y_batch, _, _ = chain(x, y, x, y)
+        assert chain[0].y_morph_out is None
+        assert y_batch.shape == (2, len(x))
+        assert numpy.allclose(y_batch[1], 0.5 / 1.3 * damped)
+
+    def test_morph_views(self):
+        """Pass unchanged arrays through as read-only views."""
+        x = numpy.linspace(0, 30, 301)
+        y = numpy.sin(x)
+        y_target = numpy.cos(x)
+        y_saved = y.copy()
+        config = {"scale": 1.3, "radius": 10.0, "iradius": 20.0}
+        chain = MorphChain(config, MorphScale(), MorphSphere(), MorphISphere())
+        x_morph, y_morph, x_target, y_target_out = chain(x, y, x, y_target)
+        for arr, arr_in in [(x_morph, x), (x_target, x)]:
+            assert numpy.shares_memory(arr, arr_in)
+        assert numpy.shares_memory(y_target_out, y_target)
+        for arr in (x_morph, x_target, y_target_out):
+            assert not arr.flags.writeable
+            with pytest.raises(ValueError):
+                arr[0] = 1
+        # The inputs are not modified
+        assert numpy.array_equal(y, y_saved)
+        assert y.flags.writeable
+        expected = 1.3 * y / (1 - 1.5 * x / 40 + 0.5 * (x / 40) ** 3)
+        expected *= numpy.where(
+            x < 20, 1 - 1.5 * x / 20 + 0.5 * (x / 20) ** 3, 0
+        )
+        assert numpy.allclose(y_morph, expected)
+
+    def test_morph_memoized(self):
+        """Only evaluate the morphs after a changed parameter."""
+        x = numpy.linspace(0, 30, 3001)
+        y = numpy.sin(3 * x)
+        config = {
+            "squeeze": {"a0": 0.01, "a1": 0.001},
+            "scale": 1.1,
+            "smear": 0.1,
+            "qdamp": 0.02,
+            "xmin": 1.0,
+            "xmax": 20.0,
+            "xstep": 0.02,
+        }
+        chain = MorphChain(
+            config,
+            MorphSqueeze(),
+            MorphScale(),
+            MorphSmear(),
+            MorphResolutionDamping(),
+            MorphRGrid(),
+        )
+        assert chain.memo_size == 0
+        chain.memo_size = 8
+        chain(x, y, x, y)
+        smeared = chain[2].y_morph_out
+        spline = chain[0].squeeze_spline
+        config["qdamp"] = 0.03
+        xyall = chain(x, y, x, y)
+        assert chain[0].squeeze_spline is spline
+        assert chain[2].y_morph_out is smeared
+        assert chain[3].y_morph_in is smeared
+
+        # Same result as evaluating every morph
+        chain.memo_size = 0
+        xyfull = chain(x, y, x, y)
+        assert chain[2].y_morph_out is not smeared
+        for arr, full in zip(xyall, xyfull):
+            assert numpy.array_equal(arr, full)
+
+        # Nested values are compared by value
+        chain.memo_size = 4
+        chain(x, y, x, y)
+        smeared = chain[2].y_morph_out
+        config["squeeze"]["a1"] = 0.002
+        chain(x, y, x, y)
+        assert chain[2].y_morph_out is not smeared
+        # Earlier evaluations are restored
+        config["squeeze"]["a1"] = 0.001
+        chain(x, y, x, y)
+        assert chain[2].y_morph_out is smeared
+        assert chain[0].squeeze_spline is spline
+        # Also when a morph was evaluated outside of the chain
+        chain[2](x, y, x, y)
+        xyall = chain(x, y, x, y)
+        assert chain[2].y_morph_in is chain[1].y_morph_out
+        assert chain[2].y_morph_out is smeared
+        assert numpy.array_equal(xyall[1], xyfull[1])
+
+        # Morphs calling user functions are always evaluated
+        calls = []
+
+        def funcy(x, y, a):
+            calls.append(a)
+            return a * y
+
+        config = {"funcy_function": funcy, "funcy": {"a": 2.0}}
+        chain = MorphChain(config, MorphFuncy())
+        chain.memo_size = 8
+        chain(x, y, x, y)
+        chain(x, y, x, y)
+        assert len(calls) == 2
+
+        # A Refiner keeps evaluations only while refining
+        config = {"scale": 1.0, "vshift": 0.0}
+        chain = MorphChain(config, MorphScale(), MorphShift())
+        chain.profile = Profiler()
+        refiner = Refiner(chain, x, y, x, 2 * y + 1)
+        refiner.analytic_jacobian = False
+        refiner.refine()
+        assert chain.profile.counts["MorphScale reused"] > 0
+        assert chain.memo_size == 0
+        assert chain._memo == {}
+
+    def test_evaluate_batch(self):
+        """Evaluate the residuals of many parameter sets at once."""
+        x = numpy.linspace(0, 20, 2001)
+        y = numpy.sin(3 * x) * numpy.exp(-0.1 * x)
+        y_target = 1.1 * numpy.sin(3 * x / 1.01)
+        config = {
+            "scale": 1.0,
+            "stretch": 0.0,
+            "squeeze": {"a0": 0.0, "a1": 0.0},
+            "radius": 15.0,
+        }
+        chain = MorphChain(
+            config, MorphSqueeze(), MorphScale(), MorphStretch(), MorphSphere()
+        )
+        rng = numpy.random.default_rng(0)
+        P = rng.uniform(0, 0.02, size=(5, 5))
+        P[:, 0] += 1
+        P[:, 4] += 15
+        rvec = chain.evaluate_batch(P, x, y, x, y_target)
+        assert rvec.shape == (5, len(x))
+        for pvals, rrow in zip(P, rvec):
+            chain.config.update(
+                scale=pvals[0],
+                stretch=pvals[1],
+                squeeze={"a0": pvals[2], "a1": pvals[3]},
+                radius=pvals[4],
+            )
+            _, y_morph_out, _, y_target_out = chain(x, y, x, y_target)
+            assert numpy.allclose(rrow, y_target_out - y_morph_out)
+
+        # The config is restored
+        assert config["stretch"] == pvals[1]
+        # Parameters can be chosen and ordered
+        rvec = chain.evaluate_batch(
+            P[:, :2], x, y, x, y_target, pars=["scale", "stretch"]
+        )
+        chain.config.update(scale=P[-1, 0], stretch=P[-1, 1])
+        _, y_morph_out, _, y_target_out = chain(x, y, x, y_target)
+        assert numpy.allclose(rvec[-1], y_target_out - y_morph_out)
+        with pytest.raises(ValueError):
+            chain.evaluate_batch(P, x, y, x, y_target, pars=["scale"])
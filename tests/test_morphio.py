@@ -462,7 +462,15 @@ class TestApp:
         )
 
         assert "uncertainties" in morph_info.keys()
-        params = ["funcy ay0", "funcy ay1", "funcx ax0", "funcx ax1"]
+        params = [
+            "squeeze a0",
+            "squeeze a1",
+            "squeeze a2",
+            "funcy ay0",
+            "funcy ay1",
+            "funcx ax0",
+            "funcx ax1",
+        ]
+        assert sorted(morph_info["uncertainties"].keys()) == sorted(params)
         for unc in morph_info["uncertainties"].keys():
-            assert unc in params
             assert morph_info["uncertainties"][unc] is not None
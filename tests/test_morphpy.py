@@ -6,7 +6,12 @@ import numpy as np
 import pytest
 
 from diffpy.morph.morphapp import create_option_parser, single_morph
-from diffpy.morph.morphpy import __get_morph_opts__, morph, morph_arrays
+from diffpy.morph.morphpy import (
+    MorphSession,
+    __get_morph_opts__,
+    morph,
+    morph_arrays,
+)
 from diffpy.morph.tools import get_rw
 
 thisfile = locals().get("__file__", "file.py")
@@ -197,6 +202,76 @@ class TestMorphpy:
                     morphapp_params[key], abs=1e-08
                 )
 
+    def test_morph_session(self, setup_morph):
+        session = MorphSession(scale=1, stretch=0, sort_by="temperature")
+        morph_file = self.testfiles[0]
+        for target_file in self.testfiles[1:]:
+            morph_info, table = session.morph(morph_file, target_file)
+            expected = self.morphapp_results[target_file.name]
+            assert morph_info.keys() == expected.keys()
+            for key in expected:
+                assert morph_info[key] == pytest.approx(
+                    expected[key], abs=1e-08
+                )
+            _, expected_table = morph(
+                morph_file, target_file, scale=1, stretch=0
+            )
+            assert np.allclose(table, expected_table)
+
+        # Each morph starts from the initial values of the session
+        def gaussian(x, mu, sigma):
+            return np.exp(-((x - mu) ** 2) / (2 * sigma**2)) / (
+                sigma * np.sqrt(2 * np.pi)
+            )
+
+        def gaussian_like_function(x, y, mu):
+            return gaussian((x + y) / 2, mu, 3)
+
+        r = np.linspace(0, 100, 1001)
+        morph_table = np.array([r, r]).T
+        target_table = np.array([r, 0.5 * gaussian(r, 50, 5) + 0.05]).T
+        kwargs = dict(
+            scale=1,
+            smear=3.75,
+            vshift=0.01,
+            funcy=(gaussian_like_function, {"mu": 47.5}),
+            tolerance=1e-12,
+        )
+        session = MorphSession(**kwargs)
+        expected, expected_table = morph_arrays(
+            morph_table, target_table, **kwargs
+        )
+        for _ in range(2):
+            morph_info, table = session.morph_arrays(morph_table, target_table)
+            assert pytest.approx(morph_info["scale"]) == expected["scale"]
+            assert pytest.approx(morph_info["smear"]) == expected["smear"]
+            assert morph_info["funcy"] == pytest.approx(expected["funcy"])
+            assert np.allclose(table, expected_table)
+        assert kwargs["funcy"][1] == {"mu": 47.5}
+
+        # A morph does not keep the grid of the previous morph
+        session = MorphSession(scale=1, stretch=0)
+        for xmax in [10, 20]:
+            x = np.linspace(0.5, xmax, 10 * xmax)
+            y = np.exp(-((x - 5) ** 2))
+            morph_info, _ = session.morph_arrays(
+                np.array([x, y]).T, np.array([x, 2 * y]).T
+            )
+            expected, _ = morph_arrays(
+                np.array([x, y]).T, np.array([x, 2 * y]).T, scale=1, stretch=0
+            )
+            assert morph_info["xmax"] == pytest.approx(expected["xmax"])
+            assert morph_info["scale"] == pytest.approx(2)
+
+        # The profile of a session accumulates over its morphs
+        session = MorphSession(scale=1, stretch=0, profile=True)
+        assert MorphSession(scale=1).profile is None
+        for target_file in self.testfiles[1:3]:
+            session.morph(morph_file, target_file)
+        session.profile.stop()
+        assert session.profile.sections["file I/O"][0] == 2
+        assert session.profile.counts["nfev"] > 0
+
     def test_exclude(self, setup_morph):
         morph_file = self.testfiles[0]
         target_file = self.testfiles[-1]
@@ -100,3 +100,52 @@ class TestMorphRGrid:
         pytest.approx(0.01, morph.xstep)
         self._runTests(xyallout, morph)
         return
+
+    def test_cached_plan(self, setup):
+        """Reuse the grid and the resampled target for the same
+        inputs."""
+        config = {"xmin": 1.0, "xmax": 4.0, "xstep": 0.015}
+        morph = MorphRGrid(config)
+        x_morph, y_morph, x_target, y_target = morph(
+            self.x_morph, self.y_morph, self.x_target, self.y_target
+        )
+        assert numpy.allclose(
+            y_morph, numpy.interp(x_morph, self.x_morph, self.y_morph)
+        )
+        assert numpy.allclose(
+            y_target, numpy.interp(x_target, self.x_target, self.y_target)
+        )
+        plan = morph._plan
+        xyallout = morph(
+            self.x_morph, 2 * self.y_morph, self.x_target, self.y_target
+        )
+        assert morph._plan is plan
+        assert xyallout[2] is x_target
+        assert xyallout[3] is y_target
+        assert numpy.allclose(xyallout[1], 2 * y_morph)
+
+        # A new grid for new inputs or config
+        morph(self.x_morph, self.y_morph, self.x_target, 2 * self.y_target)
+        assert morph._plan is not plan
+        plan = morph._plan
+        morph.xstep = 0.02
+        xyallout = morph(
+            self.x_morph, self.y_morph, self.x_target, 2 * self.y_target
+        )
+        assert morph._plan is not plan
+        assert pytest.approx(xyallout[0][1] - xyallout[0][0]) == 0.02
+        return
+
+    def test_shared_grid(self, setup):
+        """Pass the inputs through when they are on the output grid."""
+        morph = MorphRGrid({"xmin": None, "xmax": None, "xstep": None})
+        x_morph, y_morph, x_target, y_target = morph(
+            self.x_target, self.x_target, self.x_target, self.y_target
+        )
+        assert numpy.shares_memory(x_morph, self.x_target)
+        assert numpy.shares_memory(y_morph, self.x_target)
+        assert numpy.shares_memory(y_target, self.y_target)
+        assert numpy.array_equal(x_target, self.x_target)
+        dy = numpy.ones((len(self.x_target), 2))
+        assert morph.jacobian([], dy, dy)[0] is dy
+        return
@@ -6,6 +6,7 @@ import os
 import numpy
 import pytest
 
+import diffpy.morph.morphs.morphsmear as morphsmear
 from diffpy.morph.morphs.morphsmear import MorphSmear
 
 # useful variables
@@ -46,3 +47,101 @@ class TestMorphSmear:
 
         assert numpy.allclose(ysmear, y_morph)
         return
+
+    @pytest.mark.parametrize("smear", [0.02, 0.15, 2.0, -0.1])
+    def test_morph_convolution(self, setup, smear):
+        """Compare to the full convolution with the Gaussian."""
+        r = self.x_morph
+        rr = self.y_morph * r
+        r0 = r[len(r) // 2]
+        gaussian = numpy.exp(-0.5 * ((r - r0) / smear) ** 2)
+        c = numpy.convolve(rr, gaussian, mode="full")
+        x1 = numpy.arange(len(rr), dtype=float)
+        xc = numpy.arange(len(c), dtype=float)
+        shift = numpy.sum(c * xc) / numpy.sum(c) - numpy.sum(rr * x1) / sum(rr)
+        expected = numpy.interp(x1 + shift, xc, c) / numpy.sum(gaussian)
+
+        morph = MorphSmear({"smear": smear})
+        _, y_morph, _, _ = morph(r, rr, self.x_target, self.y_target)
+        assert numpy.allclose(y_morph, expected, rtol=0, atol=1e-12)
+
+    def test_kernel(self, setup):
+        """Check the direct and FFT convolutions and the kernel cache."""
+        morphsmear._kernel_cache.clear()
+        y = numpy.column_stack([self.y_morph, self.x_morph])
+        dr = 0.01
+        narrow = morphsmear._get_kernel(self.x_morph, 0.02)
+        wide = morphsmear._get_kernel(self.x_morph, 0.5)
+        assert narrow.nfft is None
+        assert wide.nfft is not None
+        assert morphsmear._get_kernel(self.x_morph, 0.5) is wide
+        assert len(morphsmear._kernel_cache) == 2
+
+        # The derivative kernel is transformed when first needed
+        assert wide._dkernel_fft is None
+        wide.convolve(y, derivative=True)
+        assert wide._dkernel_fft is not None
+
+        for smear, kernel in [(0.02, narrow), (0.5, wide)]:
+            # Smear each column alike
+            y_out = kernel.convolve(y)
+            for col in range(y.shape[1]):
+                assert numpy.allclose(
+                    y_out[:, col], kernel.convolve(y[:, col])
+                )
+
+            # The derivative kernel is the derivative of the kernel
+            delta = 1e-6
+            plus = morphsmear._SmearKernel(len(y), dr, smear + delta)
+            minus = morphsmear._SmearKernel(len(y), dr, smear - delta)
+            dy = (plus.convolve(y) - minus.convolve(y)) / (2 * delta)
+            assert numpy.allclose(
+                kernel.convolve(y, derivative=True), dy, atol=1e-6
+            )
+
+            # Disable the FFT
+            direct = morphsmear._SmearKernel(len(y), dr, smear)
+            direct.nfft = None
+            assert numpy.allclose(direct.convolve(y), y_out, atol=1e-12)
+
+    def test_kernel_cache(self, setup, monkeypatch):
+        """The cache drops the least recently used kernels beyond its
+        size in bytes."""
+        morphsmear._kernel_cache.clear()
+        first = morphsmear._get_kernel(self.x_morph, 0.5)
+        monkeypatch.setattr(morphsmear, "KERNEL_CACHE_BYTES", first.nbytes)
+        second = morphsmear._get_kernel(self.x_morph, 0.6)
+        assert list(morphsmear._kernel_cache.values()) == [second]
+        assert morphsmear._get_kernel(self.x_morph, 0.5) is not first
+
+    @pytest.mark.parametrize("smear", [0.02, 0.15])
+    def test_morph_uneven_grid(self, setup, smear):
+        """Smear with the sampled Gaussian on grids that are not equally
+        spaced."""
+        r = self.x_morph**1.2
+        rr = self.y_morph * r
+        r0 = r[len(r) // 2]
+        gaussian = numpy.exp(-0.5 * ((r - r0) / smear) ** 2)
+        c = numpy.convolve(rr, gaussian, mode="full")
+        x1 = numpy.arange(len(rr), dtype=float)
+        xc = numpy.arange(len(c), dtype=float)
+        shift = numpy.sum(c * xc) / numpy.sum(c) - numpy.sum(rr * x1) / sum(rr)
+        expected = numpy.interp(x1 + shift, xc, c) / numpy.sum(gaussian)
+
+        morph = MorphSmear({"smear": smear})
+        assert morphsmear._get_kernel(r, smear) is None
+        _, y_morph, _, _ = morph(r, rr, self.x_target, self.y_target)
+        assert numpy.allclose(y_morph, expected, rtol=0, atol=1e-10)
+
+        # The derivatives follow the sampled smear
+        dy_morph = numpy.column_stack([rr, numpy.zeros_like(rr)])
+        dy_out, _ = morph.jacobian(
+            [(None, None), ("smear", None)], dy_morph, None
+        )
+        assert numpy.allclose(dy_out[:, 0], y_morph)
+        delta = 1e-6
+        plus = morphsmear._smear_sampled(r, rr, smear + delta)
+        minus = morphsmear._smear_sampled(r, rr, smear - delta)
+        assert numpy.allclose(
+            dy_out[:, 1], (plus - minus) / (2 * delta), atol=1e-5
+        )
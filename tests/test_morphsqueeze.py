@@ -355,3 +355,43 @@ def test_handle_duplicates(x_sampled):
     y_target = np.array([y_sampled[x_sampled == x].mean() for x in x_target])
     assert np.allclose(x_handled, x_target)
     assert np.allclose(y_handled, y_target)
+
+
+def test_handle_duplicates_columns():
+    # Average each column of duplicated grid values
+    morph = MorphSqueeze()
+    x_sampled = np.array([0, 0, 1, 2, 2, 2, 3])
+    y_sampled = np.column_stack([np.sin(x_sampled), np.arange(7.0)])
+    x_handled, y_handled = morph._handle_duplicates(x_sampled, y_sampled)
+    assert np.allclose(x_handled, [0, 1, 2, 3])
+    assert np.allclose(y_handled[:, 0], np.sin([0, 1, 2, 3]))
+    assert np.allclose(y_handled[:, 1], [0.5, 2, 4, 6])
+
+
+def test_squeeze_spline_reuse():
+    x_morph = np.linspace(-1, 1, 101)
+    y_morph = np.sin(4 * x_morph)
+    morph = MorphSqueeze({"squeeze": {"a0": -1, "a1": -1, "a2": 2}})
+
+    # Sorting matches a stable sort of the squeezed grid
+    _, y_out, _, _ = morph(x_morph, y_morph, x_morph, y_morph)
+    assert not morph.strictly_increasing
+    x_squeezed = x_morph + Polynomial([-1, -1, 2])(x_morph)
+    order = np.argsort(x_squeezed, kind="stable")
+    x_sorted, y_sorted = morph._sort_squeeze(x_squeezed, y_morph)
+    assert np.array_equal(x_sorted, x_squeezed[order])
+    assert np.array_equal(y_sorted, y_morph[order])
+
+    # The spline is reused for the same squeeze and morph function
+    spline = morph.squeeze_spline
+    morph(x_morph, y_morph, x_morph, y_morph)
+    assert morph.squeeze_spline is spline
+    assert not morph.strictly_increasing
+    _, y_scaled, _, _ = morph(x_morph, 2 * y_morph, x_morph, y_morph)
+    assert morph.squeeze_spline is not spline
+    assert np.allclose(y_scaled, 2 * y_out)
+    spline = morph.squeeze_spline
+    morph.squeeze = {"a0": 0, "a1": 0.01, "a2": 0}
+    morph(x_morph, 2 * y_morph, x_morph, y_morph)
+    assert morph.squeeze_spline is not spline
+    assert morph.strictly_increasing
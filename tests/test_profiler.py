@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+
+import numpy
+import pytest
+
+from diffpy.morph.morphs.morphchain import MorphChain
+from diffpy.morph.morphs.morphrgrid import MorphRGrid
+from diffpy.morph.morphs.morphscale import MorphScale
+from diffpy.morph.morphs.morphsmear import MorphSmear
+from diffpy.morph.profiler import Profiler
+from diffpy.morph.refine import Refiner
+
+
+def test_profiler():
+    profile = Profiler(trace_memory=True)
+    with profile.section("outer"):
+        with profile.section("inner"):
+            data = numpy.ones(100000)
+        del data
+    profile.wrap("inner", sum)([1, 2])
+    profile.count("nfev", 3)
+    profile.stop()
+
+    calls, seconds, nbytes = profile.sections["inner"]
+    assert calls == 2
+    assert seconds > 0
+    # The array of 800 kB is allocated within both sections
+    assert nbytes >= 800000
+    assert profile.sections["outer"][1] >= profile.sections["inner"][1] / 2
+    assert profile.sections["outer"][2] >= 800000
+
+    other = Profiler()
+    with other.section("inner"):
+        pass
+    other.count("nfev")
+    profile.merge(other)
+    assert profile.sections["inner"][0] == 3
+    assert profile.as_dict()["counts"] == {"nfev": 4}
+    assert profile.as_dict()["sections"]["outer"]["calls"] == 1
+
+    summary = profile.summary().splitlines()
+    assert summary[0] == "# Profile:"
+    assert summary[1].split() == [
+        "#",
+        "section",
+        "calls",
+        "time",
+        "[ms]",
+        "alloc",
+        "[kB]",
+    ]
+    assert summary[-1] == "# nfev = 4"
+
+
+def test_profile_refinement():
+    x_morph = numpy.linspace(0.01, 10, 1000)
+    y_morph = numpy.sin(3 * x_morph) * numpy.exp(-0.1 * x_morph)
+    chain = MorphChain(
+        dict(xmin=1, xmax=9, xstep=None, scale=1.0, smear=0.1),
+        MorphRGrid(),
+        MorphScale(),
+        MorphSmear(),
+    )
+    chain.profile = Profiler()
+    refiner = Refiner(chain, x_morph, y_morph, x_morph, 2 * y_morph)
+    refiner.profile = chain.profile
+    refiner.refine("scale", "smear")
+    assert chain.scale == pytest.approx(2.0)
+
+    sections = chain.profile.sections
+    counts = chain.profile.counts
+    # The counts of the optimizer leave out the checks of the refiner
+    assert sections["residual"][0] >= counts["nfev"] > 0
+    assert sections["jacobian"][0] >= counts["njev"] > 0
+    assert sections["MorphSmear"][0] > 0
+    # The grid is not refined, such that its output is reused
+    assert counts["MorphRGrid reused"] > 0
+    # Each evaluation runs each morph once
+    assert sections["MorphScale"][0] == sections["MorphSmear"][0]
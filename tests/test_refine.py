@@ -11,11 +11,18 @@ from diffpy.morph.morph_helpers.transformrdftopdf import TransformXtalRDFtoPDF
 from diffpy.morph.morphapp import create_option_parser, single_morph
 from diffpy.morph.morphs.morphchain import MorphChain
 from diffpy.morph.morphs.morphfuncx import MorphFuncx
+from diffpy.morph.morphs.morphfuncy import MorphFuncy
+from diffpy.morph.morphs.morphishape import MorphISphere, MorphISpheroid
+from diffpy.morph.morphs.morphresolution import MorphResolutionDamping
 from diffpy.morph.morphs.morphrgrid import MorphRGrid
 from diffpy.morph.morphs.morphscale import MorphScale
+from diffpy.morph.morphs.morphshape import MorphSphere, MorphSpheroid
+from diffpy.morph.morphs.morphshift import MorphShift
 from diffpy.morph.morphs.morphsmear import MorphSmear
+from diffpy.morph.morphs.morphsqueeze import MorphSqueeze
 from diffpy.morph.morphs.morphstretch import MorphStretch
-from diffpy.morph.refine import Refiner
+from diffpy.morph.refine import BatchRefiner, Refiner
+from diffpy.morph.tools import get_pearson, get_rw, read_two_column
 
 # useful variables
 thisfile = locals().get("__file__", "file.py")
@@ -235,6 +242,503 @@ class TestRefine:
             single_morph(parser, opts, pargs, stdout_flag=False)
         assert expected_error_message in str(excinfo.value)
 
+    @pytest.mark.parametrize(
+        "morphs, config",
+        [
+            ([MorphScale], {"scale": 1.2}),
+            ([MorphStretch], {"stretch": 0.01}),
+            ([MorphShift], {"hshift": 0.1, "vshift": 0.2}),
+            ([MorphResolutionDamping], {"qdamp": 0.05}),
+            ([MorphSphere], {"radius": 15.0}),
+            ([MorphSpheroid], {"radius": 15.0, "pradius": 12.0}),
+            ([MorphISphere], {"iradius": 45.0}),
+            ([MorphISpheroid], {"iradius": 45.0, "ipradius": 50.0}),
+            ([MorphSmear], {"smear": 0.1}),
+            ([MorphSqueeze], {"squeeze": {"a0": 0.01, "a1": 0.005}}),
+            (
+                [
+                    MorphScale,
+                    TransformXtalPDFtoRDF,
+                    MorphSmear,
+                    TransformXtalRDFtoPDF,
+                    MorphShift,
+                ],
+                {
+                    "scale": 1.1,
+                    "smear": 0.1,
+                    "baselineslope": -0.5,
+                    "vshift": 0.1,
+                },
+            ),
+        ],
+    )
+    @pytest.mark.parametrize(
+        "residual", ["residual", "pearson", "add_pearson"]
+    )
+    def test_refine_jacobian(self, morphs, config, residual):
+        """Compare analytic derivatives to finite differences."""
+        x_morph = numpy.linspace(0.5, 20, 400)
+        y_morph = numpy.sin(3 * x_morph) * numpy.exp(-0.05 * x_morph)
+        x_target = numpy.linspace(0.3, 19, 300)
+        y_target = 1.5 * numpy.sin(3.1 * x_target)
+        config.update({"xmin": None, "xmax": None, "xstep": None})
+        refpars = [p for p in config if p not in ("xmin", "xmax", "xstep")]
+
+        chain = MorphChain(config, *[m() for m in morphs], MorphRGrid())
+        refiner = Refiner(chain, x_morph, y_morph, x_target, y_target)
+        refiner.residual = getattr(refiner, f"_{residual}")
+        initial = []
+        for p in refpars:
+            values = config[p] if isinstance(config[p], dict) else {None: 0}
+            for key in values:
+                refiner.flat_to_grouped[len(initial)] = (p, key)
+                initial.append(config[p] if key is None else config[p][key])
+        pvals = numpy.array(initial)
+
+        jacobian = refiner._get_jacobian()
+        assert jacobian is not None
+        jac = jacobian(pvals)
+        expected = numpy.zeros_like(jac)
+        for idx in range(len(pvals)):
+            step = numpy.zeros_like(pvals)
+            step[idx] = 1e-6 * max(1, abs(pvals[idx]))
+            expected[:, idx] = (
+                refiner.residual(pvals + step) - refiner.residual(pvals - step)
+            ) / (2 * step[idx])
+        atol = 1e-5 * max(abs(expected).max(), 1)
+        assert numpy.allclose(jac, expected, atol=atol)
+
+    def test_refine_jacobian_fallback(self, setup):
+        """Use finite differences when a morph has no derivatives."""
+        config = {
+            "funcy_function": lambda x, y, a: a * y,
+            "funcy": {"a": 1.0},
+            "scale": 1.0,
+        }
+        refiner = Refiner(
+            MorphChain(config, MorphScale()),
+            self.x_morph,
+            self.y_morph,
+            self.x_target,
+            self.y_target,
+        )
+        refiner.flat_to_grouped = {0: ("scale", None)}
+        assert refiner._get_jacobian() is not None
+        refiner.analytic_jacobian = False
+        assert refiner._get_jacobian() is None
+
+        chain = MorphChain(config, MorphFuncy(), MorphScale())
+        refiner = Refiner(
+            chain, self.x_morph, self.y_morph, self.x_target, self.y_target
+        )
+        refiner.flat_to_grouped = {0: ("scale", None)}
+        assert refiner._get_jacobian() is None
+        refiner.refine("funcy", "scale")
+        x_morph, y_morph, x_target, y_target = chain.xyallout
+        assert numpy.allclose(y_morph, y_target)
+
+    def test_refine_pearson_linear(self):
+        """The Pearson residual leaves scale and vshift in place."""
+        x_morph, y_morph = read_two_column(
+            os.path.join(testdata_dir, "squeeze_morph.cgr")
+        )
+        x_target, y_target = read_two_column(
+            os.path.join(testdata_dir, "ni_qmax25_psize35.cgr")
+        )
+        config = {"scale": 1.0, "vshift": 0.0}
+        config.update({"xmin": None, "xmax": None, "xstep": None})
+        chain = MorphChain(config, MorphScale(), MorphShift(), MorphRGrid())
+        refiner = Refiner(chain, x_morph, y_morph, x_target, y_target)
+        refiner.residual = refiner._pearson
+        refiner.refine("scale", "vshift")
+        assert config["scale"] == pytest.approx(1.0)
+        assert config["vshift"] == pytest.approx(0.0)
+
+    def test_refine_stationary_start(self):
+        """A refinement of smear leaves zero smear only if that helps."""
+        x = numpy.arange(0.01, 5, 0.01)
+        y = numpy.exp(-0.5 * ((x - 2.0) / 0.1) ** 2)
+        _, y_target, _, _ = MorphSmear({"smear": 0.2})(x, y, x, y)
+        pars = [("smear", None)]
+        smear = MorphSmear({"smear": 0.0})
+        assert smear.stationary_starts(pars, x) == {
+            "smear": pytest.approx(0.01)
+        }
+        assert smear.stationary_starts([("scale", None)], x) == {}
+        assert MorphScale({"scale": 0.0}).stationary_starts(pars, x) == {}
+
+        refiner = Refiner(smear, x, y, x, y_target)
+        refiner.refine("smear")
+        assert smear.smear == pytest.approx(0.2)
+
+        smear.smear = 0.0
+        refiner = Refiner(smear, x, y, x, y)
+        refiner.refine("smear")
+        assert smear.smear == 0.0
+
+    def test_refine_spheroid_from_sphere(self):
+        """A spheroid refined from a sphere reaches the target radii."""
+        x_morph, y_morph = read_two_column(
+            os.path.join(testdata_dir, "ni_qmax25.cgr")
+        )
+        x_target, y_target = read_two_column(
+            os.path.join(testdata_dir, "ni_qmax25_e17.5_p5.0.cgr")
+        )
+        config = {"radius": 10.0, "pradius": 10.0, "scale": 1.0}
+        config.update({"xmin": None, "xmax": None, "xstep": None})
+        chain = MorphChain(config, MorphSpheroid(), MorphScale(), MorphRGrid())
+        pars = [("radius", None), ("pradius", None)]
+        assert not chain.supports_jacobian(pars)
+        ispheroid = MorphISpheroid({"iradius": 10.0, "ipradius": 10.0})
+        assert not ispheroid.supports_jacobian([("iradius", None)])
+        refiner = Refiner(chain, x_morph, y_morph, x_target, y_target)
+        refiner.refine("radius", "pradius", "scale")
+        assert config["radius"] == pytest.approx(17.5, rel=1e-4)
+        assert config["pradius"] == pytest.approx(5.0, rel=1e-4)
+        assert get_rw(chain) == pytest.approx(0.0, abs=1e-6)
+        assert chain.supports_jacobian(pars)
+
+    @pytest.mark.parametrize("analytic_jacobian", [True, False])
+    def test_refine_separable(self, analytic_jacobian):
+        """Solve scale and vshift exactly during refinement."""
+        x_morph = numpy.linspace(0.5, 20, 400)
+        y_morph = numpy.sin(3 * x_morph) * numpy.exp(-0.05 * x_morph)
+        x_target = x_morph.copy()
+        y_target = 1.5 * numpy.interp(x_morph / 1.01, x_morph, y_morph)
+        y_target *= numpy.exp(-0.5 * (0.02 * x_morph) ** 2)
+        y_target += 0.2 * numpy.exp(-0.5 * (0.02 * x_morph) ** 2)
+
+        config = {"scale": 0.1, "stretch": 0.0, "vshift": -3.0, "qdamp": 0.01}
+        chain = MorphChain(config, MorphScale(), MorphStretch(), MorphShift())
+        chain.append(MorphResolutionDamping())
+        refiner = Refiner(chain, x_morph, y_morph, x_target, y_target)
+        refiner.analytic_jacobian = analytic_jacobian
+        res = refiner.refine(separable=True)
+        assert res < 1e-10
+        assert pytest.approx(config["scale"]) == 1.5
+        assert pytest.approx(config["stretch"]) == 0.01
+        assert pytest.approx(config["vshift"]) == 0.2
+        assert pytest.approx(abs(config["qdamp"])) == 0.02
+
+        # Polishing refines all parameters together from the solution
+        evaluations = refiner.cache_misses
+        config.update({"scale": 0.1, "stretch": 0.0, "vshift": -3.0})
+        config["qdamp"] = 0.01
+        res = refiner.refine(separable=True, polish=True)
+        assert res < 1e-10
+        assert pytest.approx(config["scale"]) == 1.5
+        assert refiner.cache_misses - evaluations > evaluations
+
+    def test_refine_cache(self, setup):
+        """Reuse chain evaluations for repeated parameter vectors."""
+        config = {"scale": 1.0}
+        mscale = MorphScale(config)
+        refiner = Refiner(
+            mscale, self.x_morph, self.y_morph, self.x_target, self.y_target
+        )
+        refiner.flat_to_grouped = {0: ("scale", None)}
+        pvals = numpy.array([2.0])
+
+        # Pearson and Rw share a single chain evaluation
+        refiner._add_pearson(pvals)
+        assert refiner.cache_misses == 1
+        assert refiner.cache_hits == 1
+        refiner._residual(numpy.array([1.5]))
+        rvec = refiner._residual(pvals)
+        assert refiner.cache_misses == 2
+        assert refiner.cache_hits == 2
+        assert numpy.allclose(rvec, self.y_target - 2 * self.y_morph)
+        assert config["scale"] == 2.0
+
+        # The cache is bounded
+        refiner.cache_size = 1
+        refiner._residual(numpy.array([1.0]))
+        refiner._residual(pvals)
+        assert refiner.cache_misses == 4
+        assert len(refiner._cache) == 1
+
+        # The morph holds the refined solution after refinement
+        refiner.refine()
+        assert pytest.approx(config["scale"]) == 3.0
+        assert numpy.allclose(mscale.y_morph_out, self.y_target)
+
+        # A change of the fixed configuration is not served from the cache
+        mshift = MorphShift({"scale": 1.0, "hshift": 0.0, "vshift": 0.0})
+        chain = MorphChain(mshift.config, MorphScale(), mshift)
+        refiner = Refiner(
+            chain, self.x_morph, self.y_morph, self.x_target, self.y_target
+        )
+        refiner.flat_to_grouped = {0: ("scale", None)}
+        refiner._residual(pvals)
+        chain.config["vshift"] = 1.0
+        rvec = refiner._residual(pvals)
+        assert refiner.cache_misses == 2
+        assert numpy.allclose(rvec, self.y_target - 2 * self.y_morph - 1)
+
+        # The fixed configuration is represented once per refinement
+        calls = []
+        fixed_config = refiner._fixed_config
+        refiner._fixed_config = lambda: calls.append(1) or fixed_config()
+        refiner.refine("scale")
+        assert len(calls) == 1
+        assert refiner.cache_misses > 2
+
+    @pytest.mark.parametrize("optimizer", ["leastsq", "trf", "dogbox"])
+    def test_refine_optimizer(self, optimizer):
+        """Refine with each optimizer backend."""
+        x_morph = numpy.linspace(0.5, 20, 400)
+        y_morph = numpy.sin(3 * x_morph) * numpy.exp(-0.05 * x_morph)
+        x_target = x_morph.copy()
+        y_target = 1.5 * numpy.interp(x_morph / 1.01, x_morph, y_morph)
+
+        config = {"scale": 1.0, "stretch": 0.0}
+        chain = MorphChain(config, MorphScale(), MorphStretch())
+        refiner = Refiner(chain, x_morph, y_morph, x_target, y_target)
+        refiner.optimizer = optimizer
+        unc = refiner.refine(estimate_uncertainty=True)
+        assert pytest.approx(config["scale"]) == 1.5
+        assert pytest.approx(config["stretch"]) == 0.01
+        assert set(unc) == {"scale", "stretch"}
+
+        # The evaluation budget is passed to the optimizer
+        config.update(scale=1.0, stretch=0.0)
+        refiner.max_nfev = 1
+        with pytest.raises(ValueError):
+            refiner.refine()
+
+    def test_refine_bounds(self, setup):
+        """Keep parameters within their bounds."""
+        config = {"scale": 1.0}
+        mscale = MorphScale(config)
+        refiner = Refiner(
+            mscale, self.x_morph, self.y_morph, self.x_target, self.y_target
+        )
+        refiner.bounds = {"scale": (0, 2)}
+        with pytest.raises(ValueError, match="trf or dogbox"):
+            refiner.refine()
+        refiner.optimizer = "trf"
+        refiner.refine()
+        assert pytest.approx(config["scale"]) == 2.0
+
+        # Smear is bounded below by zero by default
+        config = {"smear": 0.0}
+        refiner = Refiner(
+            MorphSmear(config),
+            self.x_morph,
+            self.y_morph,
+            self.x_target,
+            0 * self.y_target,
+        )
+        assert refiner.parameter_bounds["smear"] == (0, numpy.inf)
+        refiner.flat_to_grouped = {0: ("smear", None)}
+        lower, upper = refiner._flat_bounds(1)
+        assert lower[0] == 0 and upper[0] == numpy.inf
+
+        refiner.optimizer = "bfgs"
+        with pytest.raises(ValueError, match="Unknown optimizer"):
+            refiner.refine()
+
+    @pytest.mark.parametrize("analytic_jacobian", [True, False])
+    def test_refine_uncertainty(self, analytic_jacobian):
+        """Estimate uncertainties from the Jacobian at the solution."""
+        rng = numpy.random.default_rng(0)
+        x_morph = numpy.linspace(0.5, 20, 400)
+        y_morph = numpy.sin(3 * x_morph) * numpy.exp(-0.05 * x_morph)
+        x_target = x_morph.copy()
+        y_target = 1.5 * y_morph + 0.2 + 0.01 * rng.standard_normal(400)
+
+        config = {"scale": 1.0, "vshift": 0.0}
+        chain = MorphChain(config, MorphScale(), MorphShift())
+        refiner = Refiner(chain, x_morph, y_morph, x_target, y_target)
+        refiner.analytic_jacobian = analytic_jacobian
+        unc = refiner.refine("scale", "vshift", estimate_uncertainty=True)
+        assert refiner.rank == 2
+        assert refiner.degenerate_directions == []
+
+        # Linear model, so the covariance is known in closed form
+        design = numpy.column_stack([y_morph, numpy.ones_like(y_morph)])
+        res = y_target - design @ [config["scale"], config["vshift"]]
+        cov = numpy.linalg.inv(design.T @ design) * (res @ res) / 398
+        expected = numpy.sqrt(numpy.diag(cov))
+        assert numpy.allclose(
+            [unc["scale"], unc["vshift"]], expected, rtol=1e-4
+        )
+        assert numpy.allclose(
+            chain.xyallout[1], design @ list(config.values())
+        )
+
+        # hshift has no effect on a constant, so the problem is degenerate
+        config = {"scale": 1.0, "vshift": 0.0, "hshift": 0.0}
+        chain = MorphChain(config, MorphScale(), MorphShift())
+        x = numpy.arange(0.01, 5, 0.01)
+        refiner = Refiner(chain, x, numpy.ones_like(x), x, 3 + 0 * x)
+        refiner.analytic_jacobian = analytic_jacobian
+        with pytest.warns(UserWarning, match="degenerate directions"):
+            unc = refiner.refine(estimate_uncertainty=True)
+        assert set(unc) == {"scale", "vshift", "hshift"}
+        assert refiner.rank == 1
+        assert len(refiner.degenerate_directions) == 2
+        for direction in refiner.degenerate_directions:
+            assert abs(direction["scale"] + direction["vshift"]) < 1e-6
+
+    def test_refine_batch(self):
+        """Refine a chain against a batch of targets at once."""
+        x = numpy.linspace(0.01, 10, 1000)
+        y_morph = numpy.sin(3 * x) * numpy.exp(-0.1 * x)
+        scales = numpy.array([1.5, 0.8, 1.0, 2.0])
+        stretches = numpy.array([0.01, -0.005, 0.0, 0.002])
+        y_target = numpy.array(
+            [
+                scale * numpy.interp(x / (1 + stretch), x, y_morph)
+                for scale, stretch in zip(scales, stretches)
+            ]
+        )
+        config = {"xmin": 1, "xmax": 9, "xstep": None}
+        chain = MorphChain(config, MorphScale(), MorphStretch(), MorphRGrid())
+        refiner = BatchRefiner(chain, x, y_morph, x, y_target)
+        chi2 = refiner.refine("scale", "stretch", scale=1.0, stretch=0.001)
+
+        assert refiner.converged.all()
+        assert chi2.shape == (4,)
+        assert numpy.allclose(chi2, 0, atol=1e-12)
+        assert config["scale"].shape == (4, 1)
+        assert numpy.allclose(config["scale"][:, 0], scales)
+        assert numpy.allclose(config["stretch"][:, 0], stretches, atol=1e-8)
+        x_morph, y_morph_out, x_target, y_target_out = chain.xyallout
+        assert y_morph_out.shape == y_target_out.shape == (4, len(x_morph))
+        assert numpy.allclose(y_morph_out, y_target_out, atol=1e-6)
+
+        # Same solution as refining each target on its own
+        for idx in range(4):
+            single_config = {
+                "xmin": 1,
+                "xmax": 9,
+                "xstep": None,
+                "scale": 1.0,
+                "stretch": 0.001,
+            }
+            single_chain = MorphChain(
+                single_config, MorphScale(), MorphStretch(), MorphRGrid()
+            )
+            Refiner(single_chain, x, y_morph, x, y_target[idx]).refine(
+                "scale", "stretch"
+            )
+            assert single_config["scale"] == pytest.approx(
+                config["scale"][idx, 0]
+            )
+            assert single_config["stretch"] == pytest.approx(
+                config["stretch"][idx, 0], abs=1e-8
+            )
+
+    def test_refine_scan(self):
+        """Evaluate Rw and the Pearson coefficient on a parameter grid."""
+        x = numpy.linspace(0.01, 10, 1000)
+        y_morph = numpy.sin(3 * x) * numpy.exp(-0.1 * x)
+        y_target = 1.5 * numpy.interp(x / 1.004, x, y_morph)
+        config = {
+            "xmin": 1,
+            "xmax": 9,
+            "xstep": None,
+            "scale": 1.0,
+            "stretch": 0.0,
+        }
+        chain = MorphChain(config, MorphScale(), MorphStretch(), MorphRGrid())
+        refiner = Refiner(chain, x, y_morph, x, y_target)
+        grid = {
+            "scale": numpy.linspace(1, 2, 5),
+            "stretch": numpy.linspace(0, 0.008, 3),
+        }
+        rw, pcc = refiner.scan(grid, chunk_size=4)
+        assert rw.shape == pcc.shape == (5, 3)
+        assert numpy.unravel_index(numpy.argmin(rw), rw.shape) == (2, 1)
+        # the config is left unchanged
+        assert config["scale"] == 1.0 and config["stretch"] == 0.0
+
+        # Same values as evaluating each grid point on its own
+        for i, scale in enumerate(grid["scale"]):
+            for j, stretch in enumerate(grid["stretch"]):
+                single_config = dict(config, scale=scale, stretch=stretch)
+                single_chain = MorphChain(
+                    single_config, MorphScale(), MorphStretch(), MorphRGrid()
+                )
+                single_chain(x, y_morph, x, y_target)
+                assert rw[i, j] == pytest.approx(get_rw(single_chain))
+                assert pcc[i, j] == pytest.approx(get_pearson(single_chain))
+
+        # Chunks evaluated in other processes give the same result
+        rw_jobs, pcc_jobs = refiner.scan(grid, jobs=2)
+        assert numpy.allclose(rw_jobs, rw)
+        assert numpy.allclose(pcc_jobs, pcc)
+
+        with pytest.raises(ValueError, match="Cannot scan 'smear'"):
+            refiner.scan({"smear": numpy.linspace(0, 1, 3)})
+
+    @pytest.mark.parametrize("sampling", ["lhs", "sobol"])
+    def test_refine_multistart(self, sampling):
+        """Keep the best minimum of refinements from several starts."""
+        x = numpy.linspace(0.01, 10, 1000)
+        y_morph = numpy.sin(3 * x) * numpy.exp(-0.1 * x)
+        y_target = 1.5 * numpy.interp(x / 1.05, x, y_morph)
+        config = {
+            "xmin": 1,
+            "xmax": 9,
+            "xstep": None,
+            "scale": 1.0,
+            "stretch": -0.3,
+        }
+        chain = MorphChain(config, MorphScale(), MorphStretch(), MorphRGrid())
+        refiner = Refiner(chain, x, y_morph, x, y_target)
+        ranges = {"stretch": (-0.1, 0.1)}
+        chi2 = refiner.multistart(
+            ranges, "scale", "stretch", starts=4, sampling=sampling, seed=1
+        )
+        assert chi2 == pytest.approx(0, abs=1e-12)
+        assert config["scale"] == pytest.approx(1.5)
+        assert config["stretch"] == pytest.approx(0.05)
+
+        # The initial values and each start give a minimum
+        minima = refiner.minima
+        assert len(minima) == 5
+        assert [minimum["chi2"] for minimum in minima] == sorted(
+            minimum["chi2"] for minimum in minima
+        )
+        starts = [minimum["start"] for minimum in minima]
+        assert {} in starts
+        for start in starts:
+            assert set(start) <= {"stretch"}
+            assert -0.1 <= start.get("stretch", 0) <= 0.1
+        # A single refinement from -0.3 finds a local minimum
+        local = minima[starts.index({})]
+        assert local["rw"] > 0.5
+        assert local["config"]["stretch"] == pytest.approx(-0.3286, abs=1e-4)
+        # Minima outside of the bounds or no better than a vanishing morph
+        # are not physical
+        assert refiner._is_physical(local)
+        assert not refiner._is_physical(dict(local, rw=1.0))
+        unbound = dict(local, config={"scale": 1.0, "stretch": -1.5})
+        assert not refiner._is_physical(unbound)
+
+        # Starts refined in other processes give the same minima
+        config.update(scale=1.0, stretch=-0.3)
+        refiner.multistart(
+            ranges,
+            "scale",
+            "stretch",
+            starts=4,
+            sampling=sampling,
+            seed=1,
+            jobs=2,
+        )
+        assert [minimum["start"] for minimum in refiner.minima] == starts
+        assert config["stretch"] == pytest.approx(0.05)
+
+        with pytest.raises(ValueError, match="Unknown sampling"):
+            refiner.multistart(ranges, sampling="random")
+        with pytest.raises(ValueError, match="lower end"):
+            refiner.multistart({"stretch": (0.1, -0.1)})
+        with pytest.raises(ValueError, match="Cannot draw"):
+            refiner.multistart({"smear": (0, 1)})
+
 
 # End of class TestRefine
 
@@ -42,6 +42,23 @@ class TestTools:
         assert x, scale
         return
 
+    def test_estimate_scale_and_offset(self, setup):
+        """Check estimate_scale_and_offset() using calculated data."""
+        y_target = 1.7 * self.y_morph - 0.3
+        scale, offset = tools.estimate_scale_and_offset(self.y_morph, y_target)
+        assert pytest.approx(scale) == 1.7
+        assert pytest.approx(offset) == -0.3
+
+        # Offset with a non-constant response
+        y_offset = numpy.exp(-0.1 * self.x_morph)
+        y_target = 0.5 * self.y_morph + 2.0 * y_offset
+        scale, offset = tools.estimate_scale_and_offset(
+            self.y_morph, y_target, y_offset
+        )
+        assert pytest.approx(scale) == 0.5
+        assert pytest.approx(offset) == 2.0
+        return
+
     def test_nn_value(self, setup):
         import random
 
@@ -57,6 +74,24 @@ class TestTools:
             pytest.approx(tools.nn_value(value, name=None), abs(value))
             pytest.approx(tools.nn_value(-value, name=None), abs(-value))
 
+    def test_parse_scan(self):
+        grid = tools.parse_scan("stretch=-0.01:0.01:5, scale=0.9:1.1:3")
+        assert list(grid) == ["stretch", "scale"]
+        assert numpy.allclose(grid["stretch"], [-0.01, -0.005, 0, 0.005, 0.01])
+        assert numpy.allclose(grid["scale"], [0.9, 1.0, 1.1])
+
+        for spec in ["", "stretch=0:1", "stretch=0:1:a", "a=0:1:2,a=0:1:3"]:
+            with pytest.raises(ValueError, match="Invalid scan entry"):
+                tools.parse_scan(spec)
+
+    def test_parse_ranges(self):
+        ranges = tools.parse_ranges("stretch=-0.01:0.01, radius=5:20")
+        assert ranges == {"stretch": (-0.01, 0.01), "radius": (5, 20)}
+
+        for spec in ["", "stretch=0", "stretch=0:1:2", "a=0:1,a=1:2"]:
+            with pytest.raises(ValueError, match="Invalid range entry"):
+                tools.parse_ranges(spec)
+
     def test_field_sort(self, setup):
         sequence_files = [file for file in Path(testsequence_dir).iterdir()]
         to_remove = []
@@ -126,6 +161,40 @@ class TestTools:
         with pytest.raises(KeyError):
             tools.field_sort(path_sequence, "non_existing_field")
 
+    def test_load_file(self, tmp_path):
+        from diffpy.utils.parsers import load_data
+
+        filename = os.path.join(testsequence_dir, "a_210K.gr")
+        header = tools.load_file(filename, headers=True)
+        assert header == load_data(filename, headers=True)
+        assert header["temperature"] == 210
+        data = tools.load_file(filename)
+        assert numpy.array_equal(data, load_data(filename, unpack=True))
+        with pytest.raises(IOError):
+            tools.load_file(tmp_path / "missing.txt")
+
+        # Files are parsed once within a file cache, unless they change
+        data_file = tmp_path / "data.txt"
+        numpy.savetxt(
+            data_file, numpy.ones((20, 2)), header="T = 1", comments=""
+        )
+        assert tools.load_file(data_file) is not tools.load_file(data_file)
+        with tools.file_cache():
+            loaded = tools.load_file(data_file)
+            header = tools.load_file(data_file, headers=True)
+            assert tools.field_sort([data_file], "t") == [data_file]
+            assert tools.load_file(data_file, headers=True) is header
+            fx = tools.read_two_column(data_file)[1]
+            assert numpy.shares_memory(fx, loaded)
+            with tools.file_cache():
+                assert tools.load_file(data_file) is loaded
+            numpy.savetxt(
+                data_file, numpy.ones((20, 2)), header="T = 2", comments=""
+            )
+            os.utime(data_file, ns=(0, 0))
+            assert tools.load_file(data_file, headers=True) == {"T": 2}
+        assert tools.load_file(data_file) is not tools.load_file(data_file)
+
     def test_get_values_from_dictionary_collection(self):
         # Four dictionaries
         dict1 = {"target": "this"}
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+
+import numpy
+import pytest
+
+from diffpy.morph.morph_io import save_trace
+from diffpy.morph.morphs.morphchain import MorphChain
+from diffpy.morph.morphs.morphrgrid import MorphRGrid
+from diffpy.morph.morphs.morphscale import MorphScale
+from diffpy.morph.morphs.morphsqueeze import MorphSqueeze
+from diffpy.morph.refine import Refiner
+from diffpy.morph.trace import Trace
+
+
+def test_trace():
+    trace = Trace(capacity=2)
+    trace.add_parameters([("scale", None)])
+    for idx in range(5):
+        trace.record({"scale": float(idx)}, 2.0 * idx, 0.5)
+    trace.add_parameters([("scale", None), ("squeeze", "a0")])
+    trace.record({"scale": 5.0, "squeeze": {"a0": 0.1}}, 10.0, 0.9)
+
+    assert len(trace) == 6
+    assert trace.names == ["scale", "squeeze a0"]
+    assert numpy.allclose(trace.values[:, 0], range(6))
+    assert numpy.isnan(trace.values[:5, 1]).all()
+    assert trace.values[5, 1] == 0.1
+    assert numpy.allclose(trace.residual_norm, 2.0 * numpy.arange(6))
+    assert trace.pearson[-1] == 0.9
+    assert trace.time[0] == 0
+    assert (numpy.diff(trace.time) >= 0).all()
+    assert trace.as_dict()["values"].shape == (6, 2)
+
+
+@pytest.mark.parametrize("separable", [False, True])
+def test_refine_trace(tmp_path, separable):
+    x = numpy.linspace(0.01, 10, 1000)
+    y_morph = numpy.sin(3 * x) * numpy.exp(-0.1 * x)
+    y_target = 2 * numpy.sin(3 * (x + 0.01)) * numpy.exp(-0.1 * x)
+    config = dict(
+        xmin=1, xmax=9, xstep=None, scale=1.0, squeeze={"a0": 0.0, "a1": 0.0}
+    )
+    chain = MorphChain(config, MorphRGrid(), MorphSqueeze(), MorphScale())
+    refiner = Refiner(chain, x, y_morph, x, y_target)
+    trace = Trace()
+    chi2 = refiner.refine("squeeze", "scale", separable=separable, trace=trace)
+
+    assert trace.names == ["squeeze a0", "squeeze a1", "scale"]
+    # The last evaluation of the optimizer is at the solution
+    final = [config["squeeze"]["a0"], config["squeeze"]["a1"], config["scale"]]
+    assert numpy.allclose(trace.values[-1], final)
+    assert trace.residual_norm[-1] ** 2 == pytest.approx(chi2)
+    assert trace.residual_norm[0] > trace.residual_norm[-1]
+    assert trace.pearson[-1] == pytest.approx(1.0)
+
+    # A refinement without a trace is not recorded
+    nevals = len(trace)
+    refiner.refine("scale")
+    assert len(trace) == nevals
+
+    save_trace(tmp_path / "trace.csv", trace)
+    table = numpy.loadtxt(tmp_path / "trace.csv", delimiter=",", skiprows=1)
+    with open(tmp_path / "trace.csv") as f:
+        header = f.readline().strip()
+    assert header == (
+        "evaluation,time,residual_norm,pearson,squeeze a0,squeeze a1,scale"
+    )
+    assert numpy.allclose(table[:, 0], numpy.arange(nevals))
+    assert numpy.allclose(table[:, 4:], trace.values)
+
+    save_trace(tmp_path / "trace.npz", trace)
+    saved = numpy.load(tmp_path / "trace.npz")
+    assert list(saved["parameters"]) == trace.names
+    assert numpy.allclose(saved["residual_norm"], trace.residual_norm)
+    assert numpy.allclose(saved["values"], trace.values)